@@ -1,23 +1,860 @@
 #!/usr/bin/env python3
 
+import asyncio
+import concurrent.futures
 import getpass
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import socket
 import sys
 import time
 from datetime import datetime
-import subprocess
-from subprocess import PIPE, STDOUT
 
 import pexpect
 from pexpect import spawn
 
+from energy import EnergyLedger
+from events import EventLog
+from health import HEALTHY, PduHealth
+from history import PeakTracker, RingBuffer, format_duration
+from loads import OUTLETS, PHASES
+from metrics import Metrics
+from samplelog import SampleLog
+from scheduler import PollScheduler
+from topology import Topology
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+
+    try:
+        from cryptography.hazmat.decrepit.ciphers.modes import CFB
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.modes import CFB
+except ImportError:
+    # Only needed for SNMPv3 privacy (resetting the PDUs)
+    Cipher = None
+
+
+# ---------SNMP engine---------#
+# BER tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+# PDU types
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+RESPONSE = 0xA2
+SET_REQUEST = 0xA3
+TRAP_V1 = 0xA4
+GET_BULK_REQUEST = 0xA5
+INFORM_REQUEST = 0xA6
+TRAP_V2 = 0xA7
+REPORT = 0xA8
+# SNMPv3 message flags
+FLAG_AUTH = 0x01
+FLAG_PRIV = 0x02
+FLAG_REPORTABLE = 0x04
+USM_SECURITY_MODEL = 3
+# usmStatsNotInTimeWindows
+OID_NOT_IN_TIME_WINDOW = ".1.3.6.1.6.3.15.1.1.2.0"
+# usmStatsUnknownEngineIDs
+OID_UNKNOWN_ENGINE_ID = ".1.3.6.1.6.3.15.1.1.4.0"
+
+
+class SnmpError(Exception):
+    """Raised if an SNMP request could not be answered successfully."""
+
+
+class SnmpTimeout(SnmpError):
+    """Raised if an SNMP agent did not answer in time."""
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    raw = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(raw)]) + raw
+
+
+def encode_tlv(tag, payload):
+    return bytes([tag]) + encode_length(len(payload)) + payload
+
+
+def encode_integer(value, tag=INTEGER):
+    return encode_tlv(tag, value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True))
+
+
+def encode_octets(value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return encode_tlv(OCTET_STRING, bytes(value))
+
+
+def encode_oid(oid):
+    arcs = [int(arc) for arc in oid.strip(".").split(".")]
+    payload = bytearray()
+    # the first two arcs share one subidentifier, which exceeds a byte below arc 2
+    for arc in [40 * arcs[0] + arcs[1]] + arcs[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        payload.extend(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(payload))
+
+
+def encode_sequence(*items, tag=SEQUENCE):
+    return encode_tlv(tag, b"".join(items))
+
+
+def encode_value(value):
+    """
+    Encodes a python value as BER. Integers become INTEGER, strings and bytes OCTET STRING and
+    None NULL. Other application types can be given explicitly as (tag, value) tuple.
+    """
+    if isinstance(value, tuple):
+        tag, value = value
+        if tag in (INTEGER, COUNTER32, GAUGE32, TIMETICKS, COUNTER64):
+            return encode_integer(value, tag)
+        if tag == OBJECT_IDENTIFIER:
+            return encode_oid(value)
+        if tag == IP_ADDRESS:
+            return encode_tlv(tag, bytes(int(octet) for octet in value.split(".")))
+        if value is None:
+            return encode_tlv(tag, b"")
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        return encode_tlv(tag, bytes(value))
+    if value is None:
+        return encode_tlv(NULL, b"")
+    if isinstance(value, int):
+        return encode_integer(value)
+    return encode_octets(value)
+
+
+def encode_pdu(pdu_type, request_id, varbinds, error_status=0, error_index=0):
+    """
+    Encodes a PDU. For GETBULK requests, `error_status` and `error_index` are the
+    non-repeaters and max-repetitions fields.
+    """
+    return encode_sequence(
+        encode_integer(request_id),
+        encode_integer(error_status),
+        encode_integer(error_index),
+        encode_sequence(
+            *[encode_sequence(encode_oid(oid), encode_value(val)) for oid, val in varbinds]
+        ),
+        tag=pdu_type,
+    )
+
+
+def encode_message(community, pdu, version=1):
+    """Encodes an SNMPv1 (version=0) or SNMPv2c (version=1) message."""
+    return encode_sequence(encode_integer(version), encode_octets(community), pdu)
+
+
+def decode_tlv(data, pos=0):
+    """
+    Decodes the TLV starting at `pos`.
+
+    Returns
+    -------
+    (int, bytes, int)
+        tag, value and position of the next TLV
+    """
+    try:
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            num = length & 0x7F
+            length = int.from_bytes(data[pos : pos + num], "big")
+            pos += num
+    except IndexError:
+        raise SnmpError("Truncated BER data")
+    if pos + length > len(data):
+        raise SnmpError("Truncated BER data")
+    return tag, bytes(data[pos : pos + length]), pos + length
+
+
+def decode_sequence(data):
+    """
+    Decodes all TLVs inside a constructed value.
+
+    Returns
+    -------
+    [(int, bytes, bytes), ...]
+        tag, value and the raw encoding of each item
+    """
+    items = []
+    pos = 0
+    while pos < len(data):
+        tag, value, end = decode_tlv(data, pos)
+        items.append((tag, value, data[pos:end]))
+        pos = end
+    return items
+
+
+def decode_integer(data, signed=True):
+    return int.from_bytes(data, "big", signed=signed)
+
+
+def decode_oid(data):
+    if not data:
+        return ""
+    arcs = []
+    arc = 0
+    for byte in data:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    first = arcs[0]
+    arcs[:1] = divmod(first, 40) if first < 80 else (2, first - 80)
+    return "." + ".".join(str(a) for a in arcs)
+
+
+def decode_value(tag, data):
+    """
+    Converts a BER value into a python value. Exception values like noSuchObject are decoded
+    as None.
+    """
+    if tag == INTEGER:
+        return decode_integer(data)
+    if tag in (COUNTER32, GAUGE32, TIMETICKS, COUNTER64):
+        return decode_integer(data, signed=False)
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(data)
+    if tag == IP_ADDRESS:
+        return ".".join(str(octet) for octet in data)
+    if tag in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return None
+    return data
+
+
+def decode_pdu(data):
+    """
+    Decodes a complete PDU TLV.
+
+    Returns
+    -------
+    (int, int, int, int, [(string, object), ...])
+        PDU type, request ID, error status, error index and the variable bindings
+    """
+    pdu_type, body, _ = decode_tlv(data)
+    fields = decode_sequence(body)
+    if len(fields) != 4:
+        raise SnmpError("Malformed PDU")
+    return (
+        pdu_type,
+        decode_integer(fields[0][1]),
+        decode_integer(fields[1][1]),
+        decode_integer(fields[2][1]),
+        decode_varbinds(fields[3][1]),
+    )
+
+
+def decode_varbinds(data):
+    """
+    Decodes the content of a variable binding list into (oid, value) pairs.
+    """
+    varbinds = []
+    for _, vb, _ in decode_sequence(data):
+        (_, oid, _), (tag, value, _) = decode_sequence(vb)
+        varbinds.append((decode_oid(oid), decode_value(tag, value)))
+    return varbinds
+
+
+def password_to_key(password, engine_id):
+    """
+    Password to key algorithm of RFC 3414 (A.2.2) for SHA, localized for `engine_id`.
+    """
+    password = password.encode("utf-8")
+    if not password:
+        raise SnmpError("Empty SNMPv3 passphrase")
+    expanded = (password * (1048576 // len(password) + 1))[:1048576]
+    key = hashlib.sha1(expanded).digest()
+    return hashlib.sha1(key + engine_id + key).digest()
+
+
+def aes_cfb(key, iv, data, encrypt):
+    if Cipher is None:
+        raise SnmpError("SNMPv3 privacy requires the 'cryptography' package")
+    cipher = Cipher(algorithms.AES(key[:16]), CFB(iv))
+    ctx = cipher.encryptor() if encrypt else cipher.decryptor()
+    return ctx.update(data) + ctx.finalize()
+
+
+def encode_v3_message(
+    msg_id,
+    flags,
+    engine_id,
+    boots,
+    engine_time,
+    user,
+    scoped_pdu,
+    auth_key=None,
+    priv_key=None,
+    salt=0,
+):
+    """
+    Encodes an SNMPv3 USM message (HMAC-SHA-96 authentication, AES-128-CFB privacy).
+    `scoped_pdu` is the plaintext scoped PDU, keys must already be localized.
+    """
+    priv_params = b""
+    msg_data = scoped_pdu
+    if flags & FLAG_PRIV:
+        priv_params = salt.to_bytes(8, "big")
+        iv = boots.to_bytes(4, "big") + engine_time.to_bytes(4, "big") + priv_params
+        msg_data = encode_octets(aes_cfb(priv_key, iv, scoped_pdu, True))
+    priv_tlv = encode_octets(priv_params)
+    usm = encode_sequence(
+        encode_octets(engine_id),
+        encode_integer(boots),
+        encode_integer(engine_time),
+        encode_octets(user),
+        encode_octets(b"\x00" * 12 if flags & FLAG_AUTH else b""),
+        priv_tlv,
+    )
+    msg = encode_sequence(
+        encode_integer(3),
+        encode_sequence(
+            encode_integer(msg_id),
+            encode_integer(65507),
+            encode_octets(bytes([flags])),
+            encode_integer(USM_SECURITY_MODEL),
+        ),
+        encode_octets(usm),
+        msg_data,
+    )
+    if flags & FLAG_AUTH:
+        # authentication parameters are located right in front of the privacy parameters
+        offset = len(msg) - len(msg_data) - len(priv_tlv) - 12
+        mac = hmac.new(auth_key, msg, hashlib.sha1).digest()[:12]
+        msg = msg[:offset] + mac + msg[offset + 12 :]
+    return msg
+
+
+def encode_scoped_pdu(engine_id, pdu, context=b""):
+    return encode_sequence(encode_octets(engine_id), encode_octets(context), pdu)
+
+
+class V3Message(object):
+    """
+    Decoded SNMPv3 message. The scoped PDU stays encrypted until `scoped_pdu()` is called
+    with the localized privacy key.
+    """
+
+    __slots__ = (
+        "msg_id",
+        "flags",
+        "engine_id",
+        "boots",
+        "engine_time",
+        "user",
+        "auth_params",
+        "priv_params",
+        "msg_data",
+        "raw",
+        "auth_offset",
+    )
+
+    def __init__(self, data):
+        _, body, _ = decode_tlv(data)
+        items = decode_sequence(body)
+        if len(items) != 4 or decode_integer(items[0][1]) != 3:
+            raise SnmpError("Not an SNMPv3 message")
+        header = decode_sequence(items[1][1])
+        self.msg_id = decode_integer(header[0][1])
+        self.flags = header[2][1][0] if header[2][1] else 0
+        _, usm_body, _ = decode_tlv(items[2][1])
+        usm = decode_sequence(usm_body)
+        self.engine_id = usm[0][1]
+        self.boots = decode_integer(usm[1][1])
+        self.engine_time = decode_integer(usm[2][1])
+        self.user = usm[3][1]
+        self.auth_params = usm[4][1]
+        self.priv_params = usm[5][1]
+        self.msg_data = items[3][1] if items[3][0] == OCTET_STRING else items[3][2]
+        self.raw = data
+        self.auth_offset = len(data) - len(items[3][2]) - len(usm[5][2]) - len(self.auth_params)
+
+    def verify(self, auth_key):
+        """Checks the HMAC-SHA-96 of an authenticated message."""
+        if not self.flags & FLAG_AUTH or len(self.auth_params) != 12:
+            return False
+        end = self.auth_offset + 12
+        msg = self.raw[: self.auth_offset] + b"\x00" * 12 + self.raw[end:]
+        mac = hmac.new(auth_key, msg, hashlib.sha1).digest()[:12]
+        return hmac.compare_digest(mac, self.auth_params)
+
+    def scoped_pdu(self, priv_key=None):
+        """
+        Returns the (decrypted) scoped PDU.
+
+        Returns
+        -------
+        (bytes, bytes, bytes)
+            context engine ID, context name and the raw PDU
+        """
+        data = self.msg_data
+        if self.flags & FLAG_PRIV:
+            iv = (
+                self.boots.to_bytes(4, "big")
+                + self.engine_time.to_bytes(4, "big")
+                + self.priv_params
+            )
+            data = aes_cfb(priv_key, iv, data, False)
+        _, body, _ = decode_tlv(data)
+        items = decode_sequence(body)
+        return items[0][1], items[1][1], items[2][2]
+
+
+class UsmUser(object):
+    """
+    SNMPv3 user with SHA authentication and AES privacy. The keys localized to an engine
+    are cached, as localization hashes 1 MB per key.
+    """
+
+    __slots__ = ("name", "auth_pass", "priv_pass", "keys")
+
+    def __init__(self, name, auth_pass, priv_pass=None):
+        self.name = name
+        self.auth_pass = auth_pass
+        self.priv_pass = priv_pass if priv_pass else auth_pass
+        # engine ID -> future of (auth key, priv key)
+        self.keys = {}
+
+    async def localized_keys(self, engine_id):
+        """
+        Returns the authentication and privacy key localized to `engine_id`, computing them
+        in worker threads on first use. Concurrent callers share one computation.
+        """
+        keys = self.keys.get(engine_id)
+        if keys is None:
+            loop = asyncio.get_running_loop()
+            keys = self.keys[engine_id] = asyncio.gather(
+                loop.run_in_executor(None, password_to_key, self.auth_pass, engine_id),
+                loop.run_in_executor(None, password_to_key, self.priv_pass, engine_id),
+            )
+        try:
+            return tuple(await asyncio.shield(keys))
+        except Exception:
+            if self.keys.get(engine_id) is keys:
+                del self.keys[engine_id]
+            raise
+
+
+class V3Engine(object):
+    """
+    Authoritative engine of an SNMPv3 agent as learned by discovery. The engine time is
+    advanced locally, so requests need no discovery round-trip while it is cached.
+    """
+
+    __slots__ = ("engine_id", "boots", "engine_time", "synced")
+
+    def __init__(self, engine_id, boots, engine_time):
+        self.engine_id = engine_id
+        self.sync(boots, engine_time)
+
+    def sync(self, boots, engine_time):
+        self.boots = boots
+        self.engine_time = engine_time
+        self.synced = time.monotonic()
+
+    def now(self):
+        """
+        Returns the estimated current engine time of the agent.
+        """
+        return self.engine_time + int(time.monotonic() - self.synced)
+
+
+class _SnmpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.dispatch(data, addr)
+
+    def error_received(self, exc):
+        print("SNMP socket error: {}".format(exc), file=sys.stderr)
+
+
+class SnmpClient(object):
+    """
+    Asynchronous SNMP manager speaking SNMPv2c and SNMPv3 (USM) over a single UDP socket.
+    Responses are matched to the waiting requests by their request ID (message ID for v3).
+    """
+
+    def __init__(self, timeout=0.5, retries=1, metrics=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.metrics = metrics
+        self.transport = None
+        self.pending = {}
+        self.next_id = random.randint(1, 2**30)
+        self.salt = random.getrandbits(64)
+        # (host, port) -> future of the V3Engine of the agent
+        self.engines = {}
+
+    async def open(self):
+        if self.transport is None:
+            loop = asyncio.get_running_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _SnmpProtocol(self), local_addr=("0.0.0.0", 0)
+            )
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        for future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    def new_id(self):
+        self.next_id = self.next_id % 2**31 + 1
+        return self.next_id
+
+    def dispatch(self, data, addr):
+        """
+        Hands a received datagram to the request waiting for it.
+        """
+        try:
+            _, body, _ = decode_tlv(data)
+            version_tlv = decode_tlv(body)
+            if decode_integer(version_tlv[1]) == 3:
+                response = V3Message(data)
+                request_id = response.msg_id
+            else:
+                _, _, pos = decode_tlv(body, version_tlv[2])
+                response = decode_pdu(body[pos:])
+                request_id = response[1]
+        except (SnmpError, ValueError, IndexError):
+            print("Dropped malformed SNMP packet from {}.".format(addr[0]), file=sys.stderr)
+            return
+        future = self.pending.get(request_id)
+        if future is not None and not future.done():
+            future.set_result(response)
+
+    async def send(self, addr, request_id, data):
+        """
+        Sends `data` and waits for the response with `request_id`, retransmitting on timeout.
+        """
+        await self.open()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[request_id] = future
+        metrics = self.metrics
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt and metrics is not None:
+                    metrics.snmp_retransmits += 1
+                sent = loop.time()
+                self.transport.sendto(data, addr)
+                try:
+                    response = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if metrics is not None:
+                    metrics.snmp_rtt.observe(loop.time() - sent)
+                return response
+        finally:
+            del self.pending[request_id]
+            future.cancel()
+        if metrics is not None:
+            metrics.snmp_timeouts += 1
+        raise SnmpTimeout("No response from {}".format(addr[0]))
+
+    async def get(self, host, oids, auth="public", port=161):
+        """
+        Reads the given OIDs with a single GET request.
+
+        Parameters
+        ----------
+        host : string
+            address of the agent
+        oids : [string, ...]
+            OIDs to read
+        auth : string or UsmUser
+            community string for SNMPv2c or user for SNMPv3
+        port : int
+            UDP port of the agent
+
+        Returns
+        -------
+        [(string, object), ...]
+            variable bindings of the response
+        """
+        varbinds = await self.request(host, GET_REQUEST, [(oid, None) for oid in oids], auth, port)
+        for oid, value in varbinds:
+            if value is None:
+                raise SnmpError("No such object {} on {}".format(oid, host))
+        return varbinds
+
+    async def set(self, host, varbinds, auth="private", port=161):
+        """
+        Writes the given (oid, value) pairs with a single SET request.
+        """
+        return await self.request(host, SET_REQUEST, varbinds, auth, port)
+
+    async def walk(self, host, oids, auth="public", port=161, max_repetitions=25):
+        """
+        Reads the subtrees below the given OIDs, e.g. columns of a table, with GETBULK
+        requests. The subtrees are walked side by side, so a table of up to `max_repetitions`
+        rows takes a single request. A response the agent truncated to fit its message size
+        is continued with another request.
+
+        Returns
+        -------
+        {string: [(string, object), ...]}
+            (index, value) pairs of each subtree in order, the index being the OID suffix
+        """
+        result = {oid: [] for oid in oids}
+        cursors = {oid: oid for oid in oids}
+        while cursors:
+            roots = list(cursors)
+            varbinds = await self.request(
+                host,
+                GET_BULK_REQUEST,
+                [(cursors[root], None) for root in roots],
+                auth,
+                port,
+                0,
+                max_repetitions,
+            )
+            if not varbinds:
+                raise SnmpError("Empty GETBULK response from {}".format(host))
+            for i, (oid, value) in enumerate(varbinds):
+                root = roots[i % len(roots)]
+                if root not in cursors:
+                    continue
+                # endOfMibView, the end of the subtree or an agent not advancing
+                if value is None or not oid.startswith(root + ".") or oid == cursors[root]:
+                    del cursors[root]
+                    continue
+                result[root].append((oid[len(root) + 1 :], value))
+                cursors[root] = oid
+        return result
+
+    async def request(self, host, pdu_type, varbinds, auth="public", port=161, arg1=0, arg2=0):
+        """
+        Sends a request PDU and returns the variable bindings of the response.
+        """
+        addr = (host, port)
+        if isinstance(auth, UsmUser):
+            response = await self.request_v3(addr, pdu_type, varbinds, auth, arg1, arg2)
+        else:
+            request_id = self.new_id()
+            data = encode_message(auth, encode_pdu(pdu_type, request_id, varbinds, arg1, arg2))
+            response = await self.send(addr, request_id, data)
+        _, _, error_status, error_index, varbinds = response
+        if error_status != 0:
+            raise SnmpError(
+                "Agent {} returned error status {} (index {})".format(
+                    host, error_status, error_index
+                )
+            )
+        return varbinds
+
+    async def discover(self, addr):
+        """
+        Discovers the authoritative engine ID, boots and time of an SNMPv3 agent.
+        """
+        msg_id = self.new_id()
+        scoped = encode_scoped_pdu(b"", encode_pdu(GET_REQUEST, msg_id, []))
+        data = encode_v3_message(msg_id, FLAG_REPORTABLE, b"", 0, 0, b"", scoped)
+        response = await self.send(addr, msg_id, data)
+        if not response.engine_id:
+            raise SnmpError("Engine discovery failed for {}".format(addr[0]))
+        return response.engine_id, response.boots, response.engine_time
+
+    async def engine(self, addr):
+        """
+        Returns the engine of the agent at `addr`, discovering it only on first use.
+        Concurrent callers share one discovery.
+        """
+        engine = self.engines.get(addr)
+        if engine is None:
+            engine = self.engines[addr] = asyncio.ensure_future(self.discover_engine(addr))
+        try:
+            return await asyncio.shield(engine)
+        except Exception:
+            self.forget(addr, engine)
+            raise
+
+    async def discover_engine(self, addr):
+        return V3Engine(*await self.discover(addr))
+
+    def forget(self, addr, engine=None):
+        """
+        Drops the cached engine of the agent at `addr`, e.g. after it was replaced.
+        """
+        if engine is None or self.engines.get(addr) is engine:
+            self.engines.pop(addr, None)
+
+    async def request_v3(self, addr, pdu_type, varbinds, user, arg1=0, arg2=0):
+        """
+        Sends an authenticated and encrypted request. With the engine and the keys cached,
+        this takes a single round-trip.
+        """
+        engine = await self.engine(addr)
+        auth_key, priv_key = await user.localized_keys(engine.engine_id)
+        for _ in range(3):
+            msg_id = self.new_id()
+            self.salt = (self.salt + 1) % 2**64
+            scoped = encode_scoped_pdu(
+                engine.engine_id, encode_pdu(pdu_type, msg_id, varbinds, arg1, arg2)
+            )
+            data = encode_v3_message(
+                msg_id,
+                FLAG_AUTH | FLAG_PRIV | FLAG_REPORTABLE,
+                engine.engine_id,
+                engine.boots,
+                engine.now(),
+                user.name,
+                scoped,
+                auth_key,
+                priv_key,
+                self.salt,
+            )
+            response = await self.send(addr, msg_id, data)
+            if response.flags & FLAG_AUTH and not response.verify(auth_key):
+                raise SnmpError("Authentication of response from {} failed".format(addr[0]))
+            pdu = decode_pdu(response.scoped_pdu(priv_key)[2])
+            if pdu[0] != REPORT:
+                # Only reports may come unauthenticated, anything else could be spoofed
+                if response.flags & (FLAG_AUTH | FLAG_PRIV) != FLAG_AUTH | FLAG_PRIV:
+                    raise SnmpError("Unauthenticated response from {}".format(addr[0]))
+                engine.sync(response.boots, response.engine_time)
+                return pdu
+            report_oid = pdu[4][0][0] if pdu[4] else "?"
+            if report_oid == OID_NOT_IN_TIME_WINDOW:
+                # The agent rebooted or our clock drifted, resynchronize
+                engine.sync(response.boots, response.engine_time)
+            elif report_oid == OID_UNKNOWN_ENGINE_ID:
+                # The agent has a new engine ID, discover it again
+                self.forget(addr)
+                engine = await self.engine(addr)
+                auth_key, priv_key = await user.localized_keys(engine.engine_id)
+            else:
+                break
+        raise SnmpError("Agent {} sent report {}".format(addr[0], report_oid))
+
+
+class Sample(object):
+    """
+    Readings of one PDU taken with a single SNMP request. Power values are in W and None if
+    the PDU could not be read.
+    """
+
+    __slots__ = ("ip", "time", "current", "peak", "peak_date")
+
+    def __init__(self, ip, time, current=None, peak=None, peak_date=None):
+        self.ip = ip
+        self.time = time
+        self.current = current
+        self.peak = peak
+        self.peak_date = peak_date
+
+    @property
+    def ok(self):
+        return self.current is not None
+
+    def __repr__(self):
+        return "Sample({}, {}, {}, {}, {!r})".format(
+            self.ip, self.time, self.current, self.peak, self.peak_date
+        )
+
+
+async def read_power(snmp, host, port, community, oids):
+    """
+    Reads current power, peak power and peak timestamp of a PDU with one SNMPv2c request.
+
+    Parameters
+    ----------
+    snmp : SnmpClient
+        client sending the request
+    host, port, community : string, int, string
+        address and community of the PDU
+    oids : [string, ...]
+        OIDs of current power, peak power and peak timestamp
+
+    Returns
+    -------
+    (int, int, string)
+        current and peak power in W and the peak timestamp
+    """
+    varbinds = await snmp.get(host, oids, community, port)
+    current, peak, date = [value for _, value in varbinds]
+    return current * 10, peak * 10, date.decode("utf-8")
+
+
+def energy_text(meter):
+    """
+    Formats the energy of a meter with its mean power and gaps.
+    """
+    if meter is None or meter.seconds == 0:
+        return "no data"
+    out = "{:.3f} kWh, mean {:.0f} W".format(meter.kwh, meter.mean)
+    if meter.gap > 0:
+        out += ", {} without data".format(format_duration(round(meter.gap)))
+    return out
+
+
+def window_title(window):
+    start = datetime.fromtimestamp(window.start).strftime("%Y-%m-%d %H:%M:%S")
+    if window.running:
+        return "Window {} (since {})".format(window.name, start)
+    stop = datetime.fromtimestamp(window.stop).strftime("%H:%M:%S")
+    return "Window {} ({} - {})".format(window.name, start, stop)
+
+
+def literal_addresses(topology):
+    """
+    Returns the PDUs of `topology` given by a full IPv4 address, which need no lookup.
+    """
+    literals = {}
+    for ip, host in topology.hosts.items():
+        if host is None:
+            continue
+        try:
+            literals[ip] = str(ipaddress.IPv4Address(host))
+        except ValueError:
+            pass
+    return literals
+
 
 class Backend(object):
 
-    ips = []
-    ip_dict = {}
-    teams = {}
+    # PDUs, teams and chat IDs, replaced as a whole when a configuration file changes
+    topology = None
+    # network address -> IP as in ips.csv, for mapping traps to PDUs
+    addresses = {}
+    # IP address of every PDU given by its address in ips.csv, resolved when it is loaded.
+    # PDUs whose hostname could not be resolved are missing and count as failed reads.
+    resolved = {}
+    ips_path = "ips.csv"
+    access_path = "accesslist.conf"
+    keyboard = None
     team_peaks = {}
-    lngst_name = 0
     bot = None
 
     K_UP = "\x1b[A"
@@ -26,232 +863,1170 @@ class Backend(object):
     oid_peak = ".1.3.6.1.4.1.318.1.1.26.4.3.1.6.1"
     oid_peak_timestamp = ".1.3.6.1.4.1.318.1.1.26.4.3.1.7.1"
     oid_peak_reset = ".1.3.6.1.4.1.318.1.1.26.4.1.1.10.1"
-    oid_peak_reset_type = "i"
-    oid_peak_reset_val = "2"
-    snmp_timeout = "0.5"
+    oid_peak_reset_val = 2
+    # PDUs given by the last octet in ips.csv are addressed as subnet + last octet. The
+    # community and SNMPv3 user apply to PDUs without their own in ips.csv.
+    subnet = "192.168.1."
+    snmp_port = 161
+    snmp_community = "public"
+    snmpv3_user_name = "apc"
+    snmp_timeout = 0.5
+    snmp_retries = 1
+    snmp = None
+    # maximum number of PDUs queried at the same time
+    max_parallel = 32
+    poll_limit = None
+    # Number of worker processes polling a shard of the PDUs each, 0 polls in the bot process
+    poll_workers = 0
+    shards = None
+    # PDUs that missed the deadline of the last poll
+    skipped = set()
+    # phase and outlet tables of the PDUs by (table name, IP), walked on demand
+    loads = {}
+    bulk_repetitions = 25
+    # latest readings of all PDUs, refreshed by check_exceedings()
+    samples = {}
+    # time of the oldest reading in the snapshot
+    samples_time = 0.0
+    # decides which PDUs check_exceedings() polls
+    scheduler = None
+    # circuit breaker per PDU, state changes are reported by check_exceedings()
+    health = {}
+    health_events = []
+    probes = {}
+    # counters and histograms of the hot path, served by the metrics endpoint
+    metrics = None
+    # structured log of all exceedings, warnings, resets and PDU state changes
+    events = None
+    event_log_path = "events.jsonl"
+    # commands answer from the snapshot unless a reading is more than this many seconds past
+    # the next poll the scheduler planned for its PDU, phase and outlet tables are cached
+    # for this many seconds
+    max_sample_age = 5.0
+    refresh_lock = None
+    # power history of each PDU and team (24 h at a 2 s poll interval)
+    history_size = 43200
+    pdu_history = {}
+    team_history = {}
+    history_windows = [60, 600, 3600, 86400]
+    # Peaks tracked from the current power of every poll: since the last reset and over the
+    # last peak_window seconds. The limit checks use the larger of them and the peak registers
+    # of the PDUs, which also catch spikes between two polls. With software_peaks, /peaks and
+    # /peakdates answer from the tracked peaks instead of the registers.
+    software_peaks = False
+    peak_window = 600
+    peak_trackers = {}
+    # time of the last reset of every team, kept across restarts
+    reset_marks = {}
+    reset_marks_path = "resets.json"
+    # energy of every team in total and in named accounting windows, intervals without
+    # samples longer than energy_max_gap seconds are not integrated
+    energy = None
+    energy_path = "energy.json"
+    energy_max_gap = 60
+    # persistent log of all samples, reloaded into the history on startup
+    sample_log = None
+    sample_log_path = "samples.bin"
+    # seconds a logged sample is valid for point-in-time lookups
+    sample_log_tolerance = 60
+    # early warning if the power trend of the last trend_window seconds crosses the limit
+    # within trend_horizon seconds
+    trend_window = 30
+    trend_horizon = 60
+    team_warnings = {}
     # threshold power in Watt
     LIMIT = 6000
+    # ELinks sessions block, they run in these worker threads
+    reset_workers = 4
+    reset_executor = None
+    # PDUs reset at the same time and attempts per PDU
+    reset_parallel = 8
+    reset_attempts = 3
     # Password is set during initialization
     pwd = None
     snmpv3_auth_pass = None
     snmpv3_priv_pass = None
+    snmpv3_user = None
+    # all SNMPv3 users by name
+    usm_users = {}
 
-    def __init__(self, bot=None):
+    def __init__(self, bot=None, keyboard=None, auth_pass=None, priv_pass=None):
+        """
+        Reads the configuration and asks for the passphrases of every SNMPv3 user in it,
+        unless `auth_pass` and `priv_pass` are given, which then apply to all users.
+        """
         print("Initialize backend")
-        # Get password for Rack PDU for the duration of the runtime
-        self.snmpv3_auth_pass = getpass.getpass(
-            prompt="Enter SNMPv3 authentication passphrase for user 'apc': "
+        self.bot = bot
+        self.keyboard = keyboard
+        # Read in the IPs, team names and chat IDs
+        topology = Topology.load(self.ips_path, self.access_path, self.keyboard)
+        users = set(name for name in topology.users.values() if name is not None)
+        self.usm_users = {}
+        for name in [self.snmpv3_user_name] + sorted(users - {self.snmpv3_user_name}):
+            self.add_user(name, auth_pass, priv_pass)
+        self.snmpv3_user = self.usm_users[self.snmpv3_user_name]
+        self.snmpv3_auth_pass = self.snmpv3_user.auth_pass
+        self.snmpv3_priv_pass = self.snmpv3_user.priv_pass
+        self.metrics = Metrics()
+        self.snmp = SnmpClient(
+            timeout=self.snmp_timeout, retries=self.snmp_retries, metrics=self.metrics
         )
-        self.snmpv3_priv_pass = getpass.getpass(
-            prompt="Enter SNMPv3 privacy passphrase for user 'apc': "
+        self.poll_limit = asyncio.Semaphore(self.max_parallel)
+        self.refresh_lock = asyncio.Lock()
+        self.reset_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.reset_workers, thread_name_prefix="reset"
         )
+        self.reset_marks = self.load_reset_marks()
+        self.adopt(topology)
+        print("Successfully read in IP addresses and chat IDs!")
+        if self.poll_workers > 0:
+            # shards.py runs the backend's SNMP client in the workers and imports this module
+            from shards import ShardedPoller
+
+            self.shards = ShardedPoller(
+                self.poll_workers,
+                self.snmp_timeout,
+                self.snmp_retries,
+                self.max_parallel,
+                [self.oid_current, self.oid_peak, self.oid_peak_timestamp],
+            )
+        self.scheduler = PollScheduler(self)
+        self.events = EventLog(self.event_log_path)
+        self.sample_log = SampleLog(self.sample_log_path)
+        self.energy = EnergyLedger(self.energy_path, self.energy_max_gap)
+        self.reload_history()
+
+    def add_user(self, name, auth_pass=None, priv_pass=None):
+        """
+        Adds an SNMPv3 user, asking for its passphrases for the duration of the runtime
+        unless given.
+        """
+        if auth_pass is None:
+            auth_pass = getpass.getpass(
+                prompt="Enter SNMPv3 authentication passphrase for user '{}': ".format(name)
+            )
+            priv_pass = getpass.getpass(
+                prompt="Enter SNMPv3 privacy passphrase for user '{}': ".format(name)
+            )
         # if empty, set the same for privacy and authentication passphrase
-        if len(self.snmpv3_priv_pass) == 0:
-            self.snmpv3_priv_pass = self.snmpv3_auth_pass
-        self.bot = bot
-        # Read in the IPs and team names
-        with open("ips.csv", "r") as f:
-            for line in f:
-                ip, name, team = line.rstrip().split(",")
-                ip = int(ip)
-                self.ips.append(ip)
-                if self.teams.get(team):
-                    self.teams[team][ip] = name.strip()
-                else:
-                    self.teams[team] = {ip: name.strip()}
-                self.ip_dict[ip] = team
-                self.team_peaks[team] = 0
-                if len(team) > self.lngst_name:
-                    self.lngst_name = len(team)
-        print("Successfully read in IP addresses!")
+        self.usm_users[name] = UsmUser(name, auth_pass, priv_pass or auth_pass)
 
-    def current(self):
+    def close(self):
         """
-        Reads out the current power for each team and returns everything as a string
-        including a timestamp of the request.
+        Stops the poller workers.
+        """
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+
+    @property
+    def ips(self):
+        return self.topology.ips
+
+    @property
+    def ip_dict(self):
+        return self.topology.ip_dict
+
+    @property
+    def teams(self):
+        return self.topology.teams
+
+    @property
+    def lngst_name(self):
+        return self.topology.lngst_name
+
+    def adopt(self, topology, resolved=None):
+        """
+        Creates the history and health state of PDUs and teams new in `topology` and makes
+        it the current topology. The history and health of PDUs that were removed are kept,
+        so they are still there if the PDUs are added back, their readings are dropped.
+        `resolved` holds the IP address of every PDU given by its address in ips.csv, see
+        resolve(). Without it, only PDUs given by an IP address can be reached.
+        """
+        for ip in topology.ips:
+            if ip not in self.pdu_history:
+                self.pdu_history[ip] = RingBuffer(self.history_size)
+            if ip not in self.health:
+                self.health[ip] = PduHealth()
+        for team in topology.teams:
+            if team not in self.team_history:
+                self.team_history[team] = RingBuffer(self.history_size)
+                self.peak_trackers[team] = PeakTracker(
+                    self.peak_window, self.reset_marks.get(team, 0.0)
+                )
+            self.team_peaks.setdefault(team, 0)
+        self.resolved = literal_addresses(topology) if resolved is None else resolved
+        self.topology = topology
+        # Traps come from the IP address of a PDU, given by its hostname or not
+        addresses = {host: ip for ip, host in topology.hosts.items() if host is not None}
+        for ip in topology.ips:
+            if topology.hosts[ip] is None:
+                addresses[self.subnet + str(ip)] = ip
+            elif ip in self.resolved:
+                addresses[self.resolved[ip]] = ip
+        self.addresses = addresses
+        ip_dict = topology.ip_dict
+        self.samples = {ip: sample for ip, sample in self.samples.items() if ip in ip_dict}
+        self.loads = {key: table for key, table in self.loads.items() if key[1] in ip_dict}
+        self.skipped = {ip for ip in self.skipped if ip in ip_dict}
+        self.update_samples_time()
+
+    async def resolve(self, topology):
+        """
+        Resolves the hostnames of the PDUs in `topology` concurrently, without blocking the
+        event loop.
+
+        Returns
+        -------
+        {int: string}
+            IP address of every PDU given by its address in ips.csv, hostnames that could
+            not be resolved are left out
+        """
+        loop = asyncio.get_running_loop()
+        resolved = literal_addresses(topology)
+
+        async def lookup(ip, host):
+            try:
+                infos = await loop.getaddrinfo(
+                    host, self.snmp_port, family=socket.AF_INET, type=socket.SOCK_DGRAM
+                )
+                resolved[ip] = infos[0][4][0]
+            except OSError as e:
+                print("Could not resolve {}: {}".format(host, e), file=sys.stderr)
+
+        await asyncio.gather(
+            *[
+                lookup(ip, host)
+                for ip, host in topology.hosts.items()
+                if host is not None and ip not in resolved
+            ]
+        )
+        return resolved
+
+    async def resolve_hosts(self):
+        """
+        Resolves the hostnames of the current topology if one of them is not resolved yet,
+        e.g. at startup or after a failed lookup.
+        """
+        topology = self.topology
+        if any(host is not None and ip not in self.resolved for ip, host in topology.hosts.items()):
+            resolved = await self.resolve(topology)
+            if self.topology is topology:
+                self.adopt(topology, resolved)
+
+    async def reload_topology(self):
+        """
+        Reloads ips.csv and accesslist.conf if one of them changed since it was read. The new
+        topology replaces the old one in a single step, once its hostnames are resolved. If a
+        file cannot be read, the old topology stays in use. Hostnames that could not be
+        resolved before are tried again.
+
+        Returns
+        -------
+        bool
+            True if a new topology was loaded
+        """
+        try:
+            if Topology.modified(self.ips_path, self.access_path) == self.topology.mtimes:
+                await self.resolve_hosts()
+                return False
+            topology = Topology.load(self.ips_path, self.access_path, self.keyboard)
+            for name in topology.users.values():
+                if name is not None and name not in self.usm_users:
+                    raise ValueError("No passphrase for SNMPv3 user {}".format(name))
+        except (OSError, ValueError) as e:
+            print("Could not reload configuration: {}".format(e), file=sys.stderr)
+            return False
+        self.adopt(topology, await self.resolve(topology))
+        print(
+            "Reloaded configuration: {} PDUs, {} teams.".format(
+                len(topology.ips), len(topology.teams)
+            )
+        )
+        self.events.log("reload", ips=self.pdu_addresses(topology.ips), teams=len(topology.teams))
+        return True
+
+    def address(self, ip):
+        """
+        Returns the network address of the PDU given by ip: the IP address its address in
+        ips.csv resolved to when the configuration was loaded, or subnet + ip for a PDU given
+        by the last octet of its IP address.
+
+        Raises
+        ------
+        SnmpError
+            if the hostname of the PDU could not be resolved
+        """
+        host = self.topology.hosts.get(ip)
+        if host is None:
+            return self.subnet + str(ip)
+        address = self.resolved.get(ip)
+        if address is None:
+            raise SnmpError("Could not resolve {}".format(host))
+        return address
+
+    def community(self, ip):
+        community = self.topology.communities.get(ip)
+        return community if community is not None else self.snmp_community
+
+    def user(self, ip):
+        return self.usm_users[self.topology.users.get(ip) or self.snmpv3_user_name]
+
+    def pdu_label(self, ip):
+        return "{}({})".format(self.ip_dict.get(ip), self.topology.display.get(ip, ip))
+
+    def pdu_addresses(self, ips):
+        """
+        Returns the addresses of the given PDUs as written in ips.csv, for the event log.
+        """
+        display = self.topology.display
+        return [display.get(ip, str(ip)) for ip in ips]
+
+    async def sample(self, ip, now=None):
+        """
+        Reads current power, peak power and peak timestamp of the PDU given by ip with one
+        SNMPv2c request.
+
+        Parameters
+        ----------
+        ip : int
+            ID of the PDU
+        now : float
+            timestamp of the sample, defaults to the current time
+
+        Returns
+        -------
+        Sample
+            readings of the PDU, empty if it could not be read
+        """
+        if now is None:
+            now = time.time()
+        try:
+            reading = await read_power(
+                self.snmp,
+                self.address(ip),
+                self.snmp_port,
+                self.community(ip),
+                [self.oid_current, self.oid_peak, self.oid_peak_timestamp],
+            )
+            return Sample(ip, now, *reading)
+        except (SnmpError, TypeError, ValueError, AttributeError):
+            return Sample(ip, now)
+
+    async def poll(self, now=None, ips=None, deadline=None):
+        """
+        Samples the given PDUs (default: all) in parallel, at most `max_parallel` at a time.
+        A poll therefore takes about as long as the slowest PDU. All samples get the same
+        timestamp `now` (default: start of the poll). PDUs with an open circuit are skipped
+        and returned as unreadable. PDUs that have not answered by `deadline` (event loop
+        time) are cancelled: those already queried count as failed reads, those still
+        waiting for a free slot are left out of the result and remembered in `skipped`. With
+        `poll_workers`, the worker processes query the PDUs.
+
+        Returns
+        -------
+        {int: Sample}
+            readings for each IP
+        """
+        if now is None:
+            now = time.time()
+        if ips is None:
+            ips = self.ips
+        if self.shards is not None:
+            return await self.poll_shards(now, ips, deadline)
+
+        started = set()
+
+        async def sample_one(ip):
+            if not self.health[ip].available():
+                return Sample(ip, now)
+            async with self.poll_limit:
+                started.add(ip)
+                sample = await self.sample(ip, now)
+            self.update_health(sample)
+            return sample
+
+        tasks = [asyncio.ensure_future(sample_one(ip)) for ip in ips]
+        if deadline is None or not tasks:
+            self.skipped = set()
+            samples = await asyncio.gather(*tasks)
+            return {sample.ip: sample for sample in samples}
+        timeout = max(0.0, deadline - asyncio.get_running_loop().time())
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        samples = {}
+        self.skipped = set()
+        for ip, task in zip(ips, tasks):
+            if task not in pending:
+                samples[ip] = task.result()
+                continue
+            task.cancel()
+            if ip in started:
+                # Queried but no answer in time, as good as a timeout for the circuit breaker
+                samples[ip] = Sample(ip, now)
+                self.update_health(samples[ip])
+            else:
+                self.skipped.add(ip)
+        self.metrics.skipped_pdus += len(self.skipped)
+        return samples
+
+    async def poll_shards(self, now, ips, deadline=None):
+        """
+        Samples the given PDUs in the worker processes, see poll().
+        """
+        available = [ip for ip in ips if self.health[ip].available()]
+        unresolved = [
+            ip for ip in available if self.topology.hosts.get(ip) and ip not in self.resolved
+        ]
+        available = [ip for ip in available if ip not in unresolved]
+        readings = await self.shards.poll(
+            [(ip, self.address(ip), self.snmp_port, self.community(ip)) for ip in available],
+            deadline,
+        )
+        samples = {ip: Sample(ip, now) for ip in ips if not self.health[ip].available()}
+        for ip in unresolved:
+            samples[ip] = Sample(ip, now)
+            self.update_health(samples[ip])
+        for ip in available:
+            if ip in readings:
+                samples[ip] = Sample(ip, now, *readings[ip])
+                self.update_health(samples[ip])
+        self.skipped = set(available) - set(readings)
+        self.metrics.skipped_pdus += len(self.skipped)
+        return samples
+
+    def update_health(self, sample):
+        """
+        Feeds a sample into the circuit breaker of its PDU and queues a message if the PDU
+        went down or came back.
+        """
+        ip = sample.ip
+        team = self.ip_dict.get(ip)
+        label = self.pdu_label(ip)
+        health = self.health[ip]
+        if sample.ok:
+            if health.success(sample.time):
+                print("PDU of {} is reachable again.".format(label), file=sys.stderr)
+                self.events.log("reachable", team, self.pdu_addresses([ip]))
+                self.health_events.append("{}:\nPDU reachable again.".format(label))
+            return
+        if health.state == HEALTHY:
+            print("Could not read power values from {}.".format(label), file=sys.stderr)
+        if health.failure(time.time()):
+            print("PDU of {} is not reachable.".format(label), file=sys.stderr)
+            self.events.log("unreachable", team, self.pdu_addresses([ip]))
+            self.health_events.append("{}:\nPDU not reachable!".format(label))
+
+    def start_probes(self, now):
+        """
+        Probes PDUs with an open circuit whose backoff expired. The probes run as background
+        tasks and do not delay the poll cycle.
+        """
+        for ip in self.ips:
+            if self.health[ip].probe_due(now) and ip not in self.probes:
+                self.probes[ip] = asyncio.ensure_future(self.probe(ip))
+
+    async def probe(self, ip):
+        try:
+            async with self.poll_limit:
+                sample = await self.sample(ip)
+            self.update_health(sample)
+            if sample.ok and ip in self.ip_dict:
+                self.samples[ip] = sample
+        finally:
+            del self.probes[ip]
+
+    async def refresh(self, ips=None, max_age=0.0, deadline=None):
+        """
+        Polls the given PDUs (default: all) and updates their readings in the snapshot.
+        Concurrent calls are serialized, a caller waiting for a running poll reuses its
+        results if they are recent enough.
+
+        Parameters
+        ----------
+        ips : [int, ...]
+            PDUs to poll
+        max_age : float
+            do not poll a PDU again if its reading is not older than this (in seconds)
+        deadline : float
+            event loop time after which PDUs that have not answered are skipped
+
+        Returns
+        -------
+        {int: Sample}
+            readings for each IP
+        """
+        async with self.refresh_lock:
+            now = time.time()
+            stale = self.stale(now, max_age, self.ips if ips is None else ips)
+            if stale:
+                start = time.monotonic()
+                samples = await self.poll(now, stale, deadline)
+                self.metrics.poll_duration.observe(time.monotonic() - start)
+                self.metrics.polled_pdus += len(stale)
+                # PDUs removed by a reload during the poll are left out
+                samples = {ip: s for ip, s in samples.items() if ip in self.ip_dict}
+                self.samples.update(samples)
+                self.update_samples_time()
+                self.record(samples)
+        return self.samples
+
+    def update_samples_time(self):
+        """
+        Sets `samples_time` to the time of the oldest reading of the PDUs in the topology.
+        """
+        samples = self.samples
+        self.samples_time = min((samples[ip].time for ip in self.ips if ip in samples), default=0.0)
+
+    def stale(self, now, max_age, ips=None):
+        """
+        Returns the PDUs whose reading in the snapshot is older than `max_age` seconds.
+        """
+        return [
+            ip
+            for ip in (self.ips if ips is None else ips)
+            if ip not in self.samples or now - self.samples[ip].time > max_age
+        ]
+
+    def overdue(self, now):
+        """
+        Returns the PDUs whose reading in the snapshot is more than `max_sample_age` seconds
+        past their next scheduled poll. An idle PDU polled every 15 s is therefore fresh for
+        20 s, while the reading of a PDU polled every 0.5 s ages after 5.5 s.
+        """
+        next_due = self.scheduler.next_due
+        samples = self.samples
+        return [
+            ip
+            for ip in self.ips
+            if ip not in samples
+            or now - max(next_due.get(ip, 0.0), samples[ip].time) > self.max_sample_age
+        ]
+
+    async def snapshot(self, max_age=None):
+        """
+        Returns the latest readings without touching the PDUs. PDUs the limit checks have
+        fallen behind on (see overdue()), or with a reading older than `max_age` seconds if
+        given, are polled first.
+
+        Returns
+        -------
+        {int: Sample}
+            readings for each IP
+        """
+        now = time.time()
+        if max_age is None:
+            stale = self.overdue(now)
+            max_age = self.max_sample_age
+        else:
+            stale = self.stale(now, max_age)
+        if stale:
+            return await self.refresh(stale, max_age=max_age)
+        return self.samples
+
+    def record(self, samples, log=True):
+        """
+        Appends the readings of a poll to the power history and the tracked peaks of the PDUs
+        and teams and, if `log` is set, to the sample log.
+        """
+        for ip, sample in samples.items():
+            if sample.ok:
+                self.pdu_history[ip].append(sample.time, sample.current)
+        for team, ips in self.teams.items():
+            total = self.team_sum(team, samples)
+            if total >= 0:
+                timestamp = samples[next(iter(ips))].time
+                self.team_history[team].append(timestamp, total)
+                self.peak_trackers[team].append(timestamp, total)
+                self.energy.append(team, timestamp, total)
+        if log:
+            self.sample_log.append(
+                [(s.time, s.ip, s.current, s.peak) for s in samples.values() if s.ok]
+            )
+
+    def reload_history(self):
+        """
+        Refills the power history, the reported peaks and the energy of running accounting
+        windows from the sample log, so a restart of the bot loses none of them.
+        """
+        since = time.time() - self.history_windows[-1]
+        if self.energy.earliest_start() is not None:
+            since = min(since, self.energy.earliest_start())
+        samples = {}
+        # latest reading of every PDU, teams are polled at different times
+        latest = {}
+        count = 0
+        for t, ip, current, peak in self.sample_log.records(since):
+            if ip not in self.ip_dict:
+                continue
+            if samples and t != next(iter(samples.values())).time:
+                self.record(samples, log=False)
+                samples = {}
+            samples[ip] = latest[ip] = Sample(ip, t, current, peak)
+            count += 1
+        if samples:
+            self.record(samples, log=False)
+        # Teams already above the limit before the restart were reported already, unless
+        # they were reset since
+        for team in self.teams:
+            team_peak = self.team_peak(team, latest)
+            if team_peak > self.LIMIT:
+                self.team_peaks[team] = team_peak
+        print("Reloaded {} samples from {}.".format(count, self.sample_log_path))
+
+    def power_at(self, team, when):
+        """
+        Looks up the power of a team at a point in time in the sample log.
+
+        Parameters
+        ----------
+        team : string
+            team name
+        when : datetime
+            point in time
 
         Returns
         -------
         string
-            All current power values
+            power of the team at that time
         """
-        out = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\nCurrent power values:\n"
-        for team in sorted(self.teams.keys()):
-            team_power = 0
-            ip_list = ", ".join([str(ip) for ip in self.teams[team].keys()])
-            for ip in self.teams[team].keys():
-                sn = [
-                    "snmpget",
-                    "-v2c",
-                    "-t",
-                    self.snmp_timeout,
-                    "-cpublic",
-                    "192.168.1." + str(ip),
-                    self.oid_current,
-                ]
-                res = subprocess.run(sn, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-                if res.returncode != 0:
-                    print(
-                        "Could not read current power from " + str(team) + "(" + str(ip) + ").",
-                        file=sys.stderr,
-                    )
-                    team_power = -1
+        timestamp = when.timestamp()
+        out = "{} at {}:\n".format(self.topology.labels[team], when.strftime("%Y-%m-%d %H:%M:%S"))
+        found = {}
+        for t, ip, current, _ in self.sample_log.records_before(
+            timestamp, timestamp - self.sample_log_tolerance
+        ):
+            if ip in self.teams[team] and ip not in found:
+                found[ip] = (t, current)
+                if len(found) == len(self.teams[team]):
                     break
-                else:
-                    team_power += (
-                        int(res.stdout.decode("utf-8").replace("\n", "").split(":")[-1]) * 10
+        if len(found) < len(self.teams[team]):
+            return out + "No data recorded.\n"
+        sampled = datetime.fromtimestamp(min(t for t, _ in found.values()))
+        return out + "{} W (sampled {})\n".format(
+            sum(current for _, current in found.values()), sampled.strftime("%H:%M:%S")
+        )
+
+    def history(self, team):
+        """
+        Summarizes the recorded power of a team over several time windows.
+
+        Returns
+        -------
+        string
+            min, mean, 95th percentile and max power per window and mean power per PDU
+        """
+        now = time.time()
+        out = self.snapshot_date() + "\nPower history of {}:\n".format(self.topology.labels[team])
+        for window in self.history_windows:
+            stats = self.team_history[team].stats(now - window)
+            if stats is None:
+                out += "{}: no data\n".format(format_duration(window))
+                continue
+            out += "{}: min {} W, mean {:.0f} W, p95 {} W, max {} W\n".format(
+                format_duration(window), stats.min, stats.mean, stats.p95, stats.max
+            )
+        out += "Mean of last {} per PDU:\n".format(format_duration(self.history_windows[-1]))
+        display = self.topology.display
+        for ip, name in self.teams[team].items():
+            stats = self.pdu_history[ip].stats(now - self.history_windows[-1])
+            out += "    {}({}): {}\n".format(
+                name, display[ip], "no data" if stats is None else "{:.0f} W".format(stats.mean)
+            )
+        return out
+
+    def average(self, team, window):
+        """
+        Mean power of a team over the last `window` seconds.
+
+        Returns
+        -------
+        string
+            mean, min and max power of the window
+        """
+        stats = self.team_history[team].stats(time.time() - window)
+        out = self.snapshot_date() + "\n{} over the last {}:\n".format(
+            self.topology.labels[team], format_duration(window)
+        )
+        if stats is None:
+            return out + "No data recorded.\n"
+        return out + "Mean {:.0f} W (min {} W, max {} W, {} samples)\n".format(
+            stats.mean, stats.min, stats.max, stats.count
+        )
+
+    def energy_report(self, team=None):
+        """
+        Summarizes the energy of all teams, or of one team in every accounting window.
+
+        Returns
+        -------
+        string
+            energy in kWh since the first sample and per window
+        """
+        energy = self.energy
+        topology = self.topology
+        if energy.since is None:
+            return "No energy recorded yet.\n"
+        since = datetime.fromtimestamp(energy.since).strftime("%Y-%m-%d %H:%M:%S")
+        out = self.snapshot_date() + "\n"
+        if team is None:
+            windows = [w for w in energy.windows if w.running] or energy.windows[-1:]
+            out += "Energy since {}:\n".format(since)
+            for name in topology.team_order:
+                out += "{}: {}\n".format(
+                    topology.padded_labels[name], energy_text(energy.totals.get(name))
+                )
+            for window in windows:
+                out += "{}:\n".format(window_title(window))
+                for name in topology.team_order:
+                    out += "{}: {}\n".format(
+                        topology.padded_labels[name], energy_text(window.meters.get(name))
                     )
-            out += "{}({}): {} W\n".format(team.ljust(self.lngst_name), ip_list, team_power)
+            return out
+        out += "Energy of {}:\n".format(topology.labels[team])
+        out += "Since {}: {}\n".format(since, energy_text(energy.totals.get(team)))
+        for window in reversed(energy.windows):
+            out += "{}: {}\n".format(window_title(window), energy_text(window.meters.get(team)))
+        return out
+
+    def start_energy_window(self, name):
+        """
+        Starts the accounting window `name`.
+
+        Returns
+        -------
+        string
+            confirmation or the reason it could not be started
+        """
+        try:
+            self.energy.start(name, time.time())
+        except ValueError as e:
+            return str(e) + ".\n"
+        self.events.log("energy_start", window=name)
+        return "Started energy window {}.\n".format(name)
+
+    def stop_energy_window(self, name):
+        """
+        Stops the accounting window `name`.
+
+        Returns
+        -------
+        string
+            energy of every team in the window or the reason it could not be stopped
+        """
+        try:
+            window = self.energy.stop(name, time.time())
+        except ValueError as e:
+            return str(e) + ".\n"
+        kwh = {team: round(meter.kwh, 3) for team, meter in window.meters.items()}
+        self.events.log("energy_stop", window=name, kwh=kwh)
+        out = "Stopped energy window {}:\n".format(name)
+        topology = self.topology
+        for team in topology.team_order:
+            out += "{}: {}\n".format(
+                topology.padded_labels[team], energy_text(window.meters.get(team))
+            )
+        return out
+
+    def snapshot_date(self):
+        return datetime.fromtimestamp(self.samples_time).strftime("%Y-%m-%d %H:%M:%S")
+
+    def team_sum(self, team, samples, field="current"):
+        """
+        Sums up a power value of all PDUs of a team.
+
+        Parameters
+        ----------
+        team : string
+            team name
+        samples : {int: Sample}
+            readings for each IP
+        field : string
+            either "current" or "peak"
+
+        Returns
+        -------
+        int
+            power in W or -1 if a PDU of the team could not be read
+        """
+        total = 0
+        for ip in self.teams[team]:
+            if ip not in samples or not samples[ip].ok:
+                return -1
+            total += getattr(samples[ip], field)
+        return total
+
+    def team_peak(self, team, samples):
+        """
+        Peak power of a team the limit is checked against: the larger of the sum of the peak
+        registers in `samples` and the tracked peak since the last reset. The registers catch
+        spikes between two polls, the tracked peak covers PDUs that could not be read.
+        Readings taken before the last reset of the team, e.g. by a poll that was in flight
+        during the reset, still hold the old register values and are ignored.
+
+        Returns
+        -------
+        int
+            power in W or -1 if unknown
+        """
+        mark = self.reset_marks.get(team, 0.0)
+        since_reset = {
+            ip: samples[ip] for ip in self.teams[team] if ip in samples and samples[ip].time >= mark
+        }
+        peak = self.peak_trackers[team].since_start()
+        return max(self.team_sum(team, since_reset, "peak"), -1 if peak is None else peak[1])
+
+    def reset_tracked(self, team, now=None):
+        """
+        Restarts the tracked peak and the reported exceeding of a team after its peak
+        registers were reset.
+        """
+        now = time.time() if now is None else now
+        self.peak_trackers[team].reset(now)
+        self.team_peaks[team] = 0
+        self.reset_marks[team] = now
+        self.save_reset_marks()
+
+    def load_reset_marks(self):
+        """
+        Reads the time of the last reset of every team.
+
+        Returns
+        -------
+        {string: float}
+            timestamp of the last reset by team
+        """
+        try:
+            with open(self.reset_marks_path, "r") as f:
+                return {team: float(mark) for team, mark in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            print("Could not read {}: {}".format(self.reset_marks_path, e), file=sys.stderr)
+            return {}
+
+    def save_reset_marks(self):
+        tmp = self.reset_marks_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.reset_marks, f)
+            os.replace(tmp, self.reset_marks_path)
+        except OSError as e:
+            print("Could not write {}: {}".format(self.reset_marks_path, e), file=sys.stderr)
+
+    def tracked_peak(self, team, window=None, now=None):
+        """
+        Peak of the polled power of a team since its last reset, or over the last `window`
+        seconds. Never queries the PDUs.
+
+        Returns
+        -------
+        (float, int)
+            timestamp and value of the peak, None if there is no sample
+        """
+        if window is None:
+            return self.peak_trackers[team].since_start()
+        now = time.time() if now is None else now
+        if window == self.peak_window:
+            return self.peak_trackers[team].latest_window(now)
+        return self.team_history[team].peak(now - window)
+
+    def tracked_peaks(self, window=None, dates=False):
+        """
+        Formats the tracked peaks of all teams, see tracked_peak().
+
+        Returns
+        -------
+        string
+            peak power values, with `dates` including when they were reached
+        """
+        now = time.time()
+        topology = self.topology
+        if window is None:
+            out = self.snapshot_date() + "\nPeak power values since the last reset:\n"
+        else:
+            out = self.snapshot_date() + "\nPeak power values of the last {}:\n".format(
+                format_duration(window)
+            )
+        for team in topology.team_order:
+            peak = self.tracked_peak(team, window, now)
+            out += "{}: {} W\n".format(
+                topology.padded_labels[team], -1 if peak is None else peak[1]
+            )
+            if dates:
+                date = "" if peak is None else datetime.fromtimestamp(peak[0])
+                out += "    {}\n".format(date and date.strftime("%m/%d/%Y %H:%M:%S"))
+        return out
+
+    async def current(self):
+        """
+        Returns the current power for each team as a string including the timestamp of the
+        readings. Answers from the snapshot unless it is stale.
+
+        Returns
+        -------
+        string
+            All current power values
+        """
+        samples = await self.snapshot()
+        out = self.snapshot_date() + "\nCurrent power values:\n"
+        topology = self.topology
+        for team in topology.team_order:
+            team_power = self.team_sum(team, samples, "current")
+            out += "{}: {} W\n".format(topology.padded_labels[team], team_power)
         return out
 
-    def peaks(self):
+    async def peaks(self, window=None):
         """
-        Reads out the current peak power values for each team and returns everything as a
-        string including a timestamp of the request.
+        Returns the current peak power values for each team as a string including the
+        timestamp of the readings. Answers from the snapshot unless it is stale, or from the
+        tracked peaks without querying the PDUs if `software_peaks` or a `window` in seconds
+        is given.
 
         Returns
         -------
         string
             All current peak power values
         """
-        out = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\nPeak power values:\n"
-        for team in sorted(self.teams.keys()):
-            team_peak = 0
-            ip_list = ", ".join([str(ip) for ip in self.teams[team].keys()])
-            for ip in self.teams[team].keys():
-                sn = [
-                    "snmpget",
-                    "-v2c",
-                    "-t",
-                    self.snmp_timeout,
-                    "-cpublic",
-                    "192.168.1." + str(ip),
-                    self.oid_peak,
-                ]
-                res = subprocess.run(sn, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-                if res.returncode != 0:
-                    print(
-                        "Could not read peak power from " + str(team) + "(" + str(ip) + ").",
-                        file=sys.stderr,
-                    )
-                    team_peak = -1
-                    break
-                else:
-                    team_peak += (
-                        int(res.stdout.decode("utf-8").replace("\n", "").split(":")[-1]) * 10
-                    )
-            out += "{}({}): {} W\n".format(team.ljust(self.lngst_name), ip_list, team_peak)
+        if self.software_peaks or window is not None:
+            return self.tracked_peaks(window)
+        samples = await self.snapshot()
+        out = self.snapshot_date() + "\nPeak power values:\n"
+        topology = self.topology
+        for team in topology.team_order:
+            team_peak = self.team_sum(team, samples, "peak")
+            out += "{}: {} W\n".format(topology.padded_labels[team], team_peak)
         return out
 
-    def peak_dates(self):
+    async def peak_dates(self, window=None):
         """
-        Reads out the current peak power values together with the timestamp when the peak was
-        reached for each team and returns everything as a string including the current date.
+        Returns the current peak power values together with the timestamp when the peak was
+        reached for each team as a string including the date of the readings. Answers from the
+        snapshot unless it is stale, or from the tracked peaks like peaks().
 
         Returns
         -------
         string
             All current peak power values with corresponding timestamps
         """
-        out = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\nPeak power values:\n"
-        for team in sorted(self.teams.keys()):
-            team_peak = 0
-            ip_list = ", ".join([str(ip) for ip in self.teams[team].keys()])
-            for ip in self.teams[team].keys():
-                sn = [
-                    "snmpget",
-                    "-v2c",
-                    "-t",
-                    self.snmp_timeout,
-                    "-cpublic",
-                    "192.168.1." + str(ip),
-                    self.oid_peak,
-                ]
-                sn_time = [
-                    "snmpget",
-                    "-v2c",
-                    "-t",
-                    self.snmp_timeout,
-                    "-cpublic",
-                    "192.168.1." + str(ip),
-                    self.oid_peak_timestamp,
-                ]
-                res = subprocess.run(sn, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-                res_timestamp = subprocess.run(sn_time, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-                if res.returncode != 0 or res_timestamp.returncode != 0:
-                    print(
-                        "Could not read peak power or timestamp from "
-                        + str(team)
-                        + "("
-                        + str(ip)
-                        + ").",
-                        file=sys.stderr,
-                    )
-                    team_peak = -1
-                    break
-                else:
-                    team_peak += (
-                        int(res.stdout.decode("utf-8").replace("\n", "").split(":")[-1]) * 10
-                    )
-                    date = res_timestamp.stdout.decode("utf-8").split('"')[1]
-            out += "{}({}): {} W\n    {}\n".format(
-                team.ljust(self.lngst_name), ip_list, team_peak, date
+        if self.software_peaks or window is not None:
+            return self.tracked_peaks(window, dates=True)
+        samples = await self.snapshot()
+        out = self.snapshot_date() + "\nPeak power values:\n"
+        topology = self.topology
+        for team in topology.team_order:
+            team_peak = self.team_sum(team, samples, "peak")
+            readings = [samples.get(ip) for ip in topology.teams[team]]
+            # PDUs left out of the snapshot, e.g. by a late worker, have no date
+            dates = [sample.peak_date for sample in readings if sample is not None and sample.ok]
+            date = dates[-1] if dates else ""
+            out += "{}: {} W\n    {}\n".format(topology.padded_labels[team], team_peak, date)
+        return out
+
+    async def read_table(self, ip, table):
+        """
+        Walks a table of the PDU given by ip with GETBULK requests.
+
+        Returns
+        -------
+        LoadTable
+            the readings, None if the PDU could not be read
+        """
+        try:
+            walked = await self.snmp.walk(
+                self.address(ip),
+                table.column_oids(),
+                self.community(ip),
+                self.snmp_port,
+                self.bulk_repetitions,
             )
+        except SnmpError:
+            return None
+        return table.parse(time.time(), walked)
+
+    async def refresh_loads(self, table, ips, max_age=None):
+        """
+        Reads a table of the given PDUs in parallel unless their last reading is not older
+        than `max_age` (default: `max_sample_age`) seconds.
+
+        Returns
+        -------
+        {int: LoadTable}
+            readings for each IP, None if the PDU could not be read
+        """
+        if max_age is None:
+            max_age = self.max_sample_age
+        now = time.time()
+
+        async def read_one(ip):
+            key = (table.name, ip)
+            cached = self.loads.get(key)
+            if cached is not None and now - cached.time <= max_age:
+                return
+            if not self.health[ip].available():
+                self.loads.pop(key, None)
+                return
+            async with self.poll_limit:
+                loads = await self.read_table(ip, table)
+            if loads is None:
+                self.loads.pop(key, None)
+            else:
+                self.loads[key] = loads
+
+        await asyncio.gather(*[read_one(ip) for ip in ips])
+        return {ip: self.loads.get((table.name, ip)) for ip in ips}
+
+    def loads_header(self, title, team, loads):
+        times = [table.time for table in loads.values() if table is not None]
+        date = datetime.fromtimestamp(min(times)) if times else datetime.now()
+        return "{}\n{} of {}:\n".format(
+            date.strftime("%Y-%m-%d %H:%M:%S"), title, self.topology.labels[team]
+        )
+
+    async def phases(self, team):
+        """
+        Returns the power and current of each phase of the PDUs of a team.
+
+        Returns
+        -------
+        string
+            one line per PDU and phase
+        """
+        pdus = self.teams[team]
+        display = self.topology.display
+        loads = await self.refresh_loads(PHASES, sorted(pdus))
+        out = self.loads_header("Phases", team, loads)
+        for ip, table in loads.items():
+            if table is None:
+                out += "{}({}): not reachable\n".format(pdus[ip], display[ip])
+                continue
+            out += "{}({}): {} W\n".format(pdus[ip], display[ip], table.total("power"))
+            for row, power, current in zip(table.index, table["power"], table["current"]):
+                out += "    L{}: {} W, {:.1f} A\n".format(row, power, current)
         return out
 
-    def check_exceedings(self):
+    async def outlets(self, team):
         """
-        Snoops all current peak power values, checks against exceeding and returns list of them.
-        Returns an empty list if every team is inside the power limit.
+        Returns the power and peak power of each outlet of the PDUs of a team.
 
         Returns
         -------
-        [(string), ...]
-            List of strings with IP and peak value for each exceeder
+        string
+            one line per PDU and outlet
+        """
+        pdus = self.teams[team]
+        display = self.topology.display
+        loads = await self.refresh_loads(OUTLETS, sorted(pdus))
+        out = self.loads_header("Outlets", team, loads)
+        for ip, table in loads.items():
+            if table is None:
+                out += "{}({}): not reachable\n".format(pdus[ip], display[ip])
+                continue
+            out += "{}({}): {} W\n".format(pdus[ip], display[ip], table.total("power"))
+            for row, name, power, peak in zip(
+                table.index, table["name"], table["power"], table["peak"]
+            ):
+                out += "    {} {}: {} W (peak {} W)\n".format(row, name, power, peak)
+        return out
+
+    def team_of(self, host):
+        """
+        Returns the team of the PDU with the network address `host`, None if unknown.
+        """
+        ip = self.addresses.get(host)
+        return None if ip is None else self.ip_dict.get(ip)
+
+    async def check_exceedings(self, ips=None, deadline=None):
+        """
+        Snoops the current peak power values of all PDUs the scheduler considers due (or of
+        the given PDUs), checks against exceeding and returns list of them. Returns an empty
+        list if every team is inside the power limit. The readings also refresh the snapshot
+        the commands answer from.
+
+        Returns
+        -------
+        ([(string), ...], [(string), ...])
+            List of strings with IP and peak value for each exceeder and list of strings for
+            each PDU which went down or came back
         """
         exceeders = []
-        not_reachable = []
-        for team in sorted(self.teams.keys()):
-            team_peak = 0
-            ip_list = ", ".join([str(ip) for ip in self.teams[team].keys()])
-            for ip in self.teams[team].keys():
-                sn = [
-                    "snmpget",
-                    "-v2c",
-                    "-t",
-                    self.snmp_timeout,
-                    "-cpublic",
-                    "192.168.1." + str(ip),
-                    self.oid_peak,
-                ]
-                res = subprocess.run(sn, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-                if res.returncode != 0:
-                    print(
-                        "Could not read peak power from " + str(team) + "(" + str(ip) + ").",
-                        file=sys.stderr,
-                    )
-                    team_peak = -1
-                    not_reachable.append("{}({}):\nPDU not reachable!".format(team, ip))
-                    break
-                else:
-                    team_peak += (
-                        int(res.stdout.decode("utf-8").replace("\n", "").split(":")[-1]) * 10
-                    )
+        now = time.time()
+        # the topology may be replaced while polling, the due PDUs belong to this one
+        topology = self.topology
+        if ips is None:
+            self.start_probes(now)
+            ips = self.scheduler.due(now)
+        else:
+            ips = [ip for ip in ips if ip in topology.ip_dict]
+        if ips:
+            samples = await self.refresh(ips, deadline=deadline)
+            # Skipped PDUs stay due and are polled again in the next cycle
+            self.scheduler.update([ip for ip in ips if ip not in self.skipped], now)
+        for team in sorted(set(topology.ip_dict[ip] for ip in ips)):
+            team_peak = self.team_peak(team, samples)
             if team_peak > self.LIMIT and self.team_peaks[team] < self.LIMIT:
                 self.team_peaks[team] = team_peak
+                self.events.log(
+                    "exceeding", team, self.pdu_addresses(topology.teams[team]), team_peak
+                )
                 exceeders.append(
-                    "{}({}):\nAbove power limit ({} W)!".format(team, ip_list, team_peak)
+                    "{}:\nAbove power limit ({} W)!".format(topology.labels[team], team_peak)
                 )
+        # PDUs which went down or came back since the last call
+        not_reachable = self.health_events
+        self.health_events = []
         return (exceeders, not_reachable)
 
+    def check_trends(self, now=None):
+        """
+        Fits the power trend of every team over the last `trend_window` seconds and warns
+        about teams that are projected to exceed the limit within `trend_horizon` seconds.
+        A team is warned only once until its projection drops below the limit again.
+
+        Returns
+        -------
+        [(string), ...]
+            List of strings with IP, power and projection for each team approaching the limit
+        """
+        if now is None:
+            now = time.time()
+        warnings = []
+        for team in self.topology.team_order:
+            fit = self.team_history[team].trend(now - self.trend_window)
+            if fit is None:
+                continue
+            slope, power, t = fit
+            projected = power + slope * (now - t + self.trend_horizon)
+            if slope <= 0 or projected < self.LIMIT or power >= self.LIMIT:
+                self.team_warnings[team] = False
+                continue
+            if self.team_warnings.get(team) or self.team_peaks[team] > self.LIMIT:
+                continue
+            self.team_warnings[team] = True
+            self.events.log(
+                "warning",
+                team,
+                self.pdu_addresses(self.teams[team]),
+                round(power),
+                slope=round(slope, 1),
+            )
+            warnings.append(
+                "{}:\nApproaching power limit ({:.0f} W, {:+.0f} W/s, ".format(
+                    self.topology.labels[team], power, slope
+                )
+                + "limit in ~{:.0f} s)!".format((self.LIMIT - power) / slope)
+            )
+        return warnings
+
     async def reset_elinks(self, team, context=None, progress_msg=None):
         """
-        Resets peak power value of certain PDU given by ip.
+        Resets peak power value of all PDUs of a team via the web interface. The ELinks
+        sessions run in `reset_executor`, so the event loop keeps serving commands and limit
+        checks in the meantime.
 
         Parameters
         ----------
-        ip : int
-            last three digits of IP address for the PDU to reset
+        team : string
+            team whose PDUs are reset
         context : telegram.Context
             context for identifying the bot
         progress_msg : telegram.Message
@@ -261,131 +2036,226 @@ class Backend(object):
         -------
         bool
             True    if resetting was successful
-            False   if pexpect.TIMOUT appeared
+            False   if pexpect.TIMOUT appeared or the PDU could not be resolved
         """
+        loop = asyncio.get_running_loop()
         progress_bar = "`\|\=          \|`\n"
-        for ip in sorted(self.teams[team].keys()):
-            print("Start...", end="", flush=True)
-            # Start ELinks
+
+        def progress(progress_txt):
+            # Called from the worker thread, the message is edited on the event loop
+            nonlocal progress_bar
+            if progress_msg is None:
+                return
+            progress_bar = progress_bar.replace("= ", "=\=")
+            edit = asyncio.run_coroutine_threadsafe(
+                self.bot.edit_message_text_wrapper(
+                    context.bot,
+                    progress_msg.chat_id,
+                    progress_msg.message_id,
+                    progress_bar + progress_txt,
+                    parse_mode="md",
+                ),
+                loop,
+            )
             try:
-                child = spawn("elinks 192.168.1." + str(ip))
-                print("wait to establish connection to {}...".format(ip), end="")
-                if progress_msg != None:
-                    progress_bar = progress_bar.replace("= ", "=\=")
-                    progress_txt = "Wait to establish connection to PDU\.\.\."
-                    await self.bot.edit_message_text_wrapper(
-                        context.bot,
-                        progress_msg.chat_id,
-                        progress_msg.message_id,
-                        progress_bar + progress_txt,
-                        parse_mode="md",
-                    )
-                child.expect("Log On", timeout=10)
-                # Open PDU connection and navigate to Configurations -> Device
-                time.sleep(1)
-                child.sendline(self.K_DOWN)
-                child.send("apc")
-                child.sendline(self.K_DOWN)
-                child.sendline(self.pwd)
-                child.sendline("")
-                child.expect("Rack PDU 2G", timeout=10)
-                time.sleep(1)
-                print("Logged in...", end="", flush=True)
-                if progress_msg != None:
-                    progress_bar = progress_bar.replace("= ", "=\=")
-                    progress_txt = "Logged in"
-                    await self.bot.edit_message_text_wrapper(
-                        context.bot,
-                        progress_msg.chat_id,
-                        progress_msg.message_id,
-                        progress_bar + progress_txt,
-                        parse_mode="md",
-                    )
-                child.send("/")
-                child.sendline(self.K_DOWN)
-                child.send(self.K_UP)
-                child.sendline("Device")
-                child.sendline("n")
-                child.expect("Rack PDU 2G", timeout=10)
-                time.sleep(1)
-                print("Resetting...", end="", flush=True)
-                if progress_msg != None:
-                    progress_bar = progress_bar.replace("= ", "=\=")
-                    progress_txt = "Resetting PDU\.\.\."
-                    await self.bot.edit_message_text_wrapper(
-                        context.bot,
-                        progress_msg.chat_id,
-                        progress_msg.message_id,
-                        progress_bar + progress_txt,
-                        parse_mode="md",
-                    )
-                # Reset PDU peak power
-                child.sendline("/Reset (")
-                child.send(self.K_DOWN * 20)
-                child.sendline(self.K_UP * 7)
-                child.sendline(self.K_DOWN * 2)
-                child.sendline("")
-                child.expect("Rack PDU 2G", timeout=12)
-                time.sleep(8)
-                # Log off
-                print("Disconnecting...", end="", flush=True)
-                if progress_msg != None:
-                    progress_bar = progress_bar.replace("= ", "=\=")
-                    progress_txt = "Disconnecting from PDU\.\.\."
-                    await self.bot.edit_message_text_wrapper(
-                        context.bot,
-                        progress_msg.chat_id,
-                        progress_msg.message_id,
-                        progress_bar + progress_txt,
-                        parse_mode="md",
-                    )
-                child.sendline(self.K_DOWN * 2)
-                # child.expect('You are now logged off', timeout=20)
-                time.sleep(1)
-                child.sendline("")
-                print("Done!", flush=False)
-                if progress_msg != None:
-                    progress_bar = progress_bar.replace("= ", "=\=")
-                    progress_txt = "Done"
-                    await self.bot.edit_message_text_wrapper(
-                        context.bot,
-                        progress_msg.chat_id,
-                        progress_msg.message_id,
-                        progress_bar + progress_txt,
-                        parse_mode="md",
-                    )
-                # End ELinks
-                child.sendline("q")
-                child.kill(0)
-
-                self.team_peaks[team] = 0
-                print("PDU of " + team + " (" + str(ip) + ") successfully reset!")
-            except pexpect.TIMEOUT:
-                # print('Expect Timeout reached for '+self.teams[team]+'('+str(ip)+'). Reset '
-                print(
-                    "Expect Timeout reached for "
-                    + str(team)
-                    + "("
-                    + str(ip)
-                    + "). Reset "
-                    + "may  not be finished.",
-                    file=sys.stderr,
-                    flush=False,
-                )
-                if not child.terminate():
-                    print("Could not terminate child regularly.", file=sys.stderr)
-                    child.terminate(force=True)
+                edit.result(timeout=10)
+            except Exception as e:
+                print("Could not update progress message: {}".format(e), file=sys.stderr)
+
+        for ip in sorted(self.teams[team].keys()):
+            success = await loop.run_in_executor(
+                self.reset_executor, self.elinks_session, team, ip, progress
+            )
+            if not success:
                 return False
+            print("PDU of " + team + " (" + str(ip) + ") successfully reset!")
+        self.reset_tracked(team)
         return True
 
-    async def reset(self, team, context=None, progress_msg=None):
+    def elinks_session(self, team, ip, progress):
         """
-        Resets peak power value of certain PDU given by ip.
+        Logs into the web interface of the PDU given by ip with ELinks and resets its peak
+        power. Blocks, so it must not run on the event loop.
 
         Parameters
         ----------
+        team : string
+            team of the PDU
         ip : int
-            last three digits of IP address for the PDU to reset
+            last octet of the IP address of the PDU
+        progress : function
+            called with a description of each step
+
+        Returns
+        -------
+        bool
+            True    if resetting was successful
+            False   if pexpect.TIMOUT appeared or the PDU could not be resolved
+        """
+        print("Start...", end="", flush=True)
+        try:
+            address = self.address(ip)
+        except SnmpError as e:
+            print("{}. Reset of {} skipped.".format(e, team), file=sys.stderr)
+            return False
+        # Start ELinks
+        try:
+            child = spawn("elinks " + address)
+            print("wait to establish connection to {}...".format(ip), end="")
+            progress("Wait to establish connection to PDU\.\.\.")
+            child.expect("Log On", timeout=10)
+            # Open PDU connection and navigate to Configurations -> Device
+            time.sleep(1)
+            child.sendline(self.K_DOWN)
+            child.send("apc")
+            child.sendline(self.K_DOWN)
+            child.sendline(self.pwd)
+            child.sendline("")
+            child.expect("Rack PDU 2G", timeout=10)
+            time.sleep(1)
+            print("Logged in...", end="", flush=True)
+            progress("Logged in")
+            child.send("/")
+            child.sendline(self.K_DOWN)
+            child.send(self.K_UP)
+            child.sendline("Device")
+            child.sendline("n")
+            child.expect("Rack PDU 2G", timeout=10)
+            time.sleep(1)
+            print("Resetting...", end="", flush=True)
+            progress("Resetting PDU\.\.\.")
+            # Reset PDU peak power
+            child.sendline("/Reset (")
+            child.send(self.K_DOWN * 20)
+            child.sendline(self.K_UP * 7)
+            child.sendline(self.K_DOWN * 2)
+            child.sendline("")
+            child.expect("Rack PDU 2G", timeout=12)
+            time.sleep(8)
+            # Log off
+            print("Disconnecting...", end="", flush=True)
+            progress("Disconnecting from PDU\.\.\.")
+            child.sendline(self.K_DOWN * 2)
+            # child.expect('You are now logged off', timeout=20)
+            time.sleep(1)
+            child.sendline("")
+            print("Done!", flush=False)
+            progress("Done")
+            # End ELinks
+            child.sendline("q")
+            child.kill(0)
+            return True
+        except pexpect.TIMEOUT:
+            print(
+                "Expect Timeout reached for "
+                + str(team)
+                + "("
+                + str(ip)
+                + "). Reset "
+                + "may  not be finished.",
+                file=sys.stderr,
+                flush=False,
+            )
+            if not child.terminate():
+                print("Could not terminate child regularly.", file=sys.stderr)
+                child.terminate(force=True)
+            return False
+
+    async def reset_pdu(self, ip):
+        """
+        Resets the peak power value of the PDU given by ip via SNMPv3, retrying up to
+        `reset_attempts` times.
+
+        Returns
+        -------
+        string
+            None if resetting was successful, otherwise the last error
+        """
+        error = None
+        for _ in range(self.reset_attempts):
+            try:
+                await self.snmp.set(
+                    self.address(ip),
+                    [(self.oid_peak_reset, self.oid_peak_reset_val)],
+                    self.user(ip),
+                    self.snmp_port,
+                )
+                return None
+            except SnmpError as e:
+                error = str(e)
+        print(
+            "Could not succesfully reset " + self.pdu_label(ip) + ": " + error,
+            file=sys.stderr,
+        )
+        return error
+
+    async def reset_teams(self, teams, progress=None):
+        """
+        Resets the peak power values of all PDUs of the given teams concurrently, at most
+        `reset_parallel` PDUs at a time, and the tracked peaks of the teams whose PDUs were
+        all reset.
+
+        Parameters
+        ----------
+        teams : [string, ...]
+            teams to reset
+        progress : coroutine function
+            awaited with the status of all PDUs whenever a PDU is finished
+
+        Returns
+        -------
+        {int: string}
+            status for each IP: "pending", "done" or "failed: <error>"
+        """
+        limit = asyncio.Semaphore(self.reset_parallel)
+        topology = self.topology
+        status = {ip: "pending" for team in teams for ip in sorted(topology.teams[team])}
+
+        async def reset_one(ip):
+            async with limit:
+                error = await self.reset_pdu(ip)
+            status[ip] = "done" if error is None else "failed: " + error
+            if progress is not None:
+                await progress(status)
+
+        await asyncio.gather(*[reset_one(ip) for ip in status])
+        now = time.time()
+        for team in teams:
+            ips = topology.teams[team]
+            if all(status[ip] == "done" for ip in ips):
+                self.reset_tracked(team, now)
+                print("PDUs of " + team + " successfully reset!")
+                self.events.log("reset", team, self.pdu_addresses(ips))
+            else:
+                failed = {topology.display[ip]: status[ip] for ip in ips if status[ip] != "done"}
+                self.events.log("reset_failed", team, self.pdu_addresses(ips), errors=failed)
+        return status
+
+    def reset_report(self, status):
+        """
+        Formats the reset status of all PDUs as one line per team.
+
+        Returns
+        -------
+        string
+            status per team and PDU
+        """
+        done = sum(1 for state in status.values() if state == "done")
+        out = "Reset {}/{} PDUs:\n".format(done, len(status))
+        for team in sorted(set(self.ip_dict[ip] for ip in status)):
+            display = self.topology.display
+            states = ["{} {}".format(display[ip], status[ip]) for ip in sorted(self.teams[team])]
+            out += "{}: {}\n".format(team, ", ".join(states))
+        return out
+
+    async def reset(self, team, context=None, progress_msg=None):
+        """
+        Resets peak power value of all PDUs of a team.
+
+        Parameters
+        ----------
+        team : string
+            team whose PDUs are reset
         context : telegram.Context
             context for identifying the bot
         progress_msg : telegram.Message
@@ -395,41 +2265,17 @@ class Backend(object):
         -------
         bool
             True    if resetting was successful
-            False   if pexpect.TIMEOUT appeared
+            False   if a PDU could not be reset
         """
-        error = False
-        for ip in sorted(self.teams[team].keys()):
-            sn = [
-                "snmpset",
-                "-v3",
-                "-u",
-                "apc",
-                "-lAuthPriv",
-                "-aSHA",
-                "-A",
-                self.snmpv3_auth_pass,
-                "-xAES",
-                "-X",
-                self.snmpv3_priv_pass,
-                "192.168.1." + str(ip),
-                ".1.3.6.1.4.1.318.1.1.26.4.1.1.10.1",
-                "i",
-                "2",
-            ]
-            res = subprocess.run(sn, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-            if res.returncode != 0:
-                print(
-                    "Could not succesfully reset " + str(team) + "(" + str(ip) + ").",
-                    file=sys.stderr,
+
+        async def progress(status):
+            if progress_msg is not None:
+                await self.bot.edit_message_text_wrapper(
+                    context.bot,
+                    progress_msg.chat_id,
+                    progress_msg.message_id,
+                    self.reset_report(status),
                 )
-                error = True
-                break
-            progress_txt = "Done"
-            await self.bot.edit_message_text_wrapper(
-                context.bot,
-                progress_msg.chat_id,
-                progress_msg.message_id,
-                progress_txt,
-                parse_mode="md",
-            )
-        return True if not error else False
+
+        status = await self.reset_teams([team], progress)
+        return all(state == "done" for state in status.values())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from backend import Backend
+from simulator import address, constant, start_fleet, step
+
+# Power of every simulated PDU, two PDUs per team stay well below the limit
+BASE_WATTS = 2000
+# Power the alerting PDU jumps to, which puts its team above the limit
+ALERT_WATTS = 4500
+PORT = 1161
+
+
+class BenchBackend(Backend):
+    """
+    Backend polling the simulated fleet. Runs in a temporary directory, so neither the
+    configuration nor the logs of the bot are touched.
+    """
+
+    snmp_port = PORT
+
+    def address(self, ip):
+        return address(ip)
+
+
+def simulate(n, options, conn):
+    """
+    Runs the simulated fleet until told to stop. Commands arrive over `conn`:
+    ("alert", ip, at) makes PDU `ip` jump to ALERT_WATTS at time `at`, ("calm", ip) resets
+    it to BASE_WATTS including its peak.
+    """
+    options = dict(options)
+    dead = options.pop("dead")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        curves = {ip: constant(BASE_WATTS) for ip in range(1, n + 1)}
+        fleet = await start_fleet(curves, PORT, **options)
+        # The last PDUs are dead, PDU 1 is the one that alerts
+        for ip in range(n, max(1, n - dead), -1):
+            fleet[ip].dead = True
+        conn.send("ready")
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command[0] == "stop":
+                break
+            pdu = fleet[command[1]]
+            if command[0] == "alert":
+                pdu.set_curve(step(BASE_WATTS, ALERT_WATTS, command[2] - pdu.epoch))
+            elif command[0] == "calm":
+                pdu.set_curve(constant(BASE_WATTS))
+                pdu.on_set(Backend.oid_peak_reset, Backend.oid_peak_reset_val)
+            conn.send("ok")
+        for pdu in fleet.values():
+            pdu.close()
+
+    asyncio.run(run())
+
+
+async def cycles(backend, count):
+    """
+    Runs `count` check_exceedings() cycles with every PDU due.
+
+    Returns
+    -------
+    ([float, ...], [float, ...])
+        wall clock and CPU seconds of each cycle
+    """
+    scheduler = backend.scheduler
+    scheduler.max_rate = 1e6
+    wall, cpu = [], []
+    for _ in range(count):
+        scheduler.next_due.clear()
+        scheduler.tokens = scheduler.max_rate
+        start, start_cpu = time.perf_counter(), time.process_time()
+        await backend.check_exceedings()
+        wall.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    return wall, cpu
+
+
+async def detections(backend, conn, count, delay=1.0, timeout=60.0):
+    """
+    Lets PDU 1 jump above the limit `count` times and measures how long the adaptive
+    polling takes to report the exceeding.
+
+    Returns
+    -------
+    [float, ...]
+        seconds from the jump to the report
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = backend.scheduler
+    team = backend.ip_dict[1]
+    latencies = []
+    for _ in range(count):
+        at = time.time() + delay
+        conn.send(("alert", 1, at))
+        await loop.run_in_executor(None, conn.recv)
+        while time.time() - at < timeout:
+            start = loop.time()
+            exceeders, _ = await backend.check_exceedings()
+            if exceeders and time.time() >= at:
+                latencies.append(time.time() - at)
+                break
+            await asyncio.sleep(max(0.0, scheduler.tick - (loop.time() - start)))
+        conn.send(("calm", 1))
+        await loop.run_in_executor(None, conn.recv)
+        backend.reset_tracked(team)
+        # Let the history settle back to the base power before the next jump
+        await cycles(backend, 3)
+        scheduler.next_due.clear()
+    return latencies
+
+
+def bench(n, args, results):
+    """
+    Benchmarks a fleet of `n` PDUs, run in its own process so no state of the backend
+    carries over between fleet sizes.
+    """
+    options = {"latency": args.latency, "jitter": args.jitter, "loss": args.loss, "dead": args.dead}
+    conn, child_conn = multiprocessing.Pipe()
+    simulator = multiprocessing.Process(target=simulate, args=(n, options, child_conn))
+    simulator.start()
+    conn.recv()
+    os.chdir(tempfile.mkdtemp(prefix="iscbot-bench-"))
+    with open("ips.csv", "w") as f:
+        for ip in range(1, n + 1):
+            f.write("{},PDU-{},Team-{}\n".format(ip, ip, (ip + 1) // 2))
+    with open("accesslist.conf", "w") as f:
+        f.write("0\n")
+
+    async def run():
+        BenchBackend.poll_workers = args.workers
+        backend = BenchBackend(auth_pass="benchmark", priv_pass="benchmark")
+        await cycles(backend, 2)
+        wall, cpu = await cycles(backend, args.cycles)
+        latencies = await detections(backend, conn, args.detections)
+        await backend.events.close()
+        backend.close()
+        return wall, cpu, latencies, backend.metrics.snmp_timeouts
+
+    try:
+        results.put((n,) + asyncio.run(run()))
+    finally:
+        conn.send(("stop",))
+        simulator.join()
+
+
+def report(n, wall, cpu, latencies, timeouts, alerts):
+    ms = [1000 * w for w in sorted(wall)]
+    print(
+        "{:>5} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.2f} {:>12} {:>9}".format(
+            n,
+            statistics.median(ms),
+            ms[max(0, int(len(ms) * 0.95) - 1)],
+            1000 * statistics.mean(cpu),
+            statistics.median(latencies) if latencies else float("nan"),
+            "{}/{}".format(len(latencies), alerts),
+            timeouts,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the poll and alert pipeline against a simulated PDU fleet."
+    )
+    parser.add_argument("--sizes", default="10,50,100,250,500", help="comma separated fleet sizes")
+    parser.add_argument("--cycles", type=int, default=20, help="full poll cycles per size")
+    parser.add_argument("--detections", type=int, default=3, help="alerts per size")
+    parser.add_argument("--latency", type=float, default=0.002, help="response delay in s")
+    parser.add_argument("--jitter", type=float, default=0.002, help="random extra delay in s")
+    parser.add_argument("--loss", type=float, default=0.0, help="request loss probability")
+    parser.add_argument("--dead", type=int, default=0, help="number of dead PDUs")
+    parser.add_argument("--workers", type=int, default=0, help="poller worker processes")
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.sizes.split(",")]
+    print(
+        "{:>5} {:>9} {:>9} {:>9} {:>10} {:>12} {:>9}".format(
+            "PDUs", "cycle ms", "p95 ms", "CPU ms", "detect s", "detected", "timeouts"
+        )
+    )
+    results = multiprocessing.Queue()
+    for n in sizes:
+        worker = multiprocessing.Process(target=bench, args=(n, args, results))
+        worker.start()
+        worker.join()
+        if worker.exitcode != 0:
+            print("Benchmark of {} PDUs failed.".format(n), file=sys.stderr)
+            continue
+        report(*results.get(), args.detections)
+
+
+if __name__ == "__main__":
+    main()
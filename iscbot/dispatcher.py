@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from throttle import RateLimiter
+
+
+class Dispatcher(object):
+    """
+    Outbound message queue. Every chat has its own delivery task, so chats are served
+    concurrently while each one stays below Telegram's per-chat limit and all of them
+    together below the global limit. Messages queued for a chat while it waits are merged
+    into one, and sending is retried on RetryAfter and network errors. Callers only queue
+    messages and never wait for delivery.
+    """
+
+    # Messages per second over all chats
+    global_rate = 25.0
+    # Seconds between two messages to the same private chat or group
+    chat_interval = 1.0
+    group_interval = 3.0
+    max_attempts = 5
+    max_length = 4096
+
+    def __init__(self, bot, metrics=None):
+        self.bot = bot
+        self.metrics = metrics
+        self.limit = RateLimiter(self.global_rate, self.global_rate)
+        self.pending = {}
+        self.workers = {}
+        self.next_send = {}
+
+    def submit(self, chat_ids, texts):
+        """
+        Queues messages for the given chats.
+
+        Parameters
+        ----------
+        chat_ids : [int, ...]
+            receiving chats
+        texts : [string, ...]
+            messages, merged into as few messages as possible per chat
+        """
+        for chat_id in chat_ids:
+            self.pending.setdefault(chat_id, []).extend(texts)
+            if chat_id not in self.workers:
+                self.workers[chat_id] = asyncio.ensure_future(self.deliver(chat_id))
+
+    async def close(self, timeout=10.0):
+        """
+        Waits up to `timeout` seconds for the queued messages, then drops the rest.
+        """
+        workers = list(self.workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for worker in pending:
+            worker.cancel()
+        if pending:
+            print("Dropped messages to {} chats.".format(len(pending)), file=sys.stderr)
+
+    async def deliver(self, chat_id):
+        loop = asyncio.get_running_loop()
+        interval = self.group_interval if chat_id < 0 else self.chat_interval
+        try:
+            while self.pending.get(chat_id):
+                for text in self.merge(self.pending.pop(chat_id)):
+                    wait = self.next_send.get(chat_id, 0.0) - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    await self.send(chat_id, text)
+                    self.next_send[chat_id] = loop.time() + interval
+        finally:
+            del self.workers[chat_id]
+
+    def merge(self, texts):
+        """
+        Joins the texts into as few messages as Telegram's length limit allows.
+        """
+        messages = []
+        for text in texts:
+            text = text[: self.max_length]
+            if messages and len(messages[-1]) + 2 + len(text) <= self.max_length:
+                messages[-1] += "\n\n" + text
+            else:
+                messages.append(text)
+        return messages
+
+    async def send(self, chat_id, text):
+        """
+        Sends one message, retrying on flood control and network errors.
+
+        Returns
+        -------
+        bool
+            True if the message was delivered
+        """
+        loop = asyncio.get_running_loop()
+        metrics = self.metrics
+        for attempt in range(self.max_attempts):
+            while not self.limit.allow(None):
+                await asyncio.sleep(1 / self.global_rate)
+            sent = loop.time()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                await asyncio.sleep(delay)
+                continue
+            except NetworkError as e:
+                print("Could not send message to {}: {}".format(chat_id, e), file=sys.stderr)
+                # BadRequest is a NetworkError, but sending it again does not help
+                if isinstance(e, BadRequest):
+                    break
+                await asyncio.sleep(2**attempt)
+                continue
+            except TelegramError as e:
+                print("Could not send message to {}: {}".format(chat_id, e), file=sys.stderr)
+                break
+            if metrics is not None:
+                metrics.telegram_send.observe(loop.time() - sent)
+            return True
+        if metrics is not None:
+            metrics.telegram_errors += 1
+        return False
+
+
+class EditState(object):
+
+    __slots__ = ("bot", "last", "pending", "next_edit", "task")
+
+    def __init__(self):
+        self.bot = None
+        self.last = None
+        self.pending = None
+        self.next_edit = 0.0
+        self.task = None
+
+
+class MessageEditor(object):
+    """
+    Coalesces edits of messages, e.g. progress bars. For each message the last sent and the
+    newest pending text are kept, and the message is edited at most every `min_interval`
+    seconds with the newest text; intermediate texts are skipped. Texts equal to the shown
+    one are not sent at all. The states of the `max_messages` most recently edited messages
+    are kept.
+    """
+
+    min_interval = 1.0
+    max_messages = 256
+
+    def __init__(self):
+        self.messages = OrderedDict()
+
+    def update(self, bot, chat_id, message_id, text, parse_mode=None):
+        """
+        Sets the new text of a message. The edit is sent in the background.
+        """
+        key = (chat_id, message_id)
+        state = self.messages.get(key)
+        if state is None:
+            state = self.messages[key] = EditState()
+            if len(self.messages) > self.max_messages:
+                self.messages.popitem(last=False)
+        else:
+            self.messages.move_to_end(key)
+        shown = state.pending if state.pending is not None else state.last
+        if (text, parse_mode) == shown:
+            return
+        state.bot = bot
+        state.pending = (text, parse_mode)
+        if state.task is None:
+            state.task = asyncio.ensure_future(self.flush(key, state))
+
+    def discard(self, chat_id, message_id):
+        """
+        Forgets a message, e.g. before deleting it, and drops its pending edit.
+        """
+        state = self.messages.pop((chat_id, message_id), None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+
+    async def flush(self, key, state):
+        loop = asyncio.get_running_loop()
+        try:
+            while state.pending is not None:
+                wait = state.next_edit - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                edit, state.pending = state.pending, None
+                if edit == state.last:
+                    continue
+                text, parse_mode = edit
+                try:
+                    await state.bot.edit_message_text(
+                        chat_id=key[0], message_id=key[1], text=text, parse_mode=parse_mode
+                    )
+                    state.last = edit
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    if isinstance(delay, timedelta):
+                        delay = delay.total_seconds()
+                    if state.pending is None:
+                        state.pending = edit
+                    state.next_edit = loop.time() + delay
+                    continue
+                except BadRequest as e:
+                    if "not modified" in str(e):
+                        state.last = edit
+                    else:
+                        print("Could not edit message {}: {}".format(key, e), file=sys.stderr)
+                except TelegramError as e:
+                    print("Could not edit message {}: {}".format(key, e), file=sys.stderr)
+                state.next_edit = loop.time() + self.min_interval
+        finally:
+            state.task = None
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+
+
+class EnergyMeter(object):
+    """
+    Integrates the power of a team to energy with the trapezoidal rule, in O(1) per sample.
+    Intervals longer than `max_gap` seconds, e.g. while a PDU was not reachable, are not
+    integrated but counted as gap.
+    """
+
+    __slots__ = ("max_gap", "joules", "seconds", "gap", "last")
+
+    def __init__(self, max_gap, joules=0.0, seconds=0.0, gap=0.0):
+        self.max_gap = max_gap
+        self.joules = joules
+        self.seconds = seconds
+        self.gap = gap
+        self.last = None
+
+    def append(self, timestamp, watts):
+        """
+        Adds a sample. Older samples than the last one are ignored.
+        """
+        if self.last is not None:
+            last_time, last_watts = self.last
+            elapsed = timestamp - last_time
+            if elapsed <= 0:
+                return
+            if elapsed > self.max_gap:
+                self.gap += elapsed
+            else:
+                self.joules += (last_watts + watts) * elapsed / 2
+                self.seconds += elapsed
+        self.last = (timestamp, watts)
+
+    @property
+    def kwh(self):
+        return self.joules / 3.6e6
+
+    @property
+    def mean(self):
+        """
+        Mean power in W over the integrated time, None without any.
+        """
+        return self.joules / self.seconds if self.seconds > 0 else None
+
+
+class AccountingWindow(object):
+    """
+    Named time span with its own energy meter per team, e.g. one benchmark run.
+    """
+
+    __slots__ = ("name", "start", "stop", "meters")
+
+    def __init__(self, name, start, stop=None, meters=None):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.meters = meters if meters is not None else {}
+
+    @property
+    def running(self):
+        return self.stop is None
+
+    def append(self, team, timestamp, watts, max_gap):
+        if timestamp < self.start or (self.stop is not None and timestamp > self.stop):
+            return
+        meter = self.meters.get(team)
+        if meter is None:
+            meter = self.meters[team] = EnergyMeter(max_gap)
+        meter.append(timestamp, watts)
+
+
+class EnergyLedger(object):
+    """
+    Energy of every team since the first sample and in named accounting windows. The
+    windows are kept in a JSON file: stopped ones with their totals, running ones with
+    their start only, as their energy is integrated again from the sample log on startup.
+    Of the stopped windows, the `max_windows` most recent ones are kept.
+    """
+
+    max_windows = 50
+
+    def __init__(self, path, max_gap):
+        """
+        Parameters
+        ----------
+        path : string
+            file the windows are kept in
+        max_gap : float
+            longest interval in seconds between two samples that is integrated
+        """
+        self.path = path
+        self.max_gap = max_gap
+        self.totals = {}
+        self.since = None
+        self.windows = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print("Could not read {}: {}".format(self.path, e), file=sys.stderr)
+            return
+        for item in data:
+            meters = {}
+            if item["stop"] is not None:
+                for team, (joules, seconds, gap) in item["teams"].items():
+                    meters[team] = EnergyMeter(self.max_gap, joules, seconds, gap)
+            self.windows.append(AccountingWindow(item["name"], item["start"], item["stop"], meters))
+
+    def save(self):
+        data = [
+            {
+                "name": window.name,
+                "start": window.start,
+                "stop": window.stop,
+                "teams": (
+                    {
+                        team: [meter.joules, meter.seconds, meter.gap]
+                        for team, meter in window.meters.items()
+                    }
+                    if not window.running
+                    else {}
+                ),
+            }
+            for window in self.windows
+        ]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def earliest_start(self):
+        """
+        Returns the start of the oldest running window, None if none is running.
+        """
+        return min((w.start for w in self.windows if w.running), default=None)
+
+    def append(self, team, timestamp, watts):
+        """
+        Adds a sample of a team's power to its total and its running windows.
+        """
+        if self.since is None:
+            self.since = timestamp
+        meter = self.totals.get(team)
+        if meter is None:
+            meter = self.totals[team] = EnergyMeter(self.max_gap)
+        meter.append(timestamp, watts)
+        for window in self.windows:
+            if window.running:
+                window.append(team, timestamp, watts, self.max_gap)
+
+    def window(self, name):
+        """
+        Returns the most recent window with the given name, None if there is none.
+        """
+        for window in reversed(self.windows):
+            if window.name == name:
+                return window
+        return None
+
+    def start(self, name, now):
+        """
+        Starts a window. Teams are measured from `now` on with their last power if it is
+        not older than `max_gap`.
+
+        Raises
+        ------
+        ValueError
+            if a window of that name is running
+        """
+        window = self.window(name)
+        if window is not None and window.running:
+            raise ValueError("Window {} is already running".format(name))
+        window = AccountingWindow(name, now)
+        for team, meter in self.totals.items():
+            if meter.last is not None and now - meter.last[0] <= self.max_gap:
+                window.append(team, now, meter.last[1], self.max_gap)
+        self.windows.append(window)
+        self.save()
+        return window
+
+    def stop(self, name, now):
+        """
+        Stops a running window. Teams are measured up to `now` with their last power.
+
+        Raises
+        ------
+        ValueError
+            if no window of that name is running
+        """
+        window = self.window(name)
+        if window is None or not window.running:
+            raise ValueError("No window {} is running".format(name))
+        for team, meter in window.meters.items():
+            if meter.last is not None:
+                last = self.totals[team].last
+                meter.append(now, last[1] if last is not None else meter.last[1])
+        window.stop = now
+        stopped = [w for w in self.windows if not w.running]
+        for old in stopped[: max(0, len(stopped) - self.max_windows)]:
+            self.windows.remove(old)
+        self.save()
+        return window
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+
+class EventLog(object):
+    """
+    Structured event log writing one JSON object per line. Events are queued without blocking
+    the caller and written in batches by a background task, whenever `flush_size` events are
+    queued or `flush_interval` seconds passed. The file is rotated once it exceeds `max_bytes`.
+    """
+
+    flush_interval = 1.0
+    flush_size = 100
+    max_bytes = 10 * 1024 * 1024
+    backups = 5
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.file = None
+
+    def log(self, event, team=None, ips=None, watts=None, **fields):
+        """
+        Queues an event. Starts the writer on first use.
+
+        Parameters
+        ----------
+        event : string
+            type of the event, e.g. "exceeding" or "reset"
+        team : string
+            team the event refers to
+        ips : [string, ...]
+            addresses of the PDUs the event refers to, as written in ips.csv
+        watts : int
+            power value of the event
+        fields : dict
+            additional JSON serializable fields
+        """
+        now = time.time()
+        record = {
+            "time": datetime.fromtimestamp(now).isoformat(timespec="milliseconds"),
+            "timestamp": now,
+            "event": event,
+            "team": team,
+            "ips": list(ips) if ips is not None else None,
+            "watts": watts,
+        }
+        record.update(fields)
+        self.queue.put_nowait(record)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        """
+        Writes all queued events and stops the writer.
+        """
+        if self.task is not None:
+            self.queue.put_nowait(None)
+            await self.task
+            self.task = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            batch = []
+            record = await self.queue.get()
+            deadline = loop.time() + self.flush_interval
+            while record is not None:
+                batch.append(record)
+                timeout = deadline - loop.time()
+                if len(batch) >= self.flush_size or timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            closing = record is None
+            if batch:
+                lines = "".join([json.dumps(r) + "\n" for r in batch])
+                try:
+                    await loop.run_in_executor(None, self.write, lines)
+                except OSError as e:
+                    print("Could not write event log: {}".format(e), file=sys.stderr)
+
+    def write(self, lines):
+        """
+        Appends the lines to the log, rotating it first if it would grow beyond max_bytes.
+        Runs in a worker thread.
+        """
+        data = lines.encode("utf-8")
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        if self.file.tell() > 0 and self.file.tell() + len(data) > self.max_bytes:
+            self.file.close()
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists("{}.{}".format(self.path, i)):
+                    os.replace("{}.{}".format(self.path, i), "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+            self.file = open(self.path, "ab")
+        self.file.write(data)
+        self.file.flush()
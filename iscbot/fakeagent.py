@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import asyncio
+import random
+import sys
+import time
+from bisect import bisect_right
+
+from backend import (
+    COUNTER32,
+    END_OF_MIB_VIEW,
+    FLAG_AUTH,
+    FLAG_PRIV,
+    FLAG_REPORTABLE,
+    GET_BULK_REQUEST,
+    GET_NEXT_REQUEST,
+    GET_REQUEST,
+    NO_SUCH_OBJECT,
+    OID_UNKNOWN_ENGINE_ID,
+    REPORT,
+    RESPONSE,
+    SET_REQUEST,
+    Backend,
+    SnmpError,
+    V3Message,
+    decode_integer,
+    decode_pdu,
+    decode_sequence,
+    decode_tlv,
+    encode_message,
+    encode_pdu,
+    encode_scoped_pdu,
+    encode_v3_message,
+    password_to_key,
+)
+from loads import OUTLETS, PHASES
+
+
+class FakeAgent(asyncio.DatagramProtocol):
+    """
+    Minimal SNMP agent serving a static OID table via SNMPv2c and SNMPv3 (SHA/AES) for
+    testing the backend without real Rack PDUs. GETBULK responses are truncated to
+    `max_size` bytes like on a real agent.
+    """
+
+    max_size = 1472
+
+    def __init__(self, values=None, community="public", users=None, engine_id=None):
+        """
+        Parameters
+        ----------
+        values : {string: object}
+            OID table, values are encoded like in backend.encode_value()
+        community : string
+            accepted SNMPv2c community
+        users : {string: (string, string)}
+            SNMPv3 users with their authentication and privacy passphrase
+        engine_id : bytes
+            authoritative engine ID, random if not given
+        """
+        self.values = dict(values or {})
+        self.community = community.encode("utf-8")
+        self.engine_id = engine_id or b"\x80\x00\x13\x18\x03" + random.randbytes(6)
+        self.boots = 1
+        self.started = time.monotonic()
+        self.keys = {}
+        for name, (auth_pass, priv_pass) in (users or {}).items():
+            self.keys[name.encode("utf-8")] = (
+                password_to_key(auth_pass, self.engine_id),
+                password_to_key(priv_pass or auth_pass, self.engine_id),
+            )
+        self.requests = 0
+        self.transport = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Starts serving on the given address and returns the bound (host, port).
+        """
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        return self.transport.get_extra_info("sockname")
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def engine_time(self):
+        return int(time.monotonic() - self.started)
+
+    def datagram_received(self, data, addr):
+        try:
+            response = self.handle(data)
+        except (SnmpError, ValueError, IndexError) as e:
+            print("Fake agent dropped request: {}".format(e), file=sys.stderr)
+            return
+        if response is not None:
+            self.reply(response, addr)
+
+    def reply(self, response, addr):
+        """
+        Sends a response, hook for delaying it.
+        """
+        if self.transport is not None:
+            self.transport.sendto(response, addr)
+
+    def handle(self, data):
+        """
+        Processes one request message and returns the encoded response or None.
+        """
+        self.requests += 1
+        _, body, _ = decode_tlv(data)
+        items = decode_sequence(body)
+        version = decode_integer(items[0][1])
+        if version == 3:
+            return self.handle_v3(V3Message(data))
+        if items[1][1] != self.community:
+            return None
+        pdu = self.process(decode_pdu(items[2][2]))
+        return encode_message(items[1][1], pdu, version)
+
+    def handle_v3(self, msg):
+        if msg.engine_id != self.engine_id:
+            # Engine discovery or an outdated engine ID, answer with our engine ID, boots and
+            # time. An encrypted request cannot be read, the message ID identifies it anyway.
+            request_id = 0 if msg.flags & FLAG_PRIV else decode_pdu(msg.scoped_pdu()[2])[1]
+            report = encode_pdu(REPORT, request_id, [(OID_UNKNOWN_ENGINE_ID, (COUNTER32, 1))])
+            return encode_v3_message(
+                msg.msg_id,
+                0,
+                self.engine_id,
+                self.boots,
+                self.engine_time(),
+                b"",
+                encode_scoped_pdu(self.engine_id, report),
+            )
+        if msg.user not in self.keys or msg.flags & (FLAG_AUTH | FLAG_PRIV) == 0:
+            return None
+        auth_key, priv_key = self.keys[msg.user]
+        if not msg.verify(auth_key):
+            return None
+        _, _, raw_pdu = msg.scoped_pdu(priv_key)
+        pdu = self.process(decode_pdu(raw_pdu))
+        flags = msg.flags & ~FLAG_REPORTABLE
+        return encode_v3_message(
+            msg.msg_id,
+            flags,
+            self.engine_id,
+            self.boots,
+            self.engine_time(),
+            msg.user,
+            encode_scoped_pdu(self.engine_id, pdu),
+            auth_key,
+            priv_key,
+            random.getrandbits(64),
+        )
+
+    def process(self, request):
+        """
+        Answers a decoded GET, GETNEXT or SET request PDU.
+        """
+        pdu_type, request_id, non_repeaters, max_repetitions, varbinds = request
+        result = []
+        if pdu_type == GET_REQUEST:
+            for oid, _ in varbinds:
+                result.append((oid, self.values.get(oid, (NO_SUCH_OBJECT, None))))
+        elif pdu_type == GET_NEXT_REQUEST:
+            ordered = sorted((oid_key(oid), oid) for oid in self.values)
+            for oid, _ in varbinds:
+                result.append(self.successor(ordered, oid))
+        elif pdu_type == GET_BULK_REQUEST:
+            ordered = sorted((oid_key(oid), oid) for oid in self.values)
+            for oid, _ in varbinds[:non_repeaters]:
+                result.append(self.successor(ordered, oid))
+            cursors = [oid for oid, _ in varbinds[non_repeaters:]]
+            for _ in range(max_repetitions if cursors else 0):
+                row = [self.successor(ordered, oid) for oid in cursors]
+                result.extend(row)
+                cursors = [oid for oid, _ in row]
+            # Drop trailing variable bindings until the response fits
+            while len(result) > 1 and len(encode_pdu(RESPONSE, request_id, result)) > self.max_size:
+                result = result[: len(result) * 3 // 4]
+        elif pdu_type == SET_REQUEST:
+            for oid, value in varbinds:
+                self.on_set(oid, value)
+            result = varbinds
+        else:
+            return encode_pdu(RESPONSE, request_id, varbinds, 5, 0)
+        return encode_pdu(RESPONSE, request_id, result)
+
+    def successor(self, ordered, oid):
+        """
+        Returns the variable binding following `oid` in the sorted (key, OID) pairs,
+        endOfMibView if there is none.
+        """
+        i = bisect_right(ordered, (oid_key(oid), "~"))
+        if i == len(ordered):
+            return oid, (END_OF_MIB_VIEW, None)
+        return ordered[i][1], self.values[ordered[i][1]]
+
+    def on_set(self, oid, value):
+        """
+        Hook for SET requests, stores the value by default.
+        """
+        self.values[oid] = value
+
+
+def oid_key(oid):
+    return tuple(int(arc) for arc in oid.strip(".").split("."))
+
+
+def apc_values(current=100, peak=200, timestamp="01/01/2024 00:00:00", outlets=8):
+    """
+    Returns an OID table with the APC Rack PDU values used by the backend. Power values are
+    given in 10 W units like on the real device. The phase table has a single phase, the
+    outlet table `outlets` rows sharing its power.
+    """
+    values = {
+        Backend.oid_current: current,
+        Backend.oid_peak: peak,
+        Backend.oid_peak_timestamp: timestamp,
+        Backend.oid_peak_reset: 1,
+    }
+    values.update(apc_tables(current, outlets))
+    return values
+
+
+def apc_tables(current, outlets=8, voltage=230):
+    """
+    Returns the phase and outlet table rows of a single phase PDU drawing `current` 10 W
+    units, spread evenly over its outlets.
+    """
+    values = {
+        PHASES.oid + ".5.1": current * 100 // voltage,
+        PHASES.oid + ".7.1": current,
+    }
+    for outlet in range(1, outlets + 1):
+        values[OUTLETS.oid + ".3." + str(outlet)] = "Outlet {}".format(outlet)
+        values[OUTLETS.oid + ".7." + str(outlet)] = current * 10 // outlets
+        values[OUTLETS.oid + ".8." + str(outlet)] = current * 10 // outlets
+    return values
+
+
+async def serve(path="ips.csv", subnet="127.0.1.", port=1161):
+    """
+    Serves one fake PDU per line of `path` on subnet + last octet.
+    """
+    agents = []
+    with open(path, "r") as f:
+        for line in f:
+            ip = int(line.split(",")[0])
+            agent = FakeAgent(
+                apc_values(random.randint(50, 500), random.randint(500, 600)),
+                users={"apc": ("authpassphrase", "privpassphrase")},
+            )
+            await agent.start(subnet + str(ip), port)
+            agents.append(agent)
+    print("Serving {} fake PDUs on {}x:{}".format(len(agents), subnet, port))
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(*sys.argv[1:2]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+OPEN = "open"
+
+
+class PduHealth(object):
+    """
+    Circuit breaker for a single PDU. After `open_after` consecutive failures the circuit
+    opens: the PDU is no longer polled and only probed with exponential backoff until it
+    answers again.
+    """
+
+    __slots__ = ("state", "failures", "backoff", "next_probe", "since")
+
+    open_after = 3
+    probe_backoff = 5.0
+    max_probe_backoff = 120.0
+
+    def __init__(self):
+        self.state = HEALTHY
+        self.failures = 0
+        self.backoff = self.probe_backoff
+        self.next_probe = 0.0
+        self.since = 0.0
+
+    def available(self):
+        """
+        Returns
+        -------
+        bool
+            True if the PDU may be polled in the regular poll cycle
+        """
+        return self.state != OPEN
+
+    def probe_due(self, now):
+        return self.state == OPEN and now >= self.next_probe
+
+    def success(self, now):
+        """
+        Records a successful request.
+
+        Returns
+        -------
+        bool
+            True if the PDU is reachable again after its circuit was open
+        """
+        recovered = self.state == OPEN
+        if self.state != HEALTHY:
+            self.since = now
+        self.state = HEALTHY
+        self.failures = 0
+        self.backoff = self.probe_backoff
+        return recovered
+
+    def failure(self, now):
+        """
+        Records a failed request and schedules the next probe if the circuit is open.
+
+        Returns
+        -------
+        bool
+            True if the circuit just opened
+        """
+        self.failures += 1
+        if self.state == OPEN:
+            self.backoff = min(self.backoff * 2, self.max_probe_backoff)
+            self.next_probe = now + self.backoff
+            return False
+        if self.failures >= self.open_after:
+            self.state = OPEN
+            self.since = now
+            self.next_probe = now + self.backoff
+            return True
+        if self.state == HEALTHY:
+            self.since = now
+        self.state = DEGRADED
+        return False
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import math
+import operator
+import re
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from itertools import repeat
+
+Stats = namedtuple("Stats", ["count", "min", "max", "mean", "p50", "p95"])
+
+DURATION_UNITS = {"s": 1, "m": 60, "min": 60, "h": 3600, "d": 86400}
+
+
+class RingBuffer(object):
+    """
+    Fixed-size time series of power values. Timestamps and values live in two preallocated
+    arrays, so memory use does not grow with the runtime of the bot. Once full, the oldest
+    entries are overwritten.
+    """
+
+    __slots__ = ("size", "times", "values", "count", "pos")
+
+    def __init__(self, size):
+        """
+        Parameters
+        ----------
+        size : int
+            maximum number of samples kept
+        """
+        self.size = size
+        self.times = array("d", bytes(8 * size))
+        self.values = array("i", bytes(4 * size))
+        self.count = 0
+        self.pos = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        """
+        Adds a sample. Timestamps must not decrease.
+        """
+        self.times[self.pos] = timestamp
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def latest(self):
+        """
+        Returns
+        -------
+        (float, int)
+            timestamp and value of the newest sample, None if empty
+        """
+        if self.count == 0:
+            return None
+        return self.times[self.pos - 1], self.values[self.pos - 1]
+
+    def window(self, since=None):
+        """
+        Returns all samples not older than `since` in chronological order.
+
+        Returns
+        -------
+        (array, array)
+            timestamps and values
+        """
+        if self.count < self.size:
+            segments = [(0, self.count)]
+        else:
+            segments = [(self.pos, self.size), (0, self.pos)]
+        times = array("d")
+        values = array("i")
+        for lo, hi in segments:
+            start = lo if since is None else bisect_left(self.times, since, lo, hi)
+            times += self.times[start:hi]
+            values += self.values[start:hi]
+        return times, values
+
+    def stats(self, since=None):
+        """
+        Computes minimum, maximum, mean, median and 95th percentile of all samples not older
+        than `since`.
+
+        Returns
+        -------
+        Stats
+            statistics of the window, None if it is empty
+        """
+        _, values = self.window(since)
+        if not values:
+            return None
+        ordered = sorted(values)
+        return Stats(
+            len(values),
+            ordered[0],
+            ordered[-1],
+            sum(values) / len(values),
+            percentile(ordered, 50),
+            percentile(ordered, 95),
+        )
+
+    def trend(self, since=None):
+        """
+        Fits a straight line through all samples not older than `since`.
+
+        Returns
+        -------
+        (float, float, float)
+            slope (per second), fitted value at the newest sample and its timestamp, None if
+            there are less than 3 samples
+        """
+        times, values = self.window(since)
+        return linear_fit(times, values)
+
+    def peak(self, since=None):
+        """
+        Returns
+        -------
+        (float, int)
+            timestamp and value of the maximum of all samples not older than `since` (the
+            earliest one if it was reached several times), None if there are none
+        """
+        times, values = self.window(since)
+        if not values:
+            return None
+        i = max(range(len(values)), key=values.__getitem__)
+        return times[i], values[i]
+
+
+class PeakTracker(object):
+    """
+    Tracks the peak of a power series sample by sample: the maximum since a start mark,
+    which a reset moves to the present, and the maximum of the last `window` seconds. The
+    latter is kept in a queue of decreasing values, so each sample costs amortized O(1).
+    """
+
+    __slots__ = ("window", "start", "peak", "recent")
+
+    def __init__(self, window, start=0.0):
+        """
+        Parameters
+        ----------
+        window : float
+            length of the sliding window in seconds
+        start : float
+            samples before this timestamp do not count for the peak since the start
+        """
+        self.window = window
+        self.start = start
+        self.peak = None
+        self.recent = deque()
+
+    def append(self, timestamp, value):
+        """
+        Adds a sample. Timestamps must not decrease.
+        """
+        if timestamp >= self.start and (self.peak is None or value > self.peak[1]):
+            self.peak = (timestamp, value)
+        recent = self.recent
+        while recent and recent[-1][1] < value:
+            recent.pop()
+        recent.append((timestamp, value))
+        self.expire(timestamp)
+
+    def expire(self, now):
+        recent = self.recent
+        while recent and recent[0][0] < now - self.window:
+            recent.popleft()
+
+    def reset(self, now):
+        """
+        Moves the start mark to `now`. The peak since then starts with the next sample, as
+        earlier readings may predate the reset.
+        """
+        self.start = now
+        self.peak = None
+
+    def since_start(self):
+        """
+        Returns
+        -------
+        (float, int)
+            timestamp and value of the peak since the start mark, None if there is no sample
+        """
+        return self.peak
+
+    def latest_window(self, now):
+        """
+        Returns
+        -------
+        (float, int)
+            timestamp and value of the peak of the last `window` seconds before `now`, None
+            if there is no sample
+        """
+        self.expire(now)
+        return self.recent[0] if self.recent else None
+
+
+def linear_fit(times, values):
+    """
+    Least squares fit of a straight line. The sums are computed with map() over the arrays,
+    so no per-sample python code runs.
+
+    Returns
+    -------
+    (float, float, float)
+        slope, fitted value at the last timestamp and the last timestamp, None if there are
+        less than 3 points or all timestamps are equal
+    """
+    n = len(times)
+    if n < 3:
+        return None
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    dt = array("d", map(operator.sub, times, repeat(mean_t, n)))
+    var = sum(map(operator.mul, dt, dt))
+    if var == 0:
+        return None
+    slope = sum(map(operator.mul, dt, values)) / var
+    return slope, mean_v + slope * dt[-1], times[-1]
+
+
+def percentile(ordered, q):
+    """
+    Nearest-rank percentile of an already sorted, non-empty sequence.
+    """
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def parse_duration(text):
+    """
+    Parses durations like '90s', '10m', '10min', '2h' or '1d'. Plain numbers are minutes.
+
+    Returns
+    -------
+    float
+        duration in seconds
+
+    Raises
+    ------
+    ValueError
+        if the text is no valid duration
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(s|m|min|h|d)?\s*", text.lower())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError("Invalid duration: {}".format(text))
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or "m"]
+
+
+def format_duration(seconds):
+    for unit, factor in (("d", 86400), ("h", 3600), ("min", 60)):
+        if seconds >= factor and seconds % factor == 0:
+            return "{} {}".format(int(seconds // factor), unit)
+    return "{:g} s".format(seconds)
+
+
+def parse_datetime(words, now=None):
+    """
+    Parses a point in time given as 'HH:MM[:SS]', optionally preceded by 'today',
+    'yesterday' or a date 'YYYY-MM-DD'.
+
+    Parameters
+    ----------
+    words : [string, ...]
+        the words of the time specification
+    now : datetime
+        reference for relative days, defaults to now
+
+    Returns
+    -------
+    datetime
+
+    Raises
+    ------
+    ValueError
+        if the words are no valid point in time
+    """
+    now = now or datetime.now()
+    if not 1 <= len(words) <= 2:
+        raise ValueError("Invalid time: {}".format(" ".join(words)))
+    fmt = "%H:%M:%S" if words[-1].count(":") == 2 else "%H:%M"
+    clock = datetime.strptime(words[-1], fmt).time()
+    day = now.date()
+    if len(words) == 2:
+        if words[0].lower() == "yesterday":
+            day -= timedelta(days=1)
+        elif words[0].lower() != "today":
+            day = datetime.strptime(words[0], "%Y-%m-%d").date()
+    return datetime.combine(day, clock)
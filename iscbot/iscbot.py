@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
+import sys
+import time
 from datetime import datetime
 from functools import wraps
 
@@ -12,6 +15,12 @@ from telegram.ext import CommandHandler, filters, MessageHandler
 from telegram.ext import Application
 
 from backend import Backend
+from dispatcher import Dispatcher, MessageEditor
+from history import parse_datetime, parse_duration
+from metrics import MetricsServer
+from poller import PollLoop
+from throttle import RateLimiter, SingleFlight
+from traps import TrapReceiver
 
 
 class ISCBot(object):
@@ -20,27 +29,54 @@ class ISCBot(object):
     queue = None
     pdus = None
     wait_for_reply = False
-    counter = 15
-    last_nr = []
-    last_msg = {}
 
-    # Chat IDs for permissions
-    ISC_grpID = 0
-    access_list = []
+    # Callback data of the inline keyboard button resetting all teams
+    RESET_ALL = "*all*"
+
+    # Seconds between checks of ips.csv and accesslist.conf for changes
+    reload_interval = 10
+
+    # Drives the limit checks, PDUs that have not answered after `check_deadline` seconds
+    # count as failed reads or, if not queried yet, are skipped until the next check. Must
+    # exceed the time the backend's SNMP client takes to give up on a PDU.
+    poller = None
+    check_deadline = 1.5
+
+    # Queue of outgoing notifications
+    dispatcher = None
+    # Debounces edits of progress messages
+    editor = None
+
+    # OpenMetrics endpoint http://<metrics_host>:<metrics_port>/metrics, disabled if None
+    metrics_host = "127.0.0.1"
+    metrics_port = None
+    metrics_server = None
+
+    # SNMP trap receiver, disabled if trap_port is None. With traps, polling slows down to a
+    # consistency sweep.
+    trap_host = "0.0.0.0"
+    trap_port = None
+    trap_community = "public"
+    traps = None
+    # team -> check started by a trap, and teams that sent another trap while it ran
+    trap_checks = None
+    trap_pending = None
+
+    # Concurrent identical commands share one backend call
+    flights = None
+    # Commands per second and burst allowed for each user and each chat
+    command_rate = 0.5
+    command_burst = 5
+    user_limit = None
+    chat_limit = None
 
     def __init__(self):
         print("Initialize frontend")
-        # Read in the chat IDs for the access group
-        with open("accesslist.conf", "r") as f:
-            for line in f:
-                try:
-                    tmp_id = int(line.lstrip().split()[0])
-                    self.access_list.append(tmp_id)
-                except (ValueError, IndexError) as e:
-                    continue
-        # First item is group ID
-        self.ISC_grpID = self.access_list.pop(0)
-        print("Successfully read in chat IDs!")
+        self.flights = SingleFlight()
+        self.trap_checks = {}
+        self.trap_pending = set()
+        self.user_limit = RateLimiter(self.command_rate, self.command_burst)
+        self.chat_limit = RateLimiter(self.command_rate, self.command_burst)
 
         # Initialize logging
         logging.basicConfig(
@@ -49,12 +85,32 @@ class ISCBot(object):
         # set higher logging level for httpx to avoid all GET and POST requests being logged
         logging.getLogger("httpx").setLevel(logging.WARNING)
         # Start backend
-        self.pdus = Backend(bot=self)
+        self.pdus = Backend(bot=self, keyboard=self.create_inline_keyboard)
         print("Successfully initialized backend!")
+        snmp_budget = self.pdus.snmp_timeout * (self.pdus.snmp_retries + 1)
+        if self.check_deadline <= snmp_budget:
+            raise ValueError(
+                "check_deadline ({} s) must exceed snmp_timeout * (snmp_retries + 1) ({} s)".format(
+                    self.check_deadline, snmp_budget
+                )
+            )
 
         # Start Bot
         self.application = (
-            Application.builder().token("565616615:AAHeVav01akOO_ox2RLED8jdLqMISLL-Hfc").build()
+            Application.builder()
+            .token("565616615:AAHeVav01akOO_ox2RLED8jdLqMISLL-Hfc")
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.shutdown)
+            .build()
+        )
+        self.dispatcher = Dispatcher(self.application.bot, self.pdus.metrics)
+        self.editor = MessageEditor()
+        self.poller = PollLoop(
+            self.check_limits,
+            period=self.pdus.scheduler.tick,
+            deadline=self.check_deadline,
+            metrics=self.pdus.metrics,
         )
         app = self.application
         self.queue = self.application.job_queue
@@ -78,6 +134,27 @@ class ISCBot(object):
         peak_dates_handler = CommandHandler("peakdates", self.peak_dates)
         app.add_handler(peak_dates_handler)
 
+        history_handler = CommandHandler("history", self.history)
+        app.add_handler(history_handler)
+
+        avg_handler = CommandHandler("avg", self.average)
+        app.add_handler(avg_handler)
+
+        at_handler = CommandHandler("at", self.power_at)
+        app.add_handler(at_handler)
+
+        phases_handler = CommandHandler("phases", self.phases)
+        app.add_handler(phases_handler)
+
+        outlets_handler = CommandHandler("outlets", self.outlets)
+        app.add_handler(outlets_handler)
+
+        energy_handler = CommandHandler("energy", self.energy)
+        app.add_handler(energy_handler)
+
+        status_handler = CommandHandler("status", self.status)
+        app.add_handler(status_handler)
+
         # reset_handler = CommandHandler('reset', self.reset_pdu)
         # app.add_handler(reset_handler)
 
@@ -91,82 +168,358 @@ class ISCBot(object):
         unknw_handler = MessageHandler(filters.COMMAND, self.unknown)
         app.add_handler(unknw_handler)
 
+    # Chat IDs for permissions, read from accesslist.conf by the backend
+    @property
+    def ISC_grpID(self):
+        return self.pdus.topology.group_id
+
+    @property
+    def access_list(self):
+        return self.pdus.topology.access_list
+
+    async def reload_config(self, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Picks up changes of ips.csv and accesslist.conf.
+        """
+        await self.pdus.reload_topology()
+
+    async def post_init(self, application):
+        """
+        Resolves the hostnames of the PDUs and starts the limit checks, and the metrics
+        endpoint and the trap receiver if their ports are configured.
+        """
+        if self.trap_port is not None:
+            self.traps = TrapReceiver(self.on_trap, self.trap_community)
+            await self.traps.start(self.trap_host, self.trap_port)
+            scheduler = self.pdus.scheduler
+            scheduler.min_interval = max(scheduler.min_interval, scheduler.sweep_interval)
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(lambda: self.pdus.metrics.render(self.pdus))
+            await self.metrics_server.start(self.metrics_host, self.metrics_port)
+        await self.pdus.resolve_hosts()
+        self.poller.start()
+
+    async def post_stop(self, application):
+        """
+        Stops the limit checks and delivers queued notifications before the bot shuts down.
+        """
+        await self.poller.stop()
+        while self.trap_checks:
+            await asyncio.wait(list(self.trap_checks.values()))
+        await self.dispatcher.close()
+
+    async def shutdown(self, application):
+        """
+        Flushes the event log and stops the metrics endpoint and the poller workers when the
+        bot stops.
+        """
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        if self.traps is not None:
+            self.traps.close()
+        await self.pdus.events.close()
+        self.pdus.close()
+
     # -------Permission Config--------#
     def restricted(func):
         @wraps(func)
-        def wrapped(self, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        async def wrapped(
+            self, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs
+        ):
             user_id = update.effective_user.id
             chat_id = update.effective_message.chat.id
-            if user_id not in self.access_list and chat_id != self.ISC_grpID:
+            if not self.pdus.topology.allowed(user_id, chat_id):
                 print("Unauthorized access denied for {}.".format(user_id))
                 return
-            return func(self, update, context, *args, **kwargs)
+            return await func(self, update, context, *args, **kwargs)
+
+        return wrapped
+
+    def throttled(func):
+        """
+        Drops commands of users and chats that exceed their rate limit. The first dropped
+        command is answered with a note, further ones are ignored silently.
+        """
+
+        @wraps(func)
+        async def wrapped(
+            self, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs
+        ):
+            user_id = update.effective_user.id
+            chat_id = update.effective_chat.id
+            user_ok = self.user_limit.allow(user_id)
+            chat_ok = self.chat_limit.allow(chat_id)
+            if user_ok and chat_ok:
+                return await func(self, update, context, *args, **kwargs)
+            print("Rate limit exceeded by {} in {}.".format(user_id, chat_id))
+            limit, key = (self.chat_limit, chat_id) if user_ok else (self.user_limit, user_id)
+            if limit.warn(key):
+                text = "Too many requests, please try again in a few seconds."
+                if update.callback_query is not None:
+                    await update.callback_query.answer(text=text)
+                else:
+                    await update.effective_message.reply_text(text=text)
 
         return wrapped
 
     # ---------Main functions---------#
+    @throttled
     async def current(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Gets current power usage of all teams from backend and sends it to the user.
         """
-        await update.message.reply_text(text=self.pdus.current())
+        text = await self.flights.run("current", self.pdus.current)
+        await update.message.reply_text(text=text)
 
+    @throttled
     async def peaks(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Gets the peak power values of all teams from backend and sends it to the user.
+        Start via /peaks [window] for the peaks of the last window, e.g. /peaks 10m.
         """
-        await update.message.reply_text(text=self.pdus.peaks())
+        window = await self.peak_window(update, context, "peaks")
+        if window is not False:
+            text = await self.flights.run(("peaks", window), self.pdus.peaks, window)
+            await update.message.reply_text(text=text)
 
+    @throttled
     async def peak_dates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Gets the peak power values of all teams with corresponding timestamps from backend
-        and sends it to the user.
+        and sends it to the user. Start via /peakdates [window].
+        """
+        window = await self.peak_window(update, context, "peakdates")
+        if window is not False:
+            text = await self.flights.run(("peak_dates", window), self.pdus.peak_dates, window)
+            await update.message.reply_text(text=text)
+
+    async def peak_window(self, update, context, command):
         """
-        await update.message.reply_text(text=self.pdus.peak_dates())
+        Parses the optional window of /peaks and /peakdates.
 
-    async def check_limits(self, context: ContextTypes.DEFAULT_TYPE):
+        Returns
+        -------
+        float
+            window in seconds, None if not given and False if invalid
         """
-        Gets list of all teams off the power limit from the backend and sends push notifications.
-        Possible ways for sending it: a) First user in access list, b) in the group.
+        if not context.args:
+            return None
+        try:
+            return parse_duration(" ".join(context.args))
+        except ValueError:
+            await update.message.reply_text(
+                text="Usage: /{} [window], e.g. /{} 10m".format(command, command)
+            )
+            return False
+
+    @throttled
+    async def history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends power statistics of the recent history of a team. Start via /history <team>.
+        """
+        team = " ".join(context.args)
+        if team not in self.pdus.teams:
+            await update.message.reply_text(text="Usage: /history <team>\n" + self.team_names())
+            return
+        await update.message.reply_text(text=self.pdus.history(team))
+
+    @throttled
+    async def phases(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends the power of each phase of the PDUs of a team. Start via /phases <team>.
+        """
+        team = " ".join(context.args)
+        if team not in self.pdus.teams:
+            await update.message.reply_text(text="Usage: /phases <team>\n" + self.team_names())
+            return
+        text = await self.flights.run(("phases", team), self.pdus.phases, team)
+        await update.message.reply_text(text=text)
+
+    @throttled
+    async def outlets(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends the power of each outlet of the PDUs of a team. Start via /outlets <team>.
+        """
+        team = " ".join(context.args)
+        if team not in self.pdus.teams:
+            await update.message.reply_text(text="Usage: /outlets <team>\n" + self.team_names())
+            return
+        text = await self.flights.run(("outlets", team), self.pdus.outlets, team)
+        await update.message.reply_text(text=text)
+
+    @throttled
+    async def average(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends the mean power of a team over a time window. Start via /avg <team> <window>.
+        """
+        team = " ".join(context.args[:-1])
+        try:
+            window = parse_duration(context.args[-1])
+        except (ValueError, IndexError):
+            window = None
+        if team not in self.pdus.teams or window is None:
+            await update.message.reply_text(
+                text="Usage: /avg <team> <window>, e.g. /avg Team-1 10m\n" + self.team_names()
+            )
+            return
+        await update.message.reply_text(text=self.pdus.average(team, window))
+
+    @throttled
+    async def power_at(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
-        exceeders, not_reachable = self.pdus.check_exceedings()
+        Sends the power of a team at a point in time from the sample log.
+        Start via /at <team> [yesterday|today|YYYY-MM-DD] <HH:MM>.
+        """
+        when = None
+        for n in (2, 1):
+            team = " ".join(context.args[:-n])
+            try:
+                when = parse_datetime(context.args[-n:])
+            except ValueError:
+                continue
+            if team in self.pdus.teams:
+                break
+            when = None
+        if when is None:
+            await update.message.reply_text(
+                text="Usage: /at <team> [yesterday|today|YYYY-MM-DD] <HH:MM>\n" + self.team_names()
+            )
+            return
+        await update.message.reply_text(text=self.pdus.power_at(team, when))
+
+    @throttled
+    async def energy(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends the energy of all teams or of one team in every accounting window. Start via
+        /energy [team], windows are started and stopped via /energy start|stop <name>.
+        """
+        args = context.args
+        if args and args[0] in ("start", "stop") and len(args) == 2:
+            await self.energy_window(update, context)
+            return
+        team = " ".join(args)
+        if team and team not in self.pdus.teams:
+            await update.message.reply_text(
+                text="Usage: /energy [team] or /energy start|stop <name>\n" + self.team_names()
+            )
+            return
+        await update.message.reply_text(text=self.pdus.energy_report(team or None))
+
+    @restricted
+    async def energy_window(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Starts or stops an accounting window.
+        """
+        action, name = context.args
+        if action == "start":
+            text = self.pdus.start_energy_window(name)
+        else:
+            text = self.pdus.stop_energy_window(name)
+        await update.message.reply_text(text=text)
+
+    @throttled
+    @restricted
+    async def status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Sends the statistics of the limit checks and the polling.
+        """
+        pdus = self.pdus
+        scheduler = pdus.scheduler
+        longest = max(scheduler.intervals.values(), default=scheduler.default_interval)
+        out = self.poller.report()
+        if pdus.samples_time:
+            out += "Oldest reading: {:.1f} s\n".format(time.time() - pdus.samples_time)
+        out += "Skipped in the last cycle: {} PDUs\n".format(len(pdus.skipped))
+        out += "Longest poll interval: {:.1f} s\n".format(longest)
+        await update.message.reply_text(text=out)
+
+    def team_names(self):
+        return "Teams: " + ", ".join(self.pdus.topology.team_order)
+
+    async def check_limits(self, deadline):
+        """
+        Gets list of all teams off the power limit and of teams approaching it from the backend
+        and sends push notifications. PDUs going down or coming back are notified the same way.
+        The notifications of one check are sent as a single message to the group and to every
+        user in the access list. Delivery runs in the background, the check does not wait for
+        it. Run by the poller, PDUs that have not answered by `deadline` are skipped.
+        """
+        await self.check(deadline=deadline)
+
+    async def check(self, ips=None, deadline=None):
+        """
+        Checks the PDUs due for polling, or the given ones, and queues the notifications.
+        """
+        exceeders, not_reachable = await self.pdus.check_exceedings(ips, deadline)
+        if ips is None:
+            exceeders += self.pdus.check_trends()
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + "\n"
-        self.counter += 1
-        bot = context.bot
-        if len(exceeders) > 0:
-            for ex in exceeders:
+        if len(exceeders + not_reachable) > 0:
+            for ex in exceeders + not_reachable:
                 print(now + ex)
-                # for all users in the access list
-                # for chat in self.access_list:
-                #    await bot.send_message(chat_id=chat, text=ex)
-                # for the first user in the access list
-                await bot.send_message(chat_id=self.access_list[0], text=ex)
-
-                # Additionally, log in file
-                with open("exceedings.log", "a") as f:
-                    f.write((now + "--- " + ex).replace("\n", " ") + "\n")
-        # if(len(not_reachable) > 0 and self.counter > 15 ):
-        #    self.counter = 0
-        #    for nr in not_reachable:
-        #        if(nr in self.last_nr):
-        #            self.last_nr.remove(nr)
-        #            print(now + nr)
-        # bot.send_message(chat_id=self.access_list[0], text=nr)
-
-        # Additionally, log in file
-        #            with open('exceedings.log', 'a') as f:
-        #                f.write((now + '--- ' + nr).replace('\n', ' ') + '\n')
-        #        else:
-        #            self.last_nr.append(nr)
+            self.dispatcher.submit(self.alert_chats(), exceeders + not_reachable)
+
+    def on_trap(self, host, trap_oid, varbinds):
+        """
+        Checks the team of a PDU that sent a trap right away. The check may already have
+        polled the PDUs when another trap of the team arrives, so it runs once more after it
+        finished. Traps arriving in the meantime share that second check.
+        """
+        team = self.pdus.team_of(host)
+        if team is None:
+            print("Ignored trap {} from unknown host {}.".format(trap_oid, host))
+            return
+        print("Trap {} from {}({}).".format(trap_oid, team, host))
+        if team in self.trap_checks:
+            self.trap_pending.add(team)
+        else:
+            self.check_team(team)
+
+    def check_team(self, team):
+        """
+        Starts the check of a team after a trap, see on_trap().
+        """
+        self.trap_pending.discard(team)
+        task = asyncio.ensure_future(self.check(list(self.pdus.teams[team])))
+        self.trap_checks[team] = task
+        task.add_done_callback(lambda task: self.team_checked(team, task))
+
+    def team_checked(self, team, task):
+        """
+        Logs the error of a finished check of a team, and checks the team again if another
+        trap arrived while it ran.
+        """
+        del self.trap_checks[team]
+        if task.cancelled():
+            self.trap_pending.discard(team)
+            return
+        if task.exception() is not None:
+            print(
+                "Check of {} after trap failed: {!r}".format(team, task.exception()),
+                file=sys.stderr,
+            )
+        if team in self.trap_pending:
+            if team in self.pdus.teams:
+                self.check_team(team)
+            else:
+                self.trap_pending.discard(team)
 
+    def alert_chats(self):
+        """
+        Returns the group and all users of the access list.
+        """
+        topology = self.pdus.topology
+        chats = [topology.group_id] if topology.group_id else []
+        return chats + [chat for chat in topology.access_list if chat != topology.group_id]
+
+    @throttled
     @restricted
     async def reset_pdu_inline(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Resets the peak power of PDU for certain IP address via new inline KeyboardMarkup.
         """
-        txt = "Please choose the team to reset their PDU: "
-        markup = InlineKeyboardMarkup(inline_keyboard=self.create_inline_keyboard())
-        await update.message.reply_text(text=txt, reply_markup=markup)
+        txt = "Please choose the team to reset their PDUs or reset all teams at once: "
+        await update.message.reply_text(text=txt, reply_markup=self.pdus.topology.keyboard)
 
     # --------------------------------#
 
@@ -178,6 +531,7 @@ class ISCBot(object):
             text="Hello Group from {}".format(update.message.from_user.first_name),
         )
 
+    @throttled
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Starting point for everybody texting ISCBot for the first time. Start via /start.
@@ -190,6 +544,7 @@ class ISCBot(object):
             )
         )
 
+    @throttled
     async def get_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         List of all commands and brief explanations. Start via /help.
@@ -202,44 +557,68 @@ class ISCBot(object):
 
         await update.message.reply_text(text=helptext, parse_mode=ParseMode.MARKDOWN_V2)
 
+    @throttled
     async def unknown(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         Default output for invalid commands or other messages in private chat.
         """
         await update.message.reply_text("Sorry, I didn't understand that command.")
 
+    @throttled
     @restricted
     async def cb_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
-        Helper function for resetting the Rack PDUs.
+        Helper function for resetting the Rack PDUs of one team or of all teams at once.
         """
         query = update.callback_query
-        team = query.data
+        topology = self.pdus.topology
+        if query.data == self.RESET_ALL:
+            teams = list(topology.team_order)
+            name = "all teams"
+        elif query.data not in topology.teams:
+            await context.bot.answer_callback_query(
+                callback_query_id=query.id, text="Unknown team, please use /reset again."
+            )
+            return False
+        else:
+            teams = [query.data]
+            name = query.data
         await context.bot.answer_callback_query(
             callback_query_id=query.id,
-            text=("Resetting PDU of {}. " + "Please wait until the bot replies...").format(team),
+            text=("Resetting PDUs of {}. " + "Please wait until the bot replies...").format(name),
         )
 
         progress_msg = await context.bot.send_message(
             chat_id=query.message.chat_id,
-            text="Start resetting PDU of {}".format(team),
-            parse_mode=ParseMode.MARKDOWN_V2,
+            text="Start resetting PDUs of {}".format(name),
         )
-        if await self.pdus.reset(team, context, progress_msg):
+
+        async def progress(status):
+            await self.edit_message_text_wrapper(
+                context.bot,
+                progress_msg.chat_id,
+                progress_msg.message_id,
+                self.pdus.reset_report(status),
+            )
+
+        status = await self.pdus.reset_teams(teams, progress)
+        failed = []
+        for team in teams:
+            ips = topology.ip_lists[team]
+            if any(status[ip] != "done" for ip in topology.teams[team]):
+                failed.append("{} ({})".format(team, ips))
+        if not failed:
             # In case of success, remove progress message
+            self.editor.discard(progress_msg.chat_id, progress_msg.message_id)
             await context.bot.delete_message(progress_msg.chat_id, progress_msg.message_id)
-            ips = ", ".join([str(ip) for ip in sorted(self.pdus.teams[team].keys())])
             await self.edit_message_text_wrapper(
                 context.bot,
                 query.message.chat_id,
                 query.message.message_id,
-                ("Peak Power of PDU of team {} ({}) successfully " + "reset.").format(team, ips),
+                "Peak Power of PDUs of {} successfully reset.".format(
+                    name if len(teams) > 1 else "team {} ({})".format(name, ips)
+                ),
             )
-            # Additionally, log in file
-            ex = team + " (." + ips + "): Reset\n"
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open("exceedings.log", "a") as f:
-                f.write(now + " --- " + ex)
             return True
         else:
             await self.edit_message_text_wrapper(
@@ -247,50 +626,40 @@ class ISCBot(object):
                 query.message.chat_id,
                 query.message.message_id,
                 (
-                    "Something went wrong during resetting PDU of team {} ({}). You "
+                    "Something went wrong during resetting PDUs of {}. You "
                     + "might want to try it again!"
-                ).format(team, ips),
+                ).format(", ".join(failed)),
             )
             return False
 
-    # Avoid telegram.error.BadRequest
+    # Avoid telegram.error.BadRequest and flooding with progress updates
     async def edit_message_text_wrapper(self, bot, chat_id, message_id, text, parse_mode=None):
+        """
+        Edits a message through the editor, which skips unchanged texts and limits the edits
+        per message. Returns without waiting for the edit.
+        """
         if parse_mode == "md":
             parse_mode = ParseMode.MARKDOWN_V2
-        if (
-            "chat_id" not in self.last_msg
-            or self.last_msg["chat_id"] != chat_id
-            or self.last_msg["message_id"] != message_id
-            or self.last_msg["text"] != text
-        ):
-            # Change message
-            self.last_msg["chat_id"] = chat_id
-            self.last_msg["message_id"] = message_id
-            self.last_msg["text"] = text
-            await bot.edit_message_text(
-                chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode
-            )
-            return
-        else:
-            # Nothing to do
-            return
+        self.editor.update(bot, chat_id, message_id, text, parse_mode)
 
-    def create_inline_keyboard(self):
+    def create_inline_keyboard(self, topology):
         """
-        Creates dynamically an inline keyboard layout for markup.
+        Creates the inline keyboard markup for resetting the teams of a topology. It is built
+        once whenever the topology is loaded.
         """
         i = 0
         keyb = []
         tmp = []
         # If we don't need to reset HPCAC PDU, we don't show it here with ...ips[:-1]
-        for team in sorted(self.pdus.teams):
+        for team in topology.team_order:
             i += 1
             tmp.append(InlineKeyboardButton(str(team), callback_data=str(team)))
             if i % 4 == 0:
                 keyb.append(tmp)
                 tmp = []
         keyb.append(tmp)
-        return keyb
+        keyb.append([InlineKeyboardButton("All teams", callback_data=self.RESET_ALL)])
+        return InlineKeyboardMarkup(inline_keyboard=keyb)
 
 
 # -------Main method-------#
@@ -300,9 +669,11 @@ def main():
     VERSION = "1.6"
     print("Start ISCBot v{}".format(VERSION))
     iscbot = ISCBot()
-    # Create repeating check for power limits
-    check_job = iscbot.queue.run_repeating(iscbot.check_limits, interval=2, first=0)
-    # disable logging of running check job
+    # Reload the configuration files when they change
+    iscbot.queue.run_repeating(
+        iscbot.reload_config, interval=iscbot.reload_interval, first=iscbot.reload_interval
+    )
+    # disable logging of the configuration reload job
     logging.getLogger("apscheduler.scheduler").setLevel(logging.ERROR)
     logging.getLogger("apscheduler.executors.default").setLevel(logging.ERROR)
     # Start polling
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+from array import array
+
+
+class LoadTable(object):
+    """
+    Readings of one table of a PDU in columnar form: the row indices and one array per
+    column, all in the same row order.
+    """
+
+    __slots__ = ("time", "index", "columns")
+
+    def __init__(self, time, index, columns):
+        """
+        Parameters
+        ----------
+        time : float
+            timestamp of the reading
+        index : [string, ...]
+            row indices, the OID suffixes of the rows
+        columns : {string: array or list}
+            values of each column by name
+        """
+        self.time = time
+        self.index = index
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def total(self, name):
+        return sum(self.columns[name])
+
+
+class Table(object):
+    """
+    An APC table read with a GETBULK walk of some of its columns. Each column is given as
+    (name, column number, scale): numbers are multiplied by the scale, text columns have a
+    scale of None.
+    """
+
+    def __init__(self, name, oid, columns):
+        self.name = name
+        self.oid = oid
+        self.columns = columns
+
+    def column_oids(self):
+        return [self.oid + "." + str(number) for _, number, _ in self.columns]
+
+    def parse(self, time, walked):
+        """
+        Converts the result of SnmpClient.walk() into a LoadTable. Rows are those of the
+        first column, cells missing in other columns are 0 or empty.
+
+        Returns
+        -------
+        LoadTable
+            the readings
+        """
+        oids = self.column_oids()
+        index = [row for row, _ in walked[oids[0]]]
+        columns = {}
+        for oid, (name, _, scale) in zip(oids, self.columns):
+            cells = dict(walked[oid])
+            if scale is None:
+                columns[name] = [
+                    cells[row].decode("utf-8", "replace") if row in cells else "" for row in index
+                ]
+            else:
+                column = array("i" if isinstance(scale, int) else "d")
+                column.extend(cells.get(row, 0) * scale for row in index)
+                columns[name] = column
+        return LoadTable(time, index, columns)
+
+
+# rPDU2PhaseStatusTable: current in 0.1 A, power in 0.01 kW
+PHASES = Table("phases", ".1.3.6.1.4.1.318.1.1.26.6.3.1", [("current", 5, 0.1), ("power", 7, 10)])
+# rPDU2OutletMeteredStatusTable: power and peak power in W
+OUTLETS = Table(
+    "outlets",
+    ".1.3.6.1.4.1.318.1.1.26.9.4.3.1",
+    [("name", 3, None), ("power", 7, 1), ("peak", 8, 1)],
+)
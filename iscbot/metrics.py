@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+from bisect import bisect_left
+
+# Buckets in seconds
+SNMP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CYCLE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed bucket bounds, as exposed by Prometheus.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """
+    Instrumentation of the bot's hot path. Everything is updated in place by the code being
+    measured, so serving the metrics costs no SNMP request.
+    """
+
+    def __init__(self):
+        self.snmp_rtt = Histogram(SNMP_BUCKETS)
+        self.snmp_timeouts = 0
+        self.snmp_retransmits = 0
+        self.poll_duration = Histogram(CYCLE_BUCKETS)
+        self.polled_pdus = 0
+        self.skipped_pdus = 0
+        self.check_duration = Histogram(CYCLE_BUCKETS)
+        self.cycle_drift = Histogram(CYCLE_BUCKETS)
+        self.check_overruns = 0
+        self.telegram_send = Histogram(CYCLE_BUCKETS)
+        self.telegram_errors = 0
+
+    def render(self, backend):
+        """
+        Formats the latest readings of the backend and the instrumentation in the OpenMetrics
+        text format.
+
+        Returns
+        -------
+        string
+            the exposition, terminated by '# EOF'
+        """
+        out = []
+        topology = backend.topology
+        samples = backend.samples
+        pdus = [(ip, samples.get(ip)) for ip in topology.ips]
+
+        def labels(ip):
+            team = topology.ip_dict[ip]
+            return 'ip="{}",name="{}",team="{}"'.format(
+                escape(topology.display[ip]), escape(topology.teams[team][ip]), escape(team)
+            )
+
+        family(out, "iscbot_pdu_up", "gauge", "1 if the latest poll of the PDU succeeded")
+        for ip, sample in pdus:
+            out.append("iscbot_pdu_up{{{}}} {}".format(labels(ip), int(bool(sample and sample.ok))))
+        for name, field, text in (
+            ("iscbot_pdu_power_watts", "current", "Current power of the PDU"),
+            ("iscbot_pdu_peak_watts", "peak", "Peak power reported by the PDU"),
+        ):
+            family(out, name, "gauge", text)
+            for ip, sample in pdus:
+                if sample is not None and sample.ok:
+                    out.append("{}{{{}}} {}".format(name, labels(ip), getattr(sample, field)))
+        family(out, "iscbot_pdu_sample_timestamp_seconds", "gauge", "Time of the latest poll")
+        for ip, sample in pdus:
+            if sample is not None:
+                out.append(
+                    "iscbot_pdu_sample_timestamp_seconds{{{}}} {:.3f}".format(
+                        labels(ip), sample.time
+                    )
+                )
+        for name, field, text in (
+            ("iscbot_team_power_watts", "current", "Current power of the team"),
+            ("iscbot_team_peak_watts", "peak", "Sum of the peak power of the team's PDUs"),
+        ):
+            family(out, name, "gauge", text)
+            for team in topology.team_order:
+                total = backend.team_sum(team, samples, field)
+                if total >= 0:
+                    out.append('{}{{team="{}"}} {}'.format(name, escape(team), total))
+        family(out, "iscbot_phase_power_watts", "gauge", "Power of a phase, from the last /phases")
+        for ip, _ in pdus:
+            table = backend.loads.get(("phases", ip))
+            if table is None:
+                continue
+            for row, power in zip(table.index, table["power"]):
+                out.append(
+                    'iscbot_phase_power_watts{{{},phase="{}"}} {}'.format(labels(ip), row, power)
+                )
+        family(
+            out, "iscbot_outlet_power_watts", "gauge", "Power of an outlet, from the last /outlets"
+        )
+        for ip, _ in pdus:
+            table = backend.loads.get(("outlets", ip))
+            if table is None:
+                continue
+            for row, name, power in zip(table.index, table["name"], table["power"]):
+                out.append(
+                    'iscbot_outlet_power_watts{{{},outlet="{}",outlet_name="{}"}} {}'.format(
+                        labels(ip), row, escape(name), power
+                    )
+                )
+        family(out, "iscbot_power_limit_watts", "gauge", "Power limit per team")
+        out.append("iscbot_power_limit_watts {}".format(backend.LIMIT))
+
+        histogram(out, "iscbot_snmp_rtt_seconds", "SNMP round-trip time", self.snmp_rtt)
+        counter(out, "iscbot_snmp_timeouts", "SNMP requests without response", self.snmp_timeouts)
+        counter(out, "iscbot_snmp_retransmits", "SNMP requests sent again", self.snmp_retransmits)
+        histogram(
+            out, "iscbot_poll_duration_seconds", "Duration of a poll cycle", self.poll_duration
+        )
+        counter(out, "iscbot_polled_pdus", "PDUs polled", self.polled_pdus)
+        counter(
+            out,
+            "iscbot_skipped_pdus",
+            "PDUs that missed the deadline of their cycle",
+            self.skipped_pdus,
+        )
+        histogram(
+            out,
+            "iscbot_check_limits_duration_seconds",
+            "Duration of a limit check",
+            self.check_duration,
+        )
+        histogram(
+            out,
+            "iscbot_check_limits_drift_seconds",
+            "Delay of the start of a limit check",
+            self.cycle_drift,
+        )
+        counter(
+            out,
+            "iscbot_check_limits_overruns",
+            "Limit checks that took longer than their interval",
+            self.check_overruns,
+        )
+        histogram(
+            out,
+            "iscbot_telegram_send_seconds",
+            "Latency of sending a Telegram message",
+            self.telegram_send,
+        )
+        counter(
+            out, "iscbot_telegram_errors", "Telegram messages that failed", self.telegram_errors
+        )
+        out.append("# EOF\n")
+        return "\n".join(out)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def family(out, name, kind, text):
+    out.append("# TYPE {} {}".format(name, kind))
+    out.append("# HELP {} {}".format(name, text))
+
+
+def counter(out, name, text, value):
+    family(out, name, "counter", text)
+    out.append("{}_total {}".format(name, value))
+
+
+def histogram(out, name, text, hist):
+    family(out, name, "histogram", text)
+    total = 0
+    for bound, count in zip(hist.bounds, hist.counts):
+        total += count
+        out.append('{}_bucket{{le="{}"}} {}'.format(name, bound, total))
+    out.append('{}_bucket{{le="+Inf"}} {}'.format(name, hist.count))
+    out.append("{}_count {}".format(name, hist.count))
+    out.append("{}_sum {}".format(name, hist.sum))
+
+
+class MetricsServer(object):
+    """
+    Minimal HTTP server answering GET /metrics with the output of `render`.
+    """
+
+    # seconds a client may take to send its request
+    timeout = 5.0
+
+    def __init__(self, render):
+        """
+        Parameters
+        ----------
+        render : function
+            returns the current exposition as a string
+        """
+        self.render = render
+        self.server = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        print("Serving metrics on http://{}:{}/metrics".format(host, port))
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), self.timeout)
+            # Skip the headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, self.render()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+            data = body.encode("utf-8")
+            writer.write(
+                (
+                    "HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+                    + "Connection: close\r\n\r\n"
+                )
+                .format(status, content_type, len(data))
+                .encode("ascii")
+                + data
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            print("Could not serve metrics: {}".format(e), file=sys.stderr)
+        finally:
+            writer.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+import time
+from collections import deque
+
+from history import percentile
+
+
+class PollLoop(object):
+    """
+    Runs the limit check cycle every `period` seconds. Cycles never overlap: a cycle that
+    overruns its period delays the next one, and the ticks it covered are skipped instead of
+    being run back to back. Every cycle gets a deadline, PDUs that have not answered by then
+    are skipped. Drift, durations and overruns are recorded.
+    """
+
+    # number of recent cycles kept for percentiles
+    keep = 1000
+
+    def __init__(self, cycle, period, deadline, metrics=None):
+        """
+        Parameters
+        ----------
+        cycle : coroutine function
+            the check, awaited with the deadline of the cycle in event loop time
+        period : float
+            seconds between the starts of two cycles
+        deadline : float
+            seconds a cycle may take
+        metrics : Metrics
+            receives the cycle durations, drift and overruns
+        """
+        self.cycle = cycle
+        self.period = period
+        self.deadline = deadline
+        self.metrics = metrics
+        self.task = None
+        self.cycles = 0
+        self.errors = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.durations = deque(maxlen=self.keep)
+        self.drifts = deque(maxlen=self.keep)
+        self.max_duration = 0.0
+        self.max_drift = 0.0
+        self.last_end = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_start = loop.time()
+        while True:
+            wait = next_start - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start = loop.time()
+            try:
+                await self.cycle(start + self.deadline)
+            except Exception as e:
+                self.errors += 1
+                print("Limit check failed: {!r}".format(e), file=sys.stderr)
+            end = loop.time()
+            self.record(start - next_start, end - start)
+            next_start += self.period
+            if end > next_start:
+                # Overrun: skip the ticks the cycle covered and start the next one right away
+                self.overruns += 1
+                self.skipped_ticks += int((end - next_start) // self.period)
+                next_start = end
+                if self.metrics is not None:
+                    self.metrics.check_overruns += 1
+
+    def record(self, drift, duration):
+        self.cycles += 1
+        self.durations.append(duration)
+        self.drifts.append(drift)
+        self.max_duration = max(self.max_duration, duration)
+        self.max_drift = max(self.max_drift, drift)
+        self.last_end = time.time()
+        if self.metrics is not None:
+            self.metrics.check_duration.observe(duration)
+            self.metrics.cycle_drift.observe(max(0.0, drift))
+
+    def report(self):
+        """
+        Summarizes the cycle statistics.
+
+        Returns
+        -------
+        string
+            one line per statistic
+        """
+        if not self.durations:
+            return "No limit check finished yet.\n"
+        durations = sorted(self.durations)
+        drifts = sorted(self.drifts)
+        out = "Limit checks every {:g} s, deadline {:g} s:\n".format(self.period, self.deadline)
+        out += "{} cycles, {} failed, last {:.1f} s ago\n".format(
+            self.cycles, self.errors, time.time() - self.last_end
+        )
+        out += "Duration: median {:.0f} ms, p95 {:.0f} ms, max {:.0f} ms\n".format(
+            1000 * percentile(durations, 50),
+            1000 * percentile(durations, 95),
+            1000 * self.max_duration,
+        )
+        out += "Drift: median {:.0f} ms, p95 {:.0f} ms, max {:.0f} ms\n".format(
+            1000 * percentile(drifts, 50), 1000 * percentile(drifts, 95), 1000 * self.max_drift
+        )
+        out += "Overruns: {} ({} ticks skipped)\n".format(self.overruns, self.skipped_ticks)
+        return out
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+
+
+class SampleLog(object):
+    """
+    Append-only binary log of power samples with fixed-size records (timestamp, IP, current
+    and peak power in W).
+    The file is memory-mapped for reading, so lookups and reloads work directly on the
+    mapped pages without parsing text. Records are appended in chronological order, which
+    allows binary search by time.
+    """
+
+    MAGIC = b"ISCBOT\x00\x01"
+    HEADER_SIZE = 16
+    RECORD = struct.Struct("<dIii")
+
+    def __init__(self, path):
+        """
+        Opens or creates the log at `path`. A partial record left by a crash is cut off.
+        """
+        self.path = path
+        self.file = open(path, "ab")
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(self.MAGIC.ljust(self.HEADER_SIZE, b"\x00"))
+            self.file.flush()
+        else:
+            with open(path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError("{} is no sample log".format(path))
+            excess = (size - self.HEADER_SIZE) % self.RECORD.size
+            if excess:
+                self.file.truncate(size - excess)
+                self.file.seek(0, os.SEEK_END)
+        self.map = None
+
+    def close(self):
+        self.file.close()
+        self.map = None
+
+    def append(self, records):
+        """
+        Appends (timestamp, ip, current, peak) records and flushes them to the OS.
+        """
+        pack = self.RECORD.pack
+        self.file.write(b"".join([pack(*record) for record in records]))
+        self.file.flush()
+
+    def view(self):
+        """
+        Returns a memory map covering all complete records, remapping if the file grew.
+        """
+        size = self.HEADER_SIZE + len(self) * self.RECORD.size
+        if self.map is None or len(self.map) < size:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return self.map
+
+    def __len__(self):
+        return (self.file.tell() - self.HEADER_SIZE) // self.RECORD.size
+
+    def find(self, timestamp, right=False):
+        """
+        Returns the index of the first record not older than `timestamp` (newer than
+        `timestamp` if `right` is set).
+        """
+        view = self.view()
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self.RECORD.unpack_from(view, self.HEADER_SIZE + mid * self.RECORD.size)[0]
+            if t < timestamp or (right and t == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(self, since=None, until=None):
+        """
+        Iterates over all records with since <= timestamp < until in chronological order.
+
+        Returns
+        -------
+        iterator of (float, int, int, int)
+            timestamp, IP, current and peak power
+        """
+        start = 0 if since is None else self.find(since)
+        end = len(self) if until is None else self.find(until)
+        view = memoryview(self.view())
+        size = self.RECORD.size
+        return self.RECORD.iter_unpack(
+            view[self.HEADER_SIZE + start * size : self.HEADER_SIZE + end * size]
+        )
+
+    def records_before(self, timestamp, since):
+        """
+        Iterates backwards over all records with since <= timestamp' <= timestamp.
+        """
+        view = self.view()
+        for i in range(self.find(timestamp, right=True) - 1, -1, -1):
+            record = self.RECORD.unpack_from(view, self.HEADER_SIZE + i * self.RECORD.size)
+            if record[0] < since:
+                break
+            yield record
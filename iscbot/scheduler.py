@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import math
+
+
+class PollScheduler(object):
+    """
+    Assigns each PDU its own polling interval depending on how close its team is to the power
+    limit and how fast the team's power rises. PDUs of a team share the interval, so their
+    samples stay aligned. The total request rate is kept below `max_rate`.
+    """
+
+    # Check for due PDUs every `tick` seconds
+    tick = 0.25
+    # Intervals in seconds
+    min_interval = 0.5
+    # Shortest interval if traps report limit violations, polling is only a consistency sweep
+    sweep_interval = 2.0
+    max_interval = 15.0
+    default_interval = 2.0
+    # Headroom to the limit (fraction of LIMIT) at which the min and max intervals apply
+    near_headroom = 0.05
+    far_headroom = 0.5
+    # Poll at least this many times before a rising team reaches the limit
+    polls_to_limit = 4
+    # Maximum number of SNMP requests per second
+    max_rate = 50.0
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.intervals = {}
+        self.next_due = {}
+        self.tokens = self.max_rate
+        self.last_refill = 0.0
+
+    def interval(self, team, now):
+        """
+        Computes the polling interval of a team.
+
+        Returns
+        -------
+        float
+            interval in seconds
+        """
+        backend = self.backend
+        latest = backend.team_history[team].latest()
+        if latest is None or now - latest[0] > self.max_interval * 2:
+            return self.default_interval
+        power = latest[1]
+        headroom = (backend.LIMIT - power) / backend.LIMIT
+        if headroom <= self.near_headroom:
+            interval = self.min_interval
+        elif headroom >= self.far_headroom:
+            interval = self.max_interval
+        else:
+            # geometric interpolation between min and max interval
+            frac = (headroom - self.near_headroom) / (self.far_headroom - self.near_headroom)
+            interval = self.min_interval * (self.max_interval / self.min_interval) ** frac
+        fit = backend.team_history[team].trend(now - backend.trend_window)
+        if fit is not None and fit[0] > 0 and power < backend.LIMIT:
+            interval = min(interval, (backend.LIMIT - power) / fit[0] / self.polls_to_limit)
+        return max(self.min_interval, interval)
+
+    def update(self, ips, now):
+        """
+        Recomputes the intervals after the given PDUs were polled at `now` and schedules
+        their next poll. If the planned request rate exceeds `max_rate`, all intervals are
+        stretched by the same factor.
+        """
+        topology = self.backend.topology
+        for team in set(topology.ip_dict[ip] for ip in ips if ip in topology.ip_dict):
+            interval = self.interval(team, now)
+            for ip in topology.teams[team]:
+                self.intervals[ip] = interval
+        load = sum(1 / self.intervals.get(ip, self.default_interval) for ip in topology.ips)
+        stretch = max(1.0, load / self.max_rate)
+        for ip in ips:
+            self.next_due[ip] = now + self.intervals.get(ip, self.default_interval) * stretch
+
+    def due(self, now):
+        """
+        Returns the PDUs to poll now, most overdue first. Whole teams are returned together
+        and at most as many PDUs as the request budget allows.
+
+        Returns
+        -------
+        [int, ...]
+            IPs of the PDUs to poll
+        """
+        topology = self.backend.topology
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.tokens = min(self.max_rate, self.tokens + self.max_rate * elapsed)
+        overdue = sorted(
+            (self.next_due.get(ip, 0.0), ip)
+            for ip in topology.ips
+            if self.next_due.get(ip, 0.0) <= now
+        )
+        ips = []
+        for _, ip in overdue:
+            if ip in ips:
+                continue
+            team = list(topology.teams[topology.ip_dict[ip]])
+            if len(ips) + len(team) > math.floor(self.tokens) and ips:
+                break
+            ips.extend(team)
+        self.tokens -= len(ips)
+        return ips
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import asyncio
+import multiprocessing
+import sys
+
+from backend import SnmpClient, SnmpError, read_power
+
+
+def work(conn, timeout, retries, max_parallel, oids):
+    """
+    Entry point of a worker process: polls the PDUs it is sent with its own SNMP client and
+    event loop, until told to stop or the bot process goes away.
+    """
+    try:
+        asyncio.run(serve(conn, timeout, retries, max_parallel, oids))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve(conn, timeout, retries, max_parallel, oids):
+    loop = asyncio.get_running_loop()
+    snmp = SnmpClient(timeout=timeout, retries=retries)
+    limit = asyncio.Semaphore(max_parallel)
+    commands = asyncio.Queue()
+    polls = set()
+
+    def receive():
+        try:
+            while conn.poll():
+                commands.put_nowait(conn.recv())
+        except (EOFError, OSError):
+            commands.put_nowait(("stop",))
+
+    loop.add_reader(conn.fileno(), receive)
+    while True:
+        command = await commands.get()
+        if command[0] == "stop":
+            break
+        task = asyncio.ensure_future(poll(conn, snmp, limit, oids, *command[1:]))
+        polls.add(task)
+        task.add_done_callback(polls.discard)
+    loop.remove_reader(conn.fileno())
+    snmp.close()
+
+
+async def poll(conn, snmp, limit, oids, poll_id, pdus, timeout):
+    """
+    Reads the given PDUs concurrently and sends each reading as soon as it arrives. PDUs
+    without reading after `timeout` seconds are given up, those already queried are sent as
+    failed reads. Then the poll is marked done.
+    """
+    started = set()
+
+    async def read(ip, host, port, community):
+        async with limit:
+            started.add(ip)
+            try:
+                reading = await read_power(snmp, host, port, community, oids)
+            except (SnmpError, TypeError, ValueError, AttributeError):
+                reading = (None, None, None)
+        conn.send(("sample", poll_id, ip, reading))
+
+    tasks = [asyncio.ensure_future(read(*pdu)) for pdu in pdus]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for pdu, task in zip(pdus, tasks):
+            if task in pending:
+                task.cancel()
+                if pdu[0] in started:
+                    conn.send(("sample", poll_id, pdu[0], (None, None, None)))
+    conn.send(("done", poll_id))
+
+
+class PendingPoll(object):
+
+    __slots__ = ("readings", "shards", "future")
+
+    def __init__(self, shards, future):
+        self.readings = {}
+        self.shards = shards
+        self.future = future
+
+
+class ShardedPoller(object):
+    """
+    Polls PDUs in worker processes, each serving a shard of the fleet with its own SNMP
+    client, so the encoding, crypto and socket work of polling runs outside the event loop
+    of the bot. A poll sends every shard its PDUs; the workers stream back each reading as
+    it arrives over their pipe, which the event loop watches without blocking. A worker
+    that dies is started again on the next poll.
+    """
+
+    # seconds to wait for a worker beyond the deadline of a poll
+    grace = 1.0
+
+    def __init__(self, workers, timeout, retries, max_parallel, oids):
+        """
+        Parameters
+        ----------
+        workers : int
+            number of worker processes
+        timeout, retries : float, int
+            SNMP timeout and retries of the workers
+        max_parallel : int
+            PDUs queried at the same time per worker
+        oids : [string, ...]
+            OIDs of current power, peak power and peak timestamp
+        """
+        self.args = (timeout, retries, max_parallel, oids)
+        self.context = multiprocessing.get_context("spawn")
+        self.conns = [None] * workers
+        self.processes = [None] * workers
+        self.polls = {}
+        self.next_id = 0
+        self.loop = None
+        for shard in range(workers):
+            self.spawn(shard)
+
+    def spawn(self, shard):
+        old = self.conns[shard]
+        if old is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(old.fileno())
+            old.close()
+        conn, child = self.context.Pipe()
+        process = self.context.Process(
+            target=work, args=(child,) + self.args, name="poller-{}".format(shard), daemon=True
+        )
+        process.start()
+        child.close()
+        self.conns[shard] = conn
+        self.processes[shard] = process
+        if self.loop is not None:
+            self.loop.add_reader(conn.fileno(), self.receive, shard)
+
+    def shard(self, ip):
+        return ip % len(self.conns)
+
+    def receive(self, shard):
+        conn = self.conns[shard]
+        try:
+            while conn.poll():
+                message = conn.recv()
+                pending = self.polls.get(message[1])
+                if pending is None:
+                    continue
+                if message[0] == "sample":
+                    pending.readings[message[2]] = message[3]
+                else:
+                    self.finish(pending, shard)
+        except (EOFError, OSError):
+            print("Poller worker {} died.".format(shard), file=sys.stderr)
+            self.loop.remove_reader(conn.fileno())
+            conn.close()
+            self.conns[shard] = None
+            for pending in list(self.polls.values()):
+                self.finish(pending, shard)
+
+    def finish(self, pending, shard):
+        pending.shards.discard(shard)
+        if not pending.shards and not pending.future.done():
+            pending.future.set_result(None)
+
+    async def poll(self, pdus, deadline=None):
+        """
+        Reads the given PDUs in the workers.
+
+        Parameters
+        ----------
+        pdus : [(int, string, int, string), ...]
+            IP, host, port and community of each PDU
+        deadline : float
+            event loop time after which PDUs that have not answered are given up
+
+        Returns
+        -------
+        {int: (int, int, string)}
+            current power, peak power and peak timestamp for each IP that answered or
+            failed in time, None values if it could not be read
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            for shard, conn in enumerate(self.conns):
+                self.loop.add_reader(conn.fileno(), self.receive, shard)
+        parts = {}
+        for pdu in pdus:
+            parts.setdefault(self.shard(pdu[0]), []).append(pdu)
+        if not parts:
+            return {}
+        timeout = None if deadline is None else max(0.0, deadline - self.loop.time())
+        self.next_id += 1
+        poll_id = self.next_id
+        pending = self.polls[poll_id] = PendingPoll(set(parts), self.loop.create_future())
+        try:
+            for shard, part in parts.items():
+                if self.conns[shard] is None or not self.processes[shard].is_alive():
+                    self.spawn(shard)
+                self.conns[shard].send(("poll", poll_id, part, timeout))
+            wait = None if timeout is None else timeout + self.grace
+            await asyncio.wait_for(asyncio.shield(pending.future), wait)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            del self.polls[poll_id]
+        return pending.readings
+
+    def close(self):
+        for shard, conn in enumerate(self.conns):
+            if conn is None:
+                continue
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.remove_reader(conn.fileno())
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+            conn.close()
+            self.conns[shard] = None
+        for process in self.processes:
+            process.join(5)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+from backend import Backend
+from fakeagent import FakeAgent, apc_tables, apc_values
+from loads import OUTLETS
+
+
+def address(ip):
+    """
+    Loopback address of simulated PDU `ip`, which allows fleets of more than 254 PDUs.
+    """
+    return "127.1.{}.{}".format(ip // 256, ip % 256)
+
+
+# ---------Power curves---------#
+# A curve maps the seconds since the start of the simulation to a power in W.
+
+
+def constant(watts):
+    return lambda t: watts
+
+
+def step(before, after, at):
+    """
+    Jumps from `before` to `after` W at `at` seconds.
+    """
+    return lambda t: before if t < at else after
+
+
+def sine(mean, amplitude, period, phase=0.0):
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * (t + phase) / period)
+
+
+def piecewise(points):
+    """
+    Interpolates linearly between (seconds, W) points, constant before the first and after
+    the last point.
+    """
+    times = [t for t, _ in points]
+    values = [w for _, w in points]
+
+    def curve(t):
+        i = bisect_right(times, t)
+        if i == 0:
+            return values[0]
+        if i == len(times):
+            return values[-1]
+        frac = (t - times[i - 1]) / (times[i] - times[i - 1])
+        return values[i - 1] + frac * (values[i] - values[i - 1])
+
+    return curve
+
+
+class SimulatedPdu(FakeAgent):
+    """
+    Fake APC Rack PDU whose power follows a curve. The device tracks its peak power and the
+    time it was reached and resets it on a SET of `oid_peak_reset`, like the real one.
+    Responses can be delayed and requests dropped; a dead PDU does not answer at all. The
+    power is spread evenly over the outlets, each of them tracking its own peak.
+    """
+
+    # seconds between the points of the curve checked for a new peak
+    resolution = 0.1
+    max_steps = 1000
+
+    def __init__(
+        self,
+        curve,
+        latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        dead=False,
+        epoch=None,
+        users=None,
+        outlets=8,
+    ):
+        """
+        Parameters
+        ----------
+        curve : function
+            power in W over the seconds since `epoch`
+        latency : float
+            seconds every response is delayed
+        jitter : float
+            additional random delay of up to this many seconds
+        loss : float
+            probability of a request being dropped
+        dead : bool
+            drop all requests
+        epoch : float
+            start of the simulation, defaults to now
+        users : {string: (string, string)}
+            SNMPv3 users, needed for resets
+        outlets : int
+            number of metered outlets
+        """
+        super().__init__(apc_values(outlets=outlets), users=users)
+        self.outlets = outlets
+        self.curve = curve
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.dead = dead
+        self.epoch = time.time() if epoch is None else epoch
+        self.peak = 0
+        self.peak_time = self.epoch
+        self.updated = None
+
+    def power(self, now):
+        return max(0, int(self.curve(now - self.epoch)))
+
+    def update(self, now):
+        """
+        Advances the peak tracking to `now` and updates the OID table.
+        """
+        start = now if self.updated is None else self.updated
+        steps = min(int((now - start) / self.resolution), self.max_steps)
+        for t in [start + (i + 1) * self.resolution for i in range(steps)] + [now]:
+            watts = self.power(t)
+            if watts > self.peak:
+                self.peak, self.peak_time = watts, t
+        self.updated = now
+        for oid, value in apc_tables(self.power(now) // 10, self.outlets).items():
+            if oid.startswith(OUTLETS.oid + ".8."):
+                value = max(value, self.values[oid])
+            self.values[oid] = value
+        self.values[Backend.oid_peak] = self.peak // 10
+        self.values[Backend.oid_peak_timestamp] = datetime.fromtimestamp(self.peak_time).strftime(
+            "%m/%d/%Y %H:%M:%S"
+        )
+
+    def set_curve(self, curve):
+        self.update(time.time())
+        self.curve = curve
+
+    def datagram_received(self, data, addr):
+        if self.dead or random.random() < self.loss:
+            return
+        super().datagram_received(data, addr)
+
+    def handle(self, data):
+        self.update(time.time())
+        return super().handle(data)
+
+    def reply(self, response, addr):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, super().reply, response, addr)
+        else:
+            super().reply(response, addr)
+
+    def on_set(self, oid, value):
+        if oid == Backend.oid_peak_reset and value == Backend.oid_peak_reset_val:
+            now = time.time()
+            self.peak, self.peak_time = self.power(now), now
+            self.update(now)
+
+
+async def start_fleet(curves, port=1161, **options):
+    """
+    Starts one simulated PDU per curve.
+
+    Parameters
+    ----------
+    curves : {int: function}
+        power curve of each PDU, by IP
+    port : int
+        UDP port all PDUs listen on
+    options : dict
+        passed on to SimulatedPdu
+
+    Returns
+    -------
+    {int: SimulatedPdu}
+        the running PDUs
+    """
+    fleet = {}
+    for ip, curve in curves.items():
+        pdu = SimulatedPdu(curve, **options)
+        await pdu.start(address(ip), port)
+        fleet[ip] = pdu
+    return fleet
+
+
+async def serve(args):
+    """
+    Serves one simulated PDU per line of ips.csv, each following a random sine curve.
+    """
+    curves = {}
+    with open(args.ips, "r") as f:
+        for line in f:
+            ip = int(line.split(",")[0])
+            curves[ip] = sine(
+                random.randint(500, 2500), random.randint(0, 500), random.randint(60, 600)
+            )
+    fleet = await start_fleet(
+        curves,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        users={"apc": ("authpassphrase", "privpassphrase")},
+    )
+    for ip in random.sample(sorted(fleet), min(args.dead, len(fleet))):
+        fleet[ip].dead = True
+    print("Simulating {} PDUs on 127.1.x.x:{}".format(len(fleet), args.port))
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of APC Rack PDUs.")
+    parser.add_argument("ips", nargs="?", default="ips.csv", help="PDUs to simulate")
+    parser.add_argument("--port", type=int, default=1161)
+    parser.add_argument("--latency", type=float, default=0.0, help="response delay in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay in s")
+    parser.add_argument("--loss", type=float, default=0.0, help="request loss probability")
+    parser.add_argument("--dead", type=int, default=0, help="number of dead PDUs")
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight, further
+    callers with the same key wait for it and get its result instead of starting their own.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key, func, *args):
+        """
+        Awaits func(*args), or the call already in flight for `key`.
+
+        Parameters
+        ----------
+        key : hashable
+            identifies calls with the same result
+        func : coroutine function
+            the call to coalesce
+
+        Returns
+        -------
+        object
+            result of the call, shared by all callers
+        """
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self.calls.pop(key, None))
+        # A cancelled caller must not cancel the call for the others
+        return await asyncio.shield(future)
+
+
+class TokenBucket(object):
+
+    __slots__ = ("tokens", "last", "warned")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last = now
+        self.warned = False
+
+
+class RateLimiter(object):
+    """
+    Token bucket per key (e.g. chat or user ID). Each bucket holds up to `burst` tokens and
+    refills at `rate` tokens per second; every request takes one token.
+    """
+
+    # Buckets are dropped once they are full again and there are more than max_keys
+    max_keys = 1000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def allow(self, key, now=None):
+        """
+        Takes a token from the bucket of `key`.
+
+        Returns
+        -------
+        bool
+            True if the request is allowed
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.prune(now)
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.last) * self.rate)
+        bucket.last = now
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        bucket.warned = False
+        return True
+
+    def warn(self, key):
+        """
+        Returns True only for the first denied request of `key` since it was last allowed,
+        so a flooding chat gets told once instead of once per message.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
+
+    def prune(self, now):
+        full = self.burst / self.rate
+        for key in [k for k, b in self.buckets.items() if now - b.last >= full]:
+            del self.buckets[key]
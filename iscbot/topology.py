@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import ipaddress
+import os
+import zlib
+from types import MappingProxyType
+
+
+def pdu_id(address):
+    """
+    Returns the ID of a PDU by its address in ips.csv. PDUs given by the last octet of their
+    IP address keep it as ID, other IPv4 addresses are converted to their 32 bit value and
+    hostnames to their CRC-32. IDs thus fit the sample log and stay the same across reloads.
+
+    Returns
+    -------
+    (int, string)
+        ID and host, the host being None for a last octet
+    """
+    address = address.strip()
+    if address.isdigit():
+        return int(address), None
+    try:
+        return int(ipaddress.IPv4Address(address)), address
+    except ValueError:
+        pass
+    if not address or any(c.isspace() for c in address):
+        raise ValueError("Invalid PDU address: {!r}".format(address))
+    return zlib.crc32(address.lower().encode("utf-8")), address
+
+
+class Topology(object):
+    """
+    Immutable view of ips.csv and accesslist.conf with everything the hot paths need
+    precomputed: lookups by IP and team, the labels used in every reply, the access control
+    set and the reset keyboard. A changed configuration is loaded into a new object and
+    swapped in as a whole, so readers never see a half updated topology.
+    """
+
+    __slots__ = (
+        "ips",
+        "hosts",
+        "display",
+        "communities",
+        "users",
+        "ip_dict",
+        "teams",
+        "team_order",
+        "lngst_name",
+        "ip_lists",
+        "labels",
+        "padded_labels",
+        "group_id",
+        "access_list",
+        "access",
+        "keyboard",
+        "mtimes",
+    )
+
+    def __init__(self, pdus, chat_ids, keyboard=None, mtimes=None):
+        """
+        Parameters
+        ----------
+        pdus : [(int, string, string), ...]
+            ID, name and team of each PDU, optionally followed by its host (None for a last
+            octet), SNMP community and SNMPv3 user (None for the defaults)
+        chat_ids : [int, ...]
+            group ID followed by the IDs of all users with access
+        keyboard : function
+            builds the reset keyboard from the topology, optional
+        mtimes : (int, int)
+            modification times of the files the topology was read from
+        """
+        pdus = [tuple(pdu) + (None,) * (6 - len(pdu)) for pdu in pdus]
+        hosts = {ip: host for ip, _, _, host, _, _ in pdus}
+        display = {ip: host or str(ip) for ip, host in hosts.items()}
+        teams = {}
+        for ip, name, team, _, _, _ in pdus:
+            teams.setdefault(team, {})[ip] = name
+        lngst_name = max([len(team) for team in teams], default=0)
+        ip_lists = {team: ", ".join([display[ip] for ip in ips]) for team, ips in teams.items()}
+        init = object.__setattr__
+        init(self, "ips", tuple(pdu[0] for pdu in pdus))
+        init(self, "hosts", MappingProxyType(hosts))
+        init(self, "display", MappingProxyType(display))
+        init(self, "communities", MappingProxyType({pdu[0]: pdu[4] for pdu in pdus}))
+        init(self, "users", MappingProxyType({pdu[0]: pdu[5] for pdu in pdus}))
+        init(self, "ip_dict", MappingProxyType({pdu[0]: pdu[2] for pdu in pdus}))
+        init(
+            self,
+            "teams",
+            MappingProxyType({team: MappingProxyType(ips) for team, ips in teams.items()}),
+        )
+        init(self, "team_order", tuple(sorted(teams)))
+        init(self, "lngst_name", lngst_name)
+        init(self, "ip_lists", MappingProxyType(ip_lists))
+        init(
+            self,
+            "labels",
+            MappingProxyType({team: "{}({})".format(team, ips) for team, ips in ip_lists.items()}),
+        )
+        init(
+            self,
+            "padded_labels",
+            MappingProxyType(
+                {
+                    team: "{}({})".format(team.ljust(lngst_name), ips)
+                    for team, ips in ip_lists.items()
+                }
+            ),
+        )
+        init(self, "group_id", chat_ids[0] if chat_ids else 0)
+        init(self, "access_list", tuple(chat_ids[1:]))
+        init(self, "access", frozenset(chat_ids[1:]))
+        init(self, "mtimes", mtimes)
+        init(self, "keyboard", keyboard(self) if keyboard is not None else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Topology is immutable")
+
+    def allowed(self, user_id, chat_id):
+        """
+        Returns
+        -------
+        bool
+            True if the user is on the access list or writes in the group
+        """
+        return user_id in self.access or chat_id == self.group_id
+
+    @staticmethod
+    def modified(ips_path, access_path):
+        """
+        Returns
+        -------
+        (int, int)
+            modification times of both files in ns
+        """
+        return (os.stat(ips_path).st_mtime_ns, os.stat(access_path).st_mtime_ns)
+
+    @classmethod
+    def load(cls, ips_path="ips.csv", access_path="accesslist.conf", keyboard=None):
+        """
+        Reads both files and compiles them into a topology. Each line of ips.csv holds the
+        address of a PDU (the last octet of its IP address, a full IPv4 address or a
+        hostname), its name and team, and optionally the SNMP community and the SNMPv3 user
+        to use for it.
+
+        Raises
+        ------
+        OSError
+            if a file cannot be read
+        ValueError
+            if a line of ips.csv is malformed, a PDU is listed twice or the access list is
+            empty
+        """
+        mtimes = cls.modified(ips_path, access_path)
+        pdus = []
+        seen = set()
+        with open(ips_path, "r") as f:
+            for line in f:
+                fields = line.rstrip().split(",")
+                if not 3 <= len(fields) <= 5:
+                    raise ValueError("Malformed line in {}: {!r}".format(ips_path, line))
+                ip, host = pdu_id(fields[0])
+                if ip in seen:
+                    raise ValueError("PDU {} listed twice in {}".format(fields[0], ips_path))
+                seen.add(ip)
+                credentials = [field.strip() or None for field in fields[3:]]
+                pdus.append((ip, fields[1].strip(), fields[2], host, *credentials))
+        chat_ids = []
+        with open(access_path, "r") as f:
+            for line in f:
+                try:
+                    chat_ids.append(int(line.lstrip().split()[0]))
+                except (ValueError, IndexError):
+                    continue
+        # First item is group ID
+        if not chat_ids:
+            raise ValueError("{} contains no chat IDs".format(access_path))
+        return cls(pdus, chat_ids, keyboard, mtimes)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+
+from backend import (
+    INFORM_REQUEST,
+    RESPONSE,
+    TRAP_V1,
+    TRAP_V2,
+    SnmpError,
+    decode_integer,
+    decode_oid,
+    decode_pdu,
+    decode_sequence,
+    decode_tlv,
+    decode_varbinds,
+    encode_integer,
+    encode_sequence,
+)
+
+# snmpTrapOID.0, the second variable binding of every SNMPv2 trap
+OID_SNMP_TRAP = ".1.3.6.1.6.3.1.1.4.1.0"
+# Generic SNMPv1 traps (coldStart, ..., linkUp) as SNMPv2 trap OIDs
+OID_GENERIC_TRAPS = ".1.3.6.1.6.3.1.1.5."
+# Enterprise of all APC traps (PowerNet-MIB), including the Rack PDU load threshold traps
+OID_APC = ".1.3.6.1.4.1.318"
+
+
+def decode_trap(data):
+    """
+    Decodes an SNMPv1 trap, SNMPv2c trap or inform. SNMPv1 traps are translated to their
+    SNMPv2 trap OID as in RFC 3584.
+
+    Returns
+    -------
+    (int, bytes, int, int, string, string, [(string, object), ...])
+        version, community, PDU type, request ID (0 for SNMPv1), agent address from an
+        SNMPv1 trap (None otherwise), trap OID and the variable bindings
+    """
+    _, body, _ = decode_tlv(data)
+    items = decode_sequence(body)
+    version = decode_integer(items[0][1])
+    community = items[1][1]
+    pdu_type = items[2][0]
+    if pdu_type == TRAP_V1:
+        fields = decode_sequence(items[2][1])
+        enterprise = decode_oid(fields[0][1])
+        agent = ".".join(str(octet) for octet in fields[1][1])
+        generic = decode_integer(fields[2][1])
+        specific = decode_integer(fields[3][1])
+        if generic == 6:
+            trap_oid = "{}.0.{}".format(enterprise, specific)
+        else:
+            trap_oid = OID_GENERIC_TRAPS + str(generic + 1)
+        return version, community, pdu_type, 0, agent, trap_oid, decode_varbinds(fields[5][1])
+    if pdu_type not in (TRAP_V2, INFORM_REQUEST):
+        raise SnmpError("No trap PDU")
+    _, request_id, _, _, varbinds = decode_pdu(items[2][2])
+    trap_oid = dict(varbinds).get(OID_SNMP_TRAP)
+    if trap_oid is None:
+        raise SnmpError("Trap without snmpTrapOID")
+    return version, community, pdu_type, request_id, None, trap_oid, varbinds
+
+
+def acknowledge(data):
+    """
+    Returns the response to an inform, which repeats its request ID and variable bindings.
+    """
+    _, body, _ = decode_tlv(data)
+    version, community, pdu = decode_sequence(body)
+    request_id, _, _, varbinds = decode_sequence(pdu[1])
+    response = encode_sequence(
+        request_id[2], encode_integer(0), encode_integer(0), varbinds[2], tag=RESPONSE
+    )
+    return encode_sequence(version[2], community[2], response)
+
+
+class TrapReceiver(asyncio.DatagramProtocol):
+    """
+    Receives SNMPv1/v2c traps and informs and hands APC traps to `callback`. Informs are
+    acknowledged. SNMPv3 traps are not supported.
+    """
+
+    def __init__(self, callback, community="public"):
+        """
+        Parameters
+        ----------
+        callback : function
+            called with the sender's address, the trap OID and the variable bindings
+        community : string
+            accepted community
+        """
+        self.callback = callback
+        self.community = community.encode("utf-8")
+        self.transport = None
+
+    async def start(self, host="0.0.0.0", port=162):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+        print("Receiving traps on {}:{}".format(host, port))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            version, community, pdu_type, request_id, agent, trap_oid, varbinds = decode_trap(data)
+        except (SnmpError, ValueError, IndexError) as e:
+            print("Dropped trap from {}: {}".format(addr[0], e), file=sys.stderr)
+            return
+        if community != self.community:
+            return
+        if pdu_type == INFORM_REQUEST:
+            self.transport.sendto(acknowledge(data), addr)
+        if trap_oid.startswith(OID_APC + "."):
+            self.callback(agent if agent and agent != "0.0.0.0" else addr[0], trap_oid, varbinds)
@@ -0,0 +1,59 @@
+"""Backend and fake PDUs for the tests of the backend."""
+
+from backend import Backend
+from fakeagent import FakeAgent, apc_values
+
+USERS = {"apc": ("authpassphrase", "privpassphrase")}
+HOSTS = ["127.0.3.1", "127.0.3.2"]
+PORT = 1161
+# state the backend keeps in class level dictionaries, fresh for every test
+STATE = [
+    "health",
+    "pdu_history",
+    "team_history",
+    "peak_trackers",
+    "team_peaks",
+    "samples",
+    "loads",
+    "probes",
+    "team_warnings",
+    "reset_marks",
+]
+
+
+def make_backend(path):
+    """
+    Creates a backend for one team of two PDUs in `path`, which must be the working
+    directory.
+    """
+    with open(path / "ips.csv", "w") as f:
+        for i, host in enumerate(HOSTS):
+            f.write("{},PDU-{},Team-1\n".format(host, i + 1))
+    with open(path / "accesslist.conf", "w") as f:
+        f.write("0\n")
+    attrs = {name: {} for name in STATE}
+    attrs.update(snmp_port=PORT, skipped=set())
+    cls = type("LocalBackend", (Backend,), attrs)
+    return cls(auth_pass=USERS["apc"][0], priv_pass=USERS["apc"][1])
+
+
+async def start_agents():
+    agents = []
+    for host in HOSTS:
+        agent = FakeAgent(apc_values(100, 100), users=USERS)
+        await agent.start(host, PORT)
+        agents.append(agent)
+    return agents
+
+
+def set_power(agents, current, peak):
+    """Sets current and peak register of every PDU, in 10 W like on the device."""
+    for agent in agents:
+        agent.values[Backend.oid_current] = current
+        agent.values[Backend.oid_peak] = peak
+
+
+async def check(pdus):
+    pdus.scheduler.next_due.clear()
+    exceeders, _ = await pdus.check_exceedings()
+    return exceeders
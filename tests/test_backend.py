@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import time
+
+from fleet import HOSTS, check, make_backend, set_power, start_agents
+from loads import PHASES
+
+
+def test_reload_drops_readings_of_removed_pdus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            await pdus.refresh()
+            await pdus.refresh_loads(PHASES, pdus.ips)
+            removed = pdus.topology.ips[0]
+            pdus.skipped = {removed}
+            # The removed PDU has the oldest reading
+            pdus.samples[removed].time -= 3600
+            pdus.update_samples_time()
+            before = pdus.samples_time
+            with open("ips.csv", "w") as f:
+                f.write("{},PDU-2,Team-1\n".format(HOSTS[1]))
+            later = time.time() + 10
+            os.utime("ips.csv", (later, later))
+            assert await pdus.reload_topology()
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+        return pdus, removed, before
+
+    pdus, removed, before = asyncio.run(main())
+    assert removed not in pdus.samples
+    assert not any(ip == removed for _, ip in pdus.loads)
+    assert pdus.skipped == set()
+    assert pdus.samples_time == pdus.samples[pdus.topology.ips[0]].time > before + 3000
+
+
+def test_unresolved_hostnames_are_failed_reads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            with open("ips.csv", "w") as f:
+                f.write("{},PDU-1,Team-1\n".format(HOSTS[0]))
+                f.write("pdu.invalid,PDU-2,Team-1\n")
+            later = time.time() + 10
+            os.utime("ips.csv", (later, later))
+            assert await pdus.reload_topology()
+            return pdus, dict(await pdus.refresh())
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+
+    pdus, samples = asyncio.run(main())
+    known, unresolved = pdus.topology.ips
+    assert samples[known].ok
+    assert not samples[unresolved].ok
+    assert unresolved not in pdus.resolved
+
+
+def test_history_and_events_show_pdu_addresses(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            set_power(agents, 325, 325)
+            await check(pdus)
+            status = await pdus.reset_teams(["Team-1"])
+            return pdus.history("Team-1"), status
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+
+    history, status = asyncio.run(main())
+    assert set(status.values()) == {"done"}
+    for i, host in enumerate(HOSTS):
+        assert "PDU-{}({}): ".format(i + 1, host) in history
+    with open("events.jsonl") as f:
+        events = [json.loads(line) for line in f]
+    assert [event["event"] for event in events] == ["exceeding", "reset"]
+    assert all(event["ips"] == HOSTS for event in events)
+
+
+def test_peak_dates_skip_pdus_missing_from_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            samples = dict(await pdus.refresh())
+            # A worker that missed the grace period leaves its PDU out of the snapshot
+            del samples[pdus.topology.ips[1]]
+
+            async def snapshot():
+                return samples
+
+            pdus.snapshot = snapshot
+            return await pdus.peak_dates()
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+
+    out = asyncio.run(main())
+    assert "Team-1(127.0.3.1, 127.0.3.2): -1 W\n" in out
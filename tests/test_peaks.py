@@ -0,0 +1,73 @@
+import asyncio
+
+from fleet import check, make_backend, set_power, start_agents
+from history import PeakTracker
+
+
+def test_peak_tracker_reset_forgets_earlier_samples():
+    tracker = PeakTracker(600)
+    tracker.append(1.0, 6500)
+    tracker.reset(2.0)
+    assert tracker.since_start() is None
+    tracker.append(1.5, 7000)
+    assert tracker.since_start() is None
+    tracker.append(3.0, 2000)
+    assert tracker.since_start() == (3.0, 2000)
+    assert tracker.latest_window(3.0) == (1.5, 7000)
+
+
+def test_reset_does_not_carry_over_stale_readings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            set_power(agents, 325, 325)
+            first = await check(pdus)
+            # The team calms down, the operator resets the registers and the tracked peak
+            set_power(agents, 100, 100)
+            status = await pdus.reset_teams(["Team-1"])
+            after_reset = await check(pdus)
+            set_power(agents, 360, 360)
+            exceeding = await check(pdus)
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+        return first, status, after_reset, exceeding
+
+    first, status, after_reset, exceeding = asyncio.run(main())
+    assert first == ["Team-1(127.0.3.1, 127.0.3.2):\nAbove power limit (6500 W)!"]
+    assert set(status.values()) == {"done"}
+    assert after_reset == []
+    assert exceeding == ["Team-1(127.0.3.1, 127.0.3.2):\nAbove power limit (7200 W)!"]
+
+
+def test_readings_from_before_a_reset_are_ignored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        agents = await start_agents()
+        pdus = make_backend(tmp_path)
+        try:
+            set_power(agents, 100, 325)
+            polled = dict(await pdus.refresh())
+            pdus.reset_tracked("Team-1")
+            # A poll that started before the reset reports the old registers afterwards
+            stale = pdus.team_peak("Team-1", polled)
+            set_power(agents, 100, 100)
+            after_reset = await check(pdus)
+        finally:
+            await pdus.events.close()
+            pdus.close()
+            for agent in agents:
+                agent.close()
+        return polled, stale, after_reset, pdus.team_peaks["Team-1"]
+
+    polled, stale, after_reset, reported = asyncio.run(main())
+    assert sum(sample.peak for sample in polled.values()) == 6500
+    assert stale == -1
+    assert after_reset == []
+    assert reported == 0
@@ -0,0 +1,318 @@
+import asyncio
+
+import pytest
+
+import backend
+from backend import (
+    COUNTER32,
+    GAUGE32,
+    IP_ADDRESS,
+    NO_SUCH_OBJECT,
+    OBJECT_IDENTIFIER,
+    RESPONSE,
+    SET_REQUEST,
+    TIMETICKS,
+    Backend,
+    SnmpClient,
+    SnmpError,
+    SnmpTimeout,
+    UsmUser,
+    decode_integer,
+    decode_oid,
+    decode_pdu,
+    decode_tlv,
+    encode_integer,
+    encode_oid,
+    encode_pdu,
+    encode_scoped_pdu,
+    encode_tlv,
+    encode_v3_message,
+    read_power,
+)
+from fakeagent import FakeAgent, apc_tables, apc_values
+from loads import OUTLETS
+from metrics import Metrics
+
+USERS = {"apc": ("authpassphrase", "privpassphrase")}
+OIDS = [Backend.oid_current, Backend.oid_peak, Backend.oid_peak_timestamp]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def started(agent):
+    host, port = await agent.start("127.0.0.1", 0)
+    return host, port
+
+
+class DroppingAgent(FakeAgent):
+    """Drops the first `drop` requests."""
+
+    def __init__(self, *args, drop=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drop = drop
+
+    def datagram_received(self, data, addr):
+        if self.drop > 0:
+            self.drop -= 1
+            return
+        super().datagram_received(data, addr)
+
+
+class SpoofingAgent(FakeAgent):
+    """Answers every SNMPv3 request with a plaintext, unauthenticated response."""
+
+    def handle_v3(self, msg):
+        if msg.engine_id != self.engine_id:
+            return super().handle_v3(msg)
+        return encode_v3_message(
+            msg.msg_id,
+            0,
+            self.engine_id,
+            self.boots,
+            self.engine_time(),
+            msg.user,
+            encode_scoped_pdu(self.engine_id, encode_pdu(RESPONSE, 0, [])),
+        )
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 255, 256, -1, -128, -129, 2**31 - 1, -(2**31)])
+def test_integer_round_trip(value):
+    tag, data, end = decode_tlv(encode_integer(value))
+    assert decode_integer(data) == value
+    assert end == len(encode_integer(value))
+
+
+@pytest.mark.parametrize(
+    "oid",
+    [".1.3", ".1.3.6.1.4.1.318.1.1.26.6.3.1.7.1", ".2.999.3", ".1.3.6.1.4294967295.128.16383"],
+)
+def test_oid_round_trip(oid):
+    _, data, _ = decode_tlv(encode_oid(oid))
+    assert decode_oid(data) == oid
+
+
+def test_long_length_round_trip():
+    payload = bytes(range(256)) * 2
+    tag, data, end = decode_tlv(encode_tlv(0x04, payload))
+    assert (tag, data) == (0x04, payload)
+    assert end == len(payload) + 4
+
+
+def test_pdu_round_trip():
+    varbinds = [
+        (".1.3.6.1.2.1.1.1.0", b"Rack PDU"),
+        (".1.3.6.1.2.1.1.3.0", (TIMETICKS, 123456)),
+        (".1.3.6.1.2.1.2.2.1.10.1", (COUNTER32, 2**32 - 1)),
+        (".1.3.6.1.2.1.2.2.1.5.1", (GAUGE32, 1000000000)),
+        (".1.3.6.1.2.1.4.20.1.1.1", (IP_ADDRESS, "192.168.1.241")),
+        (".1.3.6.1.2.1.1.2.0", (OBJECT_IDENTIFIER, ".1.3.6.1.4.1.318")),
+        (".1.3.6.1.2.1.1.4.0", -42),
+        (".1.3.6.1.2.1.1.5.0", None),
+        (".1.3.6.1.2.1.1.6.0", (NO_SUCH_OBJECT, None)),
+    ]
+    pdu = decode_pdu(encode_pdu(RESPONSE, 4711, varbinds, 0, 0))
+    assert pdu[:4] == (RESPONSE, 4711, 0, 0)
+    assert pdu[4] == [
+        (".1.3.6.1.2.1.1.1.0", b"Rack PDU"),
+        (".1.3.6.1.2.1.1.3.0", 123456),
+        (".1.3.6.1.2.1.2.2.1.10.1", 2**32 - 1),
+        (".1.3.6.1.2.1.2.2.1.5.1", 1000000000),
+        (".1.3.6.1.2.1.4.20.1.1.1", "192.168.1.241"),
+        (".1.3.6.1.2.1.1.2.0", ".1.3.6.1.4.1.318"),
+        (".1.3.6.1.2.1.1.4.0", -42),
+        (".1.3.6.1.2.1.1.5.0", None),
+        (".1.3.6.1.2.1.1.6.0", None),
+    ]
+
+
+@pytest.mark.parametrize("data", [b"", b"\x30", b"\x30\x05\x02\x01", b"\x30\x84\xff\xff\xff\xff"])
+def test_truncated_ber(data):
+    with pytest.raises(SnmpError):
+        decode_tlv(data)
+
+
+def test_v2c_get_multiple_oids():
+    async def main():
+        agent = FakeAgent(apc_values(123, 456, "05/06/2024 07:08:09"))
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.5, retries=0)
+        try:
+            varbinds = await snmp.get(host, OIDS, "public", port)
+            reading = await read_power(snmp, host, port, "public", OIDS)
+            with pytest.raises(SnmpError):
+                await snmp.get(host, OIDS + [".1.3.6.1.4.1.318.9"], "public", port)
+        finally:
+            snmp.close()
+            agent.close()
+        return varbinds, reading, agent.requests
+
+    varbinds, reading, requests = run(main())
+    assert [oid for oid, _ in varbinds] == OIDS
+    assert reading == (1230, 4560, "05/06/2024 07:08:09")
+    assert requests == 3
+
+
+def test_v2c_wrong_community_times_out():
+    async def main():
+        agent = FakeAgent(apc_values())
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.05, retries=0)
+        try:
+            with pytest.raises(SnmpTimeout):
+                await snmp.get(host, OIDS, "private", port)
+        finally:
+            snmp.close()
+            agent.close()
+
+    run(main())
+
+
+def test_v3_discovery_set_and_key_cache(monkeypatch):
+    localized = []
+    password_to_key = backend.password_to_key
+
+    def counting(password, engine_id):
+        localized.append(password)
+        return password_to_key(password, engine_id)
+
+    async def main():
+        agent = FakeAgent(apc_values(), users=USERS)
+        host, port = await started(agent)
+        monkeypatch.setattr(backend, "password_to_key", counting)
+        snmp = SnmpClient(timeout=0.5, retries=0)
+        user = UsmUser("apc", *USERS["apc"])
+        try:
+            reset = [(Backend.oid_peak_reset, Backend.oid_peak_reset_val)]
+            await snmp.set(host, reset, user, port)
+            first = agent.requests
+            agent.values[Backend.oid_peak_reset] = 1
+            await snmp.set(host, reset, user, port)
+            second = agent.requests - first
+        finally:
+            snmp.close()
+            agent.close()
+        return agent, user, first, second
+
+    agent, user, first, second = run(main())
+    assert agent.values[Backend.oid_peak_reset] == Backend.oid_peak_reset_val
+    # discovery and SET, then the cached engine and keys need a single round-trip
+    assert (first, second) == (2, 1)
+    assert sorted(localized) == sorted(USERS["apc"])
+    assert list(user.keys) == [agent.engine_id]
+
+
+def test_v3_wrong_passphrase_gets_no_answer():
+    async def main():
+        agent = FakeAgent(apc_values(), users=USERS)
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.05, retries=0)
+        try:
+            with pytest.raises(SnmpTimeout):
+                await snmp.get(host, OIDS, UsmUser("apc", "wrongpassphrase"), port)
+        finally:
+            snmp.close()
+            agent.close()
+
+    run(main())
+
+
+def test_v3_rejects_unauthenticated_response():
+    async def main():
+        agent = SpoofingAgent(apc_values(), users=USERS)
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.5, retries=0)
+        try:
+            with pytest.raises(SnmpError, match="Unauthenticated"):
+                await snmp.set(
+                    host, [(Backend.oid_peak_reset, 2)], UsmUser("apc", *USERS["apc"]), port
+                )
+        finally:
+            snmp.close()
+            agent.close()
+
+    run(main())
+
+
+def test_walk_continues_truncated_getbulk():
+    async def main():
+        values = apc_values(outlets=0)
+        values.update(apc_tables(240, outlets=24))
+        agent = FakeAgent(values)
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.5, retries=0)
+        try:
+            walked = await snmp.walk(host, OUTLETS.column_oids(), "public", port, 25)
+        finally:
+            snmp.close()
+            agent.close()
+        return walked, agent.requests
+
+    walked, requests = run(main())
+    table = OUTLETS.parse(0.0, walked)
+    assert len(table) == 24
+    assert table.index == [str(outlet) for outlet in range(1, 25)]
+    assert table["name"][23] == "Outlet 24"
+    assert table.total("power") == 2400
+    # 24 rows of 3 columns do not fit into one response
+    assert requests == 2
+
+
+def test_timeout_and_retransmit():
+    async def main():
+        agent = DroppingAgent(apc_values(), drop=1)
+        host, port = await started(agent)
+        metrics = Metrics()
+        snmp = SnmpClient(timeout=0.1, retries=1, metrics=metrics)
+        try:
+            await snmp.get(host, OIDS, "public", port)
+            answered = agent.requests
+            agent.drop = 2
+            with pytest.raises(SnmpTimeout):
+                await snmp.get(host, OIDS, "public", port)
+        finally:
+            snmp.close()
+            agent.close()
+        return answered, metrics
+
+    answered, metrics = run(main())
+    assert answered == 1
+    assert metrics.snmp_retransmits == 2
+    assert metrics.snmp_timeouts == 1
+
+
+def test_malformed_packets_are_dropped(capsys):
+    async def main():
+        agent = FakeAgent(apc_values())
+        host, port = await started(agent)
+        snmp = SnmpClient(timeout=0.5, retries=0)
+        try:
+            await snmp.open()
+            client_port = snmp.transport.get_extra_info("sockname")[1]
+            loop = asyncio.get_running_loop()
+            noise, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, local_addr=("127.0.0.1", 0)
+            )
+            for garbage in [b"", b"\x30", b"\x30\x03\x02\x01", b"\xff" * 40]:
+                noise.sendto(garbage, ("127.0.0.1", client_port))
+                noise.sendto(garbage, (host, port))
+            noise.close()
+            await asyncio.sleep(0.05)
+            return await snmp.get(host, OIDS, "public", port)
+        finally:
+            snmp.close()
+            agent.close()
+
+    varbinds = run(main())
+    assert [oid for oid, _ in varbinds] == OIDS
+    err = capsys.readouterr().err
+    assert "Dropped malformed SNMP packet" in err
+    assert "Fake agent dropped request" in err
+
+
+def test_set_request_is_answered_with_its_varbinds():
+    agent = FakeAgent(apc_values())
+    response = decode_pdu(agent.process(decode_pdu(encode_pdu(SET_REQUEST, 7, [(".1.3.6", 5)]))))
+    assert response == (RESPONSE, 7, 0, 0, [(".1.3.6", 5)])
+    assert agent.values[".1.3.6"] == 5
@@ -0,0 +1,61 @@
+import asyncio
+
+from iscbot import ISCBot
+
+
+class Pdus(object):
+    teams = {"Team-1": {1: "PDU-1", 2: "PDU-2"}}
+
+    def team_of(self, host):
+        return "Team-1"
+
+
+def make_bot(check):
+    bot = object.__new__(ISCBot)
+    bot.pdus = Pdus()
+    bot.trap_checks = {}
+    bot.trap_pending = set()
+    bot.check = check
+    return bot
+
+
+def test_trap_during_a_check_checks_the_team_again():
+    async def main():
+        calls = []
+        polled = asyncio.Event()
+        release = asyncio.Event()
+
+        async def check(ips):
+            calls.append(ips)
+            polled.set()
+            await release.wait()
+
+        bot = make_bot(check)
+        bot.on_trap("127.0.3.1", "trap", [])
+        await polled.wait()
+        # Sent after the PDUs were polled, so the running check cannot have seen them
+        bot.on_trap("127.0.3.1", "trap", [])
+        bot.on_trap("127.0.3.2", "trap", [])
+        release.set()
+        while bot.trap_checks:
+            await asyncio.wait(list(bot.trap_checks.values()))
+        return calls
+
+    assert asyncio.run(main()) == [[1, 2], [1, 2]]
+
+
+def test_failed_trap_check_is_logged(capsys):
+    async def main():
+        async def check(ips):
+            raise RuntimeError("broken")
+
+        bot = make_bot(check)
+        bot.on_trap("127.0.3.1", "trap", [])
+        task = bot.trap_checks["Team-1"]
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+        return bot
+
+    bot = asyncio.run(main())
+    assert bot.trap_checks == {}
+    assert "Check of Team-1 after trap failed: RuntimeError('broken')" in capsys.readouterr().err